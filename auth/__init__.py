@@ -1 +1,10 @@
-from .auth import mainloop
+from helper import lazy_exports
+from .auth import mainloop, authenticate, register, save_rehashes
+
+# the async flows (and asyncio) are only imported when they are first used
+__getattr__ = lazy_exports(__name__, {
+    "authenticate_async": ".aio",
+    "register_async": ".aio",
+    "login_async": ".aio",
+    "sign_up_async": ".aio",
+})
@@ -0,0 +1,131 @@
+"""
+Async variants of the login and sign up flows (see ./auth/auth.py), for an
+AsyncDBConnection (see ./db/aio.py). They are kept apart so that the console
+application doesn't import asyncio on startup.
+"""
+
+import asyncio
+import functools
+import math
+from getpass import getpass
+from typing import Any, Awaitable, Callable
+
+import db
+from models.models import User
+from messages import Messages, Message
+from config import BCRYPT_COST
+from password.vault import session_keys, derive_key, new_salt
+from .auth import _pending_rehashes, _insert_user, save_rehashes, schedule_rehash, \
+    breached_password_message, init_vault
+from .hashing import get_hashing_service, HashingQueueFull
+from .ratelimit import get_login_limiter
+from .user_cache import get_user_cache
+
+
+# Asks the user for a value: prompt(text, secret) (secret values are not echoed)
+Prompt = Callable[[str, bool], Awaitable[str]]
+
+
+async def console_prompt(text: str, secret: bool = False) -> str:
+    """Prompt in the terminal, without blocking the event loop"""
+    return await asyncio.to_thread(getpass if secret else input, text)
+
+
+async def unlock_vault_async(conn: db.AsyncDBConnection, user: dict[str, Any], password: str) -> None:
+    """Same as unlock_vault, for an AsyncDBConnection"""
+    salt = user["kdf_salt"] or new_salt()
+    key = await asyncio.wrap_future(get_hashing_service().submit(derive_key, password, salt))
+    if user["kdf_salt"] is None:
+        await conn.run_sync(init_vault, user["user_id"], salt, key)
+        user["kdf_salt"] = salt
+    session_keys.put(user["user_id"], key)
+
+
+async def authenticate_async(conn: db.AsyncDBConnection, email: str, password: str,
+                             client: str = "local") -> Message:
+    """Same as authenticate, for an AsyncDBConnection. The queries and the bcrypt work run
+    outside the event loop, so one loop can check many logins at once."""
+    retry_after = get_login_limiter().check(email, client)
+    if retry_after is not None:
+        return Message(Messages.LOGIN_FAILURE, "Too many attempts. Please, try again in "
+                       + f"{math.ceil(retry_after)} seconds.")
+
+    if _pending_rehashes:
+        await conn.run_sync(save_rehashes)
+
+    user = await get_user_cache().get_by_email_async(conn, email)
+    service = get_hashing_service()
+
+    try:
+        if user is None:
+            hashed_pw = await asyncio.wrap_future(service.dummy_hash(BCRYPT_COST))
+            await service.validate_password_async(password, hashed_pw)
+            return Message(Messages.LOGIN_FAILURE, "Invalid credentials. Try Again.")
+
+        if not await service.validate_password_async(password, user["hashed_pw"]):
+            return Message(Messages.LOGIN_FAILURE, "Invalid credentials. Try Again.")
+
+        schedule_rehash(user, password)
+        await unlock_vault_async(conn, user, password)
+    except HashingQueueFull:
+        return Message(Messages.LOGIN_FAILURE, "The server is busy. Please, try again later.")
+
+    if _pending_rehashes:
+        await conn.run_sync(save_rehashes)
+
+    return Message(Messages.LOGIN_SUCCESS, user)
+
+
+async def register_async(conn: db.AsyncDBConnection, name: str, email: str, plain_pw: str,
+                         writer: "db.GroupCommitWriter | None" = None) -> Message:
+    """Same as register, for an AsyncDBConnection (the loop isn't blocked while the writer
+    commits the user)"""
+    if await get_user_cache().get_by_email_async(conn, email) is not None:
+        return Message(Messages.SIGN_UP_FAILURE, "Email is already registered. Please, try again.")
+
+    # the breach check reads the corpus file (and may open it on first use): off the event loop
+    if message := await asyncio.to_thread(breached_password_message, plain_pw):
+        return Message(Messages.SIGN_UP_FAILURE, message)
+
+    try:
+        hashed_pw = await get_hashing_service().hash_password_async(plain_pw)
+    except HashingQueueFull:
+        return Message(Messages.SIGN_UP_FAILURE, "The server is busy. Please, try again later.")
+
+    user = dict(name=name, email=email, hashed_pw=hashed_pw, kdf_salt=new_salt())
+
+    if not User.validate_data(user):
+        return Message(Messages.SIGN_UP_FAILURE, "Data entered is invalid. Please, try again.")
+
+    try:
+        if writer is None:
+            async with conn.transaction():
+                result = await conn.run_sync(_insert_user, user)
+        else:
+            get_user_cache().watch(writer)
+            result = await asyncio.wrap_future(writer.submit(functools.partial(_insert_user, user=user)))
+    except Exception:
+        return Message(Messages.SIGN_UP_FAILURE, "The user couldn't be saved. Please, try again.")
+
+    return Message(Messages.SIGN_UP_SUCCESS, result)
+
+
+async def login_async(conn: db.AsyncDBConnection, prompt: Prompt = console_prompt) -> Message:
+    """Same as login, asking for the credentials with 'prompt' (e.g. through the connection
+    of a client). The reason of a failure is returned as data instead of printed."""
+    email = await prompt(f"{'Enter your email: ':<25}", False)
+    password = await prompt(f"{'Enter your password: ':<25}", True)
+    return await authenticate_async(conn, email, password)
+
+
+async def sign_up_async(conn: db.AsyncDBConnection, prompt: Prompt = console_prompt) -> Message:
+    """Same as sign_up, asking for the data with 'prompt' (see login_async)"""
+    name = await prompt(f"{'Enter your name: ':<25}", False)
+    email = await prompt(f"{'Enter your email: ':<25}", False)
+    plain_pw = await prompt(f"{'Enter password: ':<25}", True)
+    confirm_pw = await prompt(f"{'Confirm password: ':<25}", True)
+
+    if plain_pw != confirm_pw:
+        return Message(Messages.SIGN_UP_FAILURE, "Passwords don't match. Please, try again.")
+
+    return await register_async(conn, name, email, plain_pw)
@@ -1,4 +1,7 @@
-import bcrypt
+import functools
+import math
+import threading
+from concurrent.futures import Future
 from getpass import getpass
 from typing import Any
 
@@ -7,15 +10,20 @@ from models.base import Table
 from models.models import User
 from helper import Option, index, choice
 from messages import Messages, Message
+from config import BCRYPT_COST
+from password.breach import times_breached
+from password.vault import VaultCipher, session_keys, derive_key, new_salt
+from .hashing import (hash_password, needs_rehash,
+                      get_hashing_service, HashingQueueFull)
+from .ratelimit import get_login_limiter
+from .user_cache import get_user_cache
 
 
-def validate_password(plain_pw: str, hashed_pw: str) -> bool:
-    return bcrypt.checkpw(plain_pw.encode("utf8"), hashed_pw.encode("utf8"))
-
-
-def hash_password(plain_pw: str) -> str:
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(plain_pw.encode("utf8"), salt).decode("utf8")
+# Rehashes of the passwords stored with an outdated bcrypt cost, by user id. They run in the
+# hashing workers after a successful login, and are saved by the next call to save_rehashes
+# (a connection can only be used from the thread that created it).
+_pending_rehashes: dict[int, Future[str]] = {}
+_pending_lock = threading.Lock()
 
 
 def params_exist(conn: db.DBConnection, table: Table, **params: dict[str, Any]) -> bool:
@@ -24,28 +32,221 @@ def params_exist(conn: db.DBConnection, table: Table, **params: dict[str, Any])
     return result != []
 
 
-def create_user_dict_from_tuple(user_id: int, name: str, email: str, hashed_pw: str):
+def create_user_dict_from_tuple(user_id: int, name: str, email: str, hashed_pw: str,
+                                kdf_salt: str | None = None):
     return dict(user_id=user_id, name=name,
-                email=email, hashed_pw=hashed_pw)
+                email=email, hashed_pw=hashed_pw, kdf_salt=kdf_salt)
+
+
+def unlock_vault(conn: db.DBConnection, user: dict[str, Any], password: str) -> None:
+    """Derive the vault key of the user from the master password and keep it in the
+    session cache, so that the vault entries can be encrypted and decrypted without
+    deriving the key again (see ./password/vault.py)."""
+    salt = user["kdf_salt"] or new_salt()
+    key = get_hashing_service().submit(derive_key, password, salt).result()
+    if user["kdf_salt"] is None:
+        init_vault(conn, user["user_id"], salt, key)
+        user["kdf_salt"] = salt
+    session_keys.put(user["user_id"], key)
+
+
+def init_vault(conn: db.DBConnection, user_id: int, salt: str, key: bytes) -> None:
+    """Save the salt of the vault key of a user created before the vault was encrypted (on
+    its first unlock), and encrypt the passwords that the user was given in plain text by the
+    migrations, in one transaction."""
+    # only needed once per legacy user, not worth loading password.password at startup
+    from password.password import encrypt_legacy_passwords
+
+    sql = conn.update_from_table_where(User, dict(user_id=user_id), dict(kdf_salt=salt))
+    with conn.transaction():
+        conn.execute(sql, (salt, user_id))
+        encrypt_legacy_passwords(conn, user_id, VaultCipher(key, user_id))
+
+
+def schedule_rehash(user: dict[str, Any], password: str, cost: int | None = None) -> bool:
+    """Rehash the password of the user in the background if it is hashed with a lower cost
+    than 'cost' (BCRYPT_COST by default).
+
+    Return:
+        True if a rehash was scheduled
+    """
+    cost = BCRYPT_COST if cost is None else cost
+    if not needs_rehash(user["hashed_pw"], cost):
+        return False
+
+    with _pending_lock:
+        if user["user_id"] in _pending_rehashes:
+            return False
+        try:
+            future = get_hashing_service().submit(hash_password, password, cost)
+        except HashingQueueFull:
+            # the hash is still valid, the rehash is retried on the next login
+            return False
+        _pending_rehashes[user["user_id"]] = future
+    return True
+
+
+def save_rehashes(conn: db.DBConnection, wait: bool = False) -> int:
+    """Write the finished rehashes to the database.
+
+    Args:
+        conn (db.DBConnection) : Connection used to update the users.
+        wait (bool) : If True, wait for the rehashes still running (e.g. before exiting).
+
+    Return:
+        The number of passwords updated
+    """
+    with _pending_lock:
+        finished = {user_id: future for user_id, future in _pending_rehashes.items()
+                    if wait or future.done()}
+        for user_id in finished:
+            del _pending_rehashes[user_id]
+
+    updated = 0
+    for user_id, future in finished.items():
+        try:
+            hashed_pw = future.result()
+        except Exception as e:
+            print(e)
+            continue
+        sql = conn.update_from_table_where(User, dict(user_id=user_id),
+                                           dict(hashed_pw=hashed_pw))
+        conn.execute(sql, (hashed_pw, user_id))
+        updated += 1
+
+    if updated:
+        conn.commit()
+    return updated
+
+
+def authenticate(conn: db.DBConnection, email: str, password: str,
+                 client: str = "local") -> Message:
+    """Check the credentials of a user (without prompting).
+
+    The attempts are rate limited by email and by client (see ./auth/ratelimit.py) before
+    the user is looked up, so the excess attempts are rejected without any bcrypt work.
+
+    Passwords hashed with an outdated bcrypt cost are rehashed in the background after
+    a successful check, so the login itself never pays for the new hash.
+
+    Args:
+        client (str) : Identity of the client making the attempt (e.g. its address).
+
+    Return:
+        A LOGIN_SUCCESS message with the user as data, or a LOGIN_FAILURE message
+        with the reason of the failure as data
+    """
+    retry_after = get_login_limiter().check(email, client)
+    if retry_after is not None:
+        return Message(Messages.LOGIN_FAILURE, "Too many attempts. Please, try again in "
+                       + f"{math.ceil(retry_after)} seconds.")
+
+    save_rehashes(conn)
+
+    # repeated logins are served by the cache, without querying the database
+    user = get_user_cache().get_by_email(conn, email)
+
+    if user is None:
+        # unknown email: check a dummy hash anyway, so the response takes as long as for
+        # a wrong password and doesn't reveal which emails are registered
+        service = get_hashing_service()
+        try:
+            service.validate_password(password, service.dummy_hash(BCRYPT_COST).result())
+        except HashingQueueFull:
+            return Message(Messages.LOGIN_FAILURE, "The server is busy. Please, try again later.")
+        return Message(Messages.LOGIN_FAILURE, "Invalid credentials. Try Again.")
+
+    try:
+        valid = get_hashing_service().validate_password(password, user["hashed_pw"])
+    except HashingQueueFull:
+        return Message(Messages.LOGIN_FAILURE, "The server is busy. Please, try again later.")
+
+    if not valid:
+        return Message(Messages.LOGIN_FAILURE, "Invalid credentials. Try Again.")
+
+    # the rehash runs in the workers while the vault key is derived
+    schedule_rehash(user, password)
+
+    try:
+        unlock_vault(conn, user, password)
+    except HashingQueueFull:
+        return Message(Messages.LOGIN_FAILURE, "The server is busy. Please, try again later.")
+
+    save_rehashes(conn)
+
+    return Message(Messages.LOGIN_SUCCESS, user)
 
 
 def login(conn: db.DBConnection) -> Message:
     print(f"\n{'  LOGIN  '::^50}\n")
+    # starts the workers (and the dummy hash) while the credentials are typed
+    get_hashing_service()
     email: str = input(f"{'Enter your email: ':<25}")
     password: str = getpass(f"{'Enter your password: ':<25}")
 
-    sql = conn.select_from_table_where(User, dict(email=email))
-    result: list[tuple[Any, ...]] = \
-        conn.execute(sql, parameters=(email,))
+    response = authenticate(conn, email, password)
+    if response.message == Messages.LOGIN_FAILURE:
+        print(response.data)
 
-    # unpack the first (and only) element of the list result
-    user = create_user_dict_from_tuple(*result[0])
+    return response
 
-    if not validate_password(password, user["hashed_pw"]):
-        print("Invalid credentials. Try Again.")
-        return Message(Messages.LOGIN_FAILURE, None)
 
-    return Message(Messages.LOGIN_SUCCESS, user)
+def breached_password_message(plain_pw: str) -> str | None:
+    """Return the reason to reject 'plain_pw' if it was seen in breaches (see password/breach.py)"""
+    seen = times_breached(plain_pw)
+    if seen:
+        return f"This password was seen {seen} times in data breaches. Please, choose another one."
+    return None
+
+
+def register(conn: db.DBConnection, name: str, email: str, plain_pw: str,
+             writer: "db.GroupCommitWriter | None" = None) -> Message:
+    """Create a new user (without prompting).
+
+    Args:
+        writer (GroupCommitWriter | None) : If given, the user is saved by the writer, committed
+            together with the users of the concurrent sign ups (see db/writer.py), instead of
+            in a transaction of 'conn'.
+
+    Return:
+        A SIGN_UP_SUCCESS message, or a SIGN_UP_FAILURE message with the reason
+        of the failure as data
+    """
+    if get_user_cache().get_by_email(conn, email) is not None:
+        return Message(Messages.SIGN_UP_FAILURE, "Email is already registered. Please, try again.")
+
+    if message := breached_password_message(plain_pw):
+        return Message(Messages.SIGN_UP_FAILURE, message)
+
+    try:
+        hashed_pw = get_hashing_service().hash_password(plain_pw)
+    except HashingQueueFull:
+        return Message(Messages.SIGN_UP_FAILURE, "The server is busy. Please, try again later.")
+
+    user = dict(name=name, email=email, hashed_pw=hashed_pw, kdf_salt=new_salt())
+
+    if not User.validate_data(user):
+        return Message(Messages.SIGN_UP_FAILURE, "Data entered is invalid. Please, try again.")
+
+    try:
+        if writer is None:
+            with conn.transaction():
+                result = _insert_user(conn, user)
+        else:
+            # the cache forgets the missing email when the writer saves the user
+            get_user_cache().watch(writer)
+            result = writer.run(functools.partial(_insert_user, user=user))
+    except Exception:
+        # e.g. the same email was registered by a concurrent sign up
+        return Message(Messages.SIGN_UP_FAILURE, "The user couldn't be saved. Please, try again.")
+
+    return Message(Messages.SIGN_UP_SUCCESS, result)
+
+
+def _insert_user(conn: db.DBConnection, user: dict[str, Any]) -> list[Any]:
+    """Insert 'user' with the statement built by 'conn' (so its write listeners see it)"""
+    values = tuple(user.get(column) for column in User.__compiled__.insert_columns)
+    return conn.execute(conn.insert_into_table(User), values)
 
 
 def sign_up(conn: db.DBConnection) -> Message:
@@ -55,31 +256,17 @@ def sign_up(conn: db.DBConnection) -> Message:
     plain_pw: str = getpass(f"{'Enter password: ':<25}")
     confirm_pw: str = getpass(f"{'Confirm password: ':<25}")
 
-    if params_exist(conn, User, email=email):
-        print("\nEmail is already registered. Please, try again.")
-        return Message(Messages.SIGN_UP_FAILURE, None)
-
     if plain_pw != confirm_pw:
         print("\nPasswords don't match. Please, try again.")
         return sign_up(conn)
 
-    hashed_pw = hash_password(plain_pw)
-
-    user = dict(name=name, email=email, hashed_pw=hashed_pw)
+    response = register(conn, name, email, plain_pw)
+    if response.message == Messages.SIGN_UP_FAILURE:
+        print(f"\n{response.data}")
+    else:
+        print(f"\nUser {name} saved successfully. Please, log in.\n")
 
-    if not User.validate_data(user):
-        print("\nData entered is invalid. Please, try again.")
-        return Message(Messages.SIGN_UP_FAILURE, None)
-
-    sql = conn.insert_into_table(User)
-    values = tuple(user.values())
-    result = conn.execute(sql, values)
-
-    conn.commit()
-
-    print(f"\nUser {user["name"]} saved successfully. Please, log in.\n")
-
-    return Message(Messages.SIGN_UP_SUCCESS, result)
+    return response
 
 
 def mainloop(conn: db.DBConnection) -> Message:
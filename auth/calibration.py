@@ -0,0 +1,109 @@
+"""
+Calibration of the bcrypt cost for this host.
+
+Every step of the cost doubles the time of a hash, so the calibration measures the costs from
+'min_cost' upwards and stops at the first one slower than the target. The chosen cost can be
+written to config.py (BCRYPT_COST), and the hashes stored with a lower cost are rehashed the
+next time their users log in (see ./auth/auth.py):
+
+    python -m auth.calibration --target-ms 250 --write
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+import config
+from config import BCRYPT_TARGET_MS, BCRYPT_MIN_COST, BCRYPT_MAX_COST
+from .hashing import hash_password
+
+
+def time_hash(cost: int, repeat: int = 3) -> float:
+    """Return the median time (in seconds) of hashing a password with 'cost'"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hash_password("calibration", cost)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate_cost(target_ms: float = BCRYPT_TARGET_MS, min_cost: int = BCRYPT_MIN_COST,
+                   max_cost: int = BCRYPT_MAX_COST,
+                   repeat: int = 3) -> tuple[int, dict[int, float]]:
+    """Find the highest bcrypt cost whose hash takes at most 'target_ms' milliseconds.
+
+    Args:
+        target_ms (float) : Latency target of one hash, in milliseconds.
+        min_cost (int) : Lowest cost accepted, returned even if it is slower than the target.
+        max_cost (int) : Highest cost accepted.
+        repeat (int) : Number of hashes measured for each cost.
+
+    Return:
+        The chosen cost and the median time (in seconds) measured for each cost
+    """
+    if not 4 <= min_cost <= max_cost <= 31:
+        raise ValueError("bcrypt costs should satisfy 4 <= min_cost <= max_cost <= 31")
+
+    target = target_ms / 1000
+    timings: dict[int, float] = {}
+    cost = min_cost
+    timings[cost] = time_hash(cost, repeat)
+
+    # the next cost takes about twice as long, don't measure it if it can't fit the target
+    while cost < max_cost and timings[cost] * 2 <= target * 1.1:
+        seconds = time_hash(cost + 1, repeat)
+        timings[cost + 1] = seconds
+        if seconds > target:
+            break
+        cost += 1
+
+    return cost, timings
+
+
+def save_cost(cost: int, path: str = config.__file__) -> None:
+    """Write 'cost' as BCRYPT_COST in the config file 'path'"""
+    with open(path) as f:
+        content = f.read()
+
+    content, count = re.subn(r"^BCRYPT_COST = .*$", f"BCRYPT_COST = {cost}", content,
+                             flags=re.MULTILINE)
+    if count != 1:
+        raise ValueError(f"BCRYPT_COST is not defined in {path}")
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Calibrate the bcrypt cost for this host")
+    parser.add_argument("--target-ms", type=float, default=BCRYPT_TARGET_MS,
+                        help="latency target of one hash, in milliseconds")
+    parser.add_argument("--min-cost", type=int, default=BCRYPT_MIN_COST)
+    parser.add_argument("--max-cost", type=int, default=BCRYPT_MAX_COST)
+    parser.add_argument("--write", action="store_true",
+                        help="save the chosen cost in config.py")
+    args = parser.parse_args(argv)
+
+    cost, timings = calibrate_cost(args.target_ms, args.min_cost, args.max_cost)
+    for measured, seconds in timings.items():
+        print(f"cost {measured:>2}: {seconds * 1000:>10.1f} ms")
+    print(f"\nChosen cost: {cost} (target {args.target_ms:.0f} ms)")
+
+    if timings[cost] * 1000 > args.target_ms:
+        print(f"Warning: the minimum cost {cost} is slower than the target.")
+
+    if args.write:
+        save_cost(cost)
+        print(f"BCRYPT_COST = {cost} written to {config.__file__}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
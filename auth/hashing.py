@@ -0,0 +1,187 @@
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Executor, Future
+from functools import partial
+from typing import Any, Callable
+
+from config import HASH_EXECUTOR, HASH_WORKERS, HASH_MAX_PENDING, BCRYPT_COST
+from metrics import LatencyRecorder
+
+
+# bcrypt, multiprocessing and asyncio are imported on first use, not on startup
+
+
+def validate_password(plain_pw: str, hashed_pw: str) -> bool:
+    import bcrypt
+    return bcrypt.checkpw(plain_pw.encode("utf8"), hashed_pw.encode("utf8"))
+
+
+def hash_password(plain_pw: str, rounds: int | None = None) -> str:
+    import bcrypt
+    salt = bcrypt.gensalt(BCRYPT_COST if rounds is None else rounds)
+    return bcrypt.hashpw(plain_pw.encode("utf8"), salt).decode("utf8")
+
+
+def hash_cost(hashed_pw: str) -> int:
+    """Return the bcrypt cost of 'hashed_pw' ('$2b$<cost>$<salt and hash>')"""
+    return int(hashed_pw.split("$")[2])
+
+
+def needs_rehash(hashed_pw: str, cost: int | None = None) -> bool:
+    """Return True if 'hashed_pw' was hashed with a lower cost than 'cost' (BCRYPT_COST by
+    default). Hashes with a higher cost are kept: lowering the cost would weaken them.
+    """
+    return hash_cost(hashed_pw) < (BCRYPT_COST if cost is None else cost)
+
+
+class HashingQueueFull(Exception):
+    """Raised when the hashing service already has the maximum number of pending jobs"""
+
+
+class HashingService:
+    """Runs bcrypt hashing and verification in a pool of workers so that many
+    authentications can be processed at once (across all cores) without blocking the caller's thread.
+
+    Args:
+        workers (int | None) : Number of workers. None uses the number of cpus.
+        max_pending (int) : Maximum number of jobs queued or running. New jobs are rejected
+            with HashingQueueFull when it is reached.
+        executor (str) : "process" to run bcrypt in a process pool or "thread" to run it in
+            a thread pool (bcrypt releases the GIL while hashing).
+    """
+
+    def __init__(self, workers: int | None = HASH_WORKERS,
+                 max_pending: int = HASH_MAX_PENDING,
+                 executor: str = HASH_EXECUTOR) -> None:
+        if max_pending <= 0:
+            raise ValueError("'max_pending' should be greater than zero")
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Unknown executor {executor!r}")
+        self.workers: int = workers or os.cpu_count() or 1
+        self.max_pending: int = max_pending
+        self.executor_kind: str = executor
+        self.latency = LatencyRecorder()
+
+        self.pending: int = 0
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+
+        self._executor: Executor | None = None
+        self._dummy_hashes: dict[int, Future[str]] = {}
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> Executor:
+        # the workers are only started when the first job is submitted
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+                if self.executor_kind == "process":
+                    self._executor = ProcessPoolExecutor(self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers,
+                                                        thread_name_prefix="hashing")
+            return self._executor
+
+    def submit[T](self, func: Callable[..., T], *args: Any) -> Future[T]:
+        """Submit 'func(*args)' to the workers.
+
+        Return:
+            The future of the job
+
+        Raises:
+            HashingQueueFull: If there are already 'max_pending' jobs queued or running.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingQueueFull(f"More than {self.max_pending} hashing jobs are pending")
+
+        start = time.perf_counter()
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.pending += 1
+            self.submitted += 1
+        future.add_done_callback(partial(self._on_done, start))
+        return future
+
+    def _on_done(self, start: float, future: Future) -> None:
+        self.latency.record(time.perf_counter() - start)
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+        self._slots.release()
+
+    def dummy_hash(self, cost: int | None = None) -> Future[str]:
+        """Return the future of a hash of a random password with 'cost' (BCRYPT_COST by
+        default), computed once per cost by the workers. It is checked when the email is
+        unknown, so unknown users cost the same bcrypt work as wrong passwords.
+
+        It is not a job of the service: it doesn't take a slot and isn't counted in stats.
+        """
+        cost = BCRYPT_COST if cost is None else cost
+        executor = self.executor
+        with self._lock:
+            future = self._dummy_hashes.get(cost)
+            # computed again if it failed
+            if future is None or future.done() and (future.cancelled() or future.exception()):
+                future = executor.submit(hash_password, secrets.token_hex(16), cost)
+                self._dummy_hashes[cost] = future
+        return future
+
+    def hash_password(self, plain_pw: str, rounds: int | None = None) -> str:
+        return self.submit(hash_password, plain_pw, rounds).result()
+
+    def validate_password(self, plain_pw: str, hashed_pw: str) -> bool:
+        return self.submit(validate_password, plain_pw, hashed_pw).result()
+
+    async def hash_password_async(self, plain_pw: str, rounds: int | None = None) -> str:
+        import asyncio
+        return await asyncio.wrap_future(self.submit(hash_password, plain_pw, rounds))
+
+    async def validate_password_async(self, plain_pw: str, hashed_pw: str) -> bool:
+        import asyncio
+        return await asyncio.wrap_future(self.submit(validate_password, plain_pw, hashed_pw))
+
+    def stats(self) -> dict[str, Any]:
+        """Return a snapshot of the queue depth, counters and latencies (in seconds)"""
+        with self._lock:
+            counters = dict(workers=self.workers, max_pending=self.max_pending,
+                            pending=self.pending, submitted=self.submitted,
+                            completed=self.completed, failed=self.failed,
+                            rejected=self.rejected)
+        return dict(counters, latency=self.latency.snapshot())
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+_service: HashingService | None = None
+_service_lock = threading.Lock()
+
+
+def get_hashing_service() -> HashingService:
+    """Return the hashing service shared by the application (created on first use)"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = HashingService()
+            # hashed in the background, so the first unknown email isn't slower to reject
+            _service.dummy_hash()
+        return _service
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from config import (LOGIN_EMAIL_BURST, LOGIN_EMAIL_RATE, LOGIN_CLIENT_BURST,
+                    LOGIN_CLIENT_RATE, LOGIN_LIMITER_MAX_KEYS)
+
+
+class RateLimiter:
+    """Token buckets by key: every key can spend 'burst' attempts at once, and gets
+    'rate' attempts back per second.
+
+    At most 'max_keys' buckets are kept. When a new key arrives and the limit is reached
+    the least recently used bucket is dropped, so the memory stays bounded whatever the
+    number of keys seen (e.g. during a credential stuffing attack).
+
+    Args:
+        burst (float) : Capacity of every bucket.
+        rate (float) : Tokens added to every bucket per second.
+        max_keys (int) : Maximum number of buckets kept.
+        clock (Callable[[], float]) : Returns the current time in seconds.
+    """
+
+    def __init__(self, burst: float, rate: float, max_keys: int = LOGIN_LIMITER_MAX_KEYS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if burst < 1 or rate <= 0 or max_keys <= 0:
+            raise ValueError("'burst' should be at least 1, 'rate' and 'max_keys' positive")
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self.clock = clock
+
+        self.allowed: int = 0
+        self.rejected: int = 0
+        self.evictions: int = 0
+
+        # key -> [tokens, time of the last update]
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refill(self, key: str, now: float) -> list[float]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(self, key: str) -> bool:
+        """Spend one token of the bucket of 'key'.
+
+        Return:
+            False if the bucket is empty (the attempt should be rejected)
+        """
+        with self._lock:
+            bucket = self._refill(key, self.clock())
+            if bucket[0] < 1:
+                self.rejected += 1
+                return False
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+
+    def retry_after(self, key: str) -> float:
+        """Return the seconds until the bucket of 'key' has a token again"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0.0
+            tokens = min(self.burst, bucket[0] + (self.clock() - bucket[1]) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return dict(keys=len(self._buckets), max_keys=self.max_keys,
+                        allowed=self.allowed, rejected=self.rejected,
+                        evictions=self.evictions)
+
+
+class LoginRateLimiter:
+    """Limits the login attempts by email (against brute force on one account) and by
+    client (against one client trying many accounts). It is checked before the user is
+    looked up, so the rejected attempts cost no database query and no bcrypt work.
+    """
+
+    def __init__(self, email_burst: float = LOGIN_EMAIL_BURST,
+                 email_rate: float = LOGIN_EMAIL_RATE,
+                 client_burst: float = LOGIN_CLIENT_BURST,
+                 client_rate: float = LOGIN_CLIENT_RATE,
+                 max_keys: int = LOGIN_LIMITER_MAX_KEYS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.by_email = RateLimiter(email_burst, email_rate, max_keys, clock)
+        self.by_client = RateLimiter(client_burst, client_rate, max_keys, clock)
+
+    def check(self, email: str, client: str) -> float | None:
+        """Record a login attempt.
+
+        Return:
+            None if the attempt is allowed, otherwise the seconds to wait before trying again
+        """
+        email = email.strip().lower()
+        if not self.by_client.acquire(client):
+            return self.by_client.retry_after(client)
+        if not self.by_email.acquire(email):
+            return self.by_email.retry_after(email)
+        return None
+
+    def stats(self) -> dict[str, Any]:
+        return dict(email=self.by_email.stats(), client=self.by_client.stats())
+
+
+_limiter: LoginRateLimiter | None = None
+_limiter_lock = threading.Lock()
+
+
+def get_login_limiter() -> LoginRateLimiter:
+    """Return the login rate limiter shared by the application (created on first use)"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = LoginRateLimiter()
+        return _limiter
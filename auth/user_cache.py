@@ -0,0 +1,200 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import db
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL
+from models.models import User
+
+
+class UserCache:
+    """Read-through cache of the user records, by email and by user id, in front of the
+    connections to one database.
+
+    Missing emails are cached too (for 'negative_ttl' seconds), so repeated logins and
+    sign up checks of the same email don't query the database either. The cache registers
+    itself as write listener of every connection it reads from, and forgets the users
+    written through the statements of the connection builders (see DBConnection.add_write_listener).
+    Writes made with other sql are only seen when the entries expire.
+
+    The users are kept as records of the users table (User.__record__, a tuple per user),
+    and handed out as new dictionaries, so callers can't change the cached entries.
+
+    Args:
+        maxsize (int) : Maximum number of entries (users and missing emails). When the cache
+            is full the least recently used entry is evicted.
+        ttl (float) : Seconds a user is kept.
+        negative_ttl (float) : Seconds a missing email is kept.
+        clock (Callable[[], float]) : Returns the current time in seconds.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL,
+                 negative_ttl: float = USER_CACHE_NEGATIVE_TTL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if maxsize <= 0:
+            raise ValueError("'maxsize' should be greater than zero")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        self.hits: int = 0
+        self.negative_hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+        self.evictions: int = 0
+
+        # ("email", email) or ("id", user_id) -> (user or None, expiration time)
+        self._entries: OrderedDict[Hashable, tuple[tuple | None, float]] = OrderedDict()
+        # bumped by every invalidation, so that a read that started before it isn't cached
+        self._generation: int = 0
+        self._connections: weakref.WeakSet = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def get_by_email(self, conn: db.DBConnection, email: str) -> dict[str, Any] | None:
+        """Return (a copy of) the user with 'email', or None if there is no such user"""
+        return self._get(conn, ("email", email), dict(email=email))
+
+    def get_by_id(self, conn: db.DBConnection, user_id: int) -> dict[str, Any] | None:
+        """Return (a copy of) the user with 'user_id', or None if there is no such user"""
+        return self._get(conn, ("id", user_id), dict(user_id=user_id))
+
+    async def get_by_email_async(self, conn: "db.AsyncDBConnection", email: str) -> dict[str, Any] | None:
+        """Same as get_by_email, reading through an AsyncDBConnection"""
+        return await self._get_async(conn, ("email", email), dict(email=email))
+
+    async def get_by_id_async(self, conn: "db.AsyncDBConnection", user_id: int) -> dict[str, Any] | None:
+        """Same as get_by_id, reading through an AsyncDBConnection"""
+        return await self._get_async(conn, ("id", user_id), dict(user_id=user_id))
+
+    def _get(self, conn: db.DBConnection, key: Hashable,
+             conditions: dict[str, Any]) -> dict[str, Any] | None:
+        found, user, generation = self._lookup(conn, key)
+        if found:
+            return user
+        sql = conn.select_from_table_where(User, conditions)
+        rows = conn.execute(sql, tuple(conditions.values()), row_type=User.__record__)
+        return self._store(key, rows[0] if rows else None, generation)
+
+    async def _get_async(self, conn: "db.AsyncDBConnection", key: Hashable,
+                         conditions: dict[str, Any]) -> dict[str, Any] | None:
+        found, user, generation = self._lookup(conn, key)
+        if found:
+            return user
+        sql = conn.select_from_table_where(User, conditions)
+        rows = await conn.execute(sql, tuple(conditions.values()), row_type=User.__record__)
+        return self._store(key, rows[0] if rows else None, generation)
+
+    def watch(self, source: "db.DBConnection | db.AsyncDBConnection | db.GroupCommitWriter") -> None:
+        """Forget the users written through 'source' (e.g. a GroupCommitWriter that writes
+        the users with a connection the cache doesn't read from)"""
+        with self._lock:
+            self._watch(source)
+
+    def _watch(self, source: "db.DBConnection | db.AsyncDBConnection | db.GroupCommitWriter") -> None:
+        if source not in self._connections:
+            source.add_write_listener(self.on_write)
+            self._connections.add(source)
+
+    def _lookup(self, conn: "db.DBConnection | db.AsyncDBConnection",
+                key: Hashable) -> tuple[bool, dict[str, Any] | None, int]:
+        """Return (True, user, _) if 'key' is cached, or (False, None, generation) if the user
+        has to be read (the generation is given back to _store)"""
+        with self._lock:
+            self._watch(conn)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                user, expires = entry
+                if self.clock() <= expires:
+                    self._entries.move_to_end(key)
+                    if user is None:
+                        self.negative_hits += 1
+                        return True, None, self._generation
+                    self.hits += 1
+                    return True, user._asdict(), self._generation
+                del self._entries[key]
+            self.misses += 1
+            return False, None, self._generation
+
+    def _store(self, key: Hashable, user: tuple | None, generation: int) -> dict[str, Any] | None:
+        with self._lock:
+            if generation == self._generation:
+                now = self.clock()
+                if user is None:
+                    self._put(key, None, now + self.negative_ttl)
+                else:
+                    self._put(("email", user.email), user, now + self.ttl)
+                    self._put(("id", user.user_id), user, now + self.ttl)
+        return None if user is None else user._asdict()
+
+    def _put(self, key: Hashable, user: tuple | None, expires: float) -> None:
+        self._entries[key] = (user, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _forget(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[0] is not None:
+            # forget the other key of the same user
+            user = entry[0]
+            self._entries.pop(("email", user.email), None)
+            self._entries.pop(("id", user.user_id), None)
+
+    def on_write(self, event: db.WriteEvent) -> None:
+        """Forget the users changed by 'event' (see DBConnection.add_write_listener)"""
+        if event.table is not User:
+            return
+        try:
+            with self._lock:
+                self._generation += 1
+                self.invalidations += 1
+                keys = event.keys
+                if event.operation == "insert":
+                    # a missing email may have been cached
+                    self._forget(("email", keys.get("email")))
+                elif event.operation == "bulk_insert" or not keys.keys() & {"user_id", "email"}:
+                    # the users written are unknown
+                    self._entries.clear()
+                else:
+                    if "user_id" in keys:
+                        self._forget(("id", keys["user_id"]))
+                    if "email" in keys:
+                        self._forget(("email", keys["email"]))
+                    if "email" in event.data:
+                        self._forget(("email", event.data["email"]))
+        except Exception:
+            # a stale user (e.g. its old hashed_pw) must not be served until it expires
+            self.clear()
+            raise
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """Return a snapshot of the cache counters"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return dict(size=len(self._entries), maxsize=self.maxsize, hits=self.hits,
+                        negative_hits=self.negative_hits, misses=self.misses,
+                        invalidations=self.invalidations, evictions=self.evictions,
+                        hit_ratio=(self.hits + self.negative_hits) / lookups if lookups else 0.0)
+
+
+_cache: UserCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache() -> UserCache:
+    """Return the user cache shared by the application (created on first use)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UserCache()
+        return _cache
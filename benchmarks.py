@@ -0,0 +1,372 @@
+"""
+Benchmark suite for the auth, model and DB layers.
+
+The benchmarks run against a temporary sqlite3 database and the results are written to a
+JSON file, so that runs can be compared against a saved baseline:
+
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --baseline baseline.json --threshold 0.25
+
+Every result reports the median time of one operation (p50, in seconds) or, for the bulk
+operations, the rows per second: those are the values compared against the baseline. The
+command exits with status 1 if any benchmark is slower than its baseline by more than
+'threshold' (a fraction, 0.25 = 25%).
+
+Use --sizes to choose the number of rows of the vault (default 1000,100000,1000000) and
+--costs to choose the bcrypt costs.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from auth import authenticate, register
+from auth.auth import params_exist
+from auth.hashing import get_hashing_service, hash_password, validate_password
+from config import SEARCH_PAGE_SIZE
+from db.db import SQLiteDBConnection
+from db.memory import MemoryDBConnection
+from db.writer import GroupCommitWriter, group_commit_enabled
+from db.query import Query
+from db.migrations import migrate
+from models.migrations import MIGRATIONS
+from models.models import MODELS, User, Password
+from password.breach import BreachChecker, convert
+from password.search import match_expression
+
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_COSTS = (4, 8, 10, 12)
+
+
+def measure(func: Callable[[], Any], repeat: int = 5, number: int = 1) -> dict[str, Any]:
+    """Run 'func' 'number' times in each of 'repeat' rounds and return the statistics of the
+    time per call (in seconds)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+
+    p50 = statistics.median(timings)
+    return dict(repeat=repeat, number=number, min=min(timings),
+                mean=statistics.fmean(timings), p50=p50,
+                ops_per_sec=1 / p50 if p50 > 0 else None)
+
+
+def allocated(func: Callable[[], Any]) -> int:
+    """Return the memory (in bytes) still held by the result of 'func'"""
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_sql_builders(conn: SQLiteDBConnection) -> dict[str, Any]:
+    conditions = dict(email="eduardo@mail.com")
+    data = dict(name="Eduardo", email="eduardo@mail.com", hashed_pw="hash")
+    return {
+        "sql.insert_into_table": measure(lambda: conn.insert_into_table(User), number=10_000),
+        "sql.select_from_table_where": measure(
+            lambda: conn.select_from_table_where(User, conditions), number=10_000),
+        "sql.update_from_table_where": measure(
+            lambda: conn.update_from_table_where(User, conditions, data), number=10_000),
+        "sql.delete_from_table_where": measure(
+            lambda: conn.delete_from_table_where(User, conditions), number=10_000),
+    }
+
+
+def bench_validation() -> dict[str, Any]:
+    data = dict(name="Eduardo", email="eduardo@mail.com", hashed_pw="hash")
+    rows = [data] * 1_000
+    return {
+        "models.validate_data": measure(lambda: User.validate_data(data), number=10_000),
+        "models.validate_many[1000]": measure(lambda: User.validate_many(rows), number=10),
+    }
+
+
+def bench_bcrypt(costs: tuple[int, ...]) -> dict[str, Any]:
+    results = {}
+    for cost in costs:
+        hashed_pw = hash_password("secret", cost)
+        results[f"bcrypt.hash_password[cost={cost}]"] = measure(
+            lambda: hash_password("secret", cost), repeat=3)
+        results[f"bcrypt.validate_password[cost={cost}]"] = measure(
+            lambda: validate_password("secret", hashed_pw), repeat=3)
+    return results
+
+
+def bench_auth(conn: SQLiteDBConnection) -> dict[str, Any]:
+    counter = iter(range(1_000_000))
+    register(conn, "Bench", "bench@mail.com", "secret")
+
+    return {
+        "auth.sign_up": measure(
+            lambda: register(conn, "Bench", f"bench{next(counter)}@mail.com", "secret"), repeat=3),
+        "auth.login": measure(lambda: authenticate(conn, "bench@mail.com", "secret"), repeat=3),
+        "auth.params_exist": measure(
+            lambda: params_exist(conn, User, email="bench@mail.com"), number=1_000),
+    }
+
+
+def bench_vault(conn: SQLiteDBConnection, sizes: tuple[int, ...]) -> dict[str, Any]:
+    results = {}
+    user_id = conn.execute(conn.select_from_table_where(User, dict(email="bench@mail.com")),
+                           ("bench@mail.com",))[0][0]
+    list_sql = conn.select_from_table_where(Password, dict(user_id=user_id))
+    lookup_sql = conn.select_from_table_where(Password, dict(user_id=user_id, app_url=None))
+    search_sql = conn.search_table(Password, dict(user_id=user_id))
+    page_query = (Query(Password).select("app_name", "app_url", "username", "password")
+                  .where(user_id=user_id).order_by("app_url").limit(50))
+
+    filled = 0
+    for size in sorted(sizes):
+        rows = (dict(user_id=user_id, app_name=f"app{i}", app_url=f"https://app{i}.com",
+                     username=f"user{i}", password="secret")
+                for i in range(filled, size))
+        fill = conn.bulk_insert(Password, rows)
+        filled = size
+        results[f"vault.bulk_insert[{size}]"] = dict(
+            rows=fill.rows, seconds=fill.seconds, rows_per_second=fill.rows_per_second)
+
+        results[f"vault.list[{size}]"] = measure(
+            lambda: sum(1 for _ in conn.iter_query(list_sql, (user_id,))),
+            repeat=3 if size <= 100_000 else 1)
+        url = f"https://app{size // 2}.com"
+        results[f"vault.lookup[{size}]"] = measure(
+            lambda: conn.execute(lookup_sql, (user_id, url)), number=1_000)
+        # keyset pagination: the last page costs the same as the first one
+        for position in (0, size - 50):
+            page = page_query.after((f"https://app{position}.com",)).build()
+            results[f"vault.page[{size},{position}]"] = measure(
+                lambda: conn.execute(*page), number=100)
+        if size <= 100_000:
+            # memory of a materialized listing, by shape of the rows
+            columns = Password.__compiled__.column_names
+            shapes = dict(
+                tuple=lambda: conn.execute(list_sql, (user_id,)),
+                dict=lambda: [dict(zip(columns, row)) for row in conn.execute(list_sql, (user_id,))],
+                record=lambda: conn.execute(list_sql, (user_id,), row_type=Password.__record__),
+                columns=lambda: conn.fetch_columns(list_sql, (user_id,)))
+            for shape, read in shapes.items():
+                result = measure(read, repeat=3)
+                result["bytes_per_row"] = allocated(read) / size
+                results[f"vault.rows[{size},{shape}]"] = result
+        for query in ("ap", f"app{size // 3}"):
+            parameters = (match_expression(query), user_id, SEARCH_PAGE_SIZE, 0)
+            results[f"vault.search[{size},{query}]"] = measure(
+                lambda: conn.execute(search_sql, parameters), number=10)
+
+    return results
+
+
+def bench_memory(sizes: tuple[int, ...]) -> dict[str, Any]:
+    """The vault benchmarks that the in-memory engine supports (see db/memory.py)"""
+    results = {}
+    conn = MemoryDBConnection()
+    conn.connect()
+    for model in MODELS:
+        for sql in [conn.create_table(model), *conn.create_indexes(model),
+                    *conn.create_search_index(model)]:
+            conn.execute(sql)
+    conn.execute(conn.insert_into_table(User), ("Bench", "bench@mail.com", "hash", None))
+    conn.commit()
+    list_sql = conn.select_from_table_where(Password, dict(user_id=1))
+    lookup_sql = conn.select_from_table_where(Password, dict(user_id=1, app_url=None))
+    search_sql = conn.search_table(Password, dict(user_id=1))
+
+    filled = 0
+    for size in sorted(sizes):
+        rows = (dict(user_id=1, app_name=f"app{i}", app_url=f"https://app{i}.com",
+                     username=f"user{i}", password="secret")
+                for i in range(filled, size))
+        fill = conn.bulk_insert(Password, rows)
+        filled = size
+        results[f"memory.bulk_insert[{size}]"] = dict(
+            rows=fill.rows, seconds=fill.seconds, rows_per_second=fill.rows_per_second)
+
+        results[f"memory.list[{size}]"] = measure(
+            lambda: sum(1 for _ in conn.iter_query(list_sql, (1,))),
+            repeat=3 if size <= 100_000 else 1)
+        url = f"https://app{size // 2}.com"
+        results[f"memory.lookup[{size}]"] = measure(
+            lambda: conn.execute(lookup_sql, (1, url)), number=1_000)
+        parameters = (match_expression(f"app{size // 3}"), 1, SEARCH_PAGE_SIZE, 0)
+        results[f"memory.search[{size},app{size // 3}]"] = measure(
+            lambda: conn.execute(search_sql, parameters), repeat=3)
+
+    conn.close_connection()
+    return results
+
+
+def bench_group_commit(url: str, profiles: tuple[str, ...] = ("durable", "balanced"),
+                       count: int = 2_000, threads: int = 16) -> dict[str, Any]:
+    """A burst of single user inserts by concurrent callers (sign ups without bcrypt), each
+    committed on its own and committed together by the group commit writer (see db/writer.py),
+    with every sqlite3 profile of 'profiles'. The results of the writer record whether the
+    service uses it with that profile (see group_commit_enabled): without an fsync per commit
+    committing each insert is usually faster."""
+    results = {}
+
+    def insert(conn: SQLiteDBConnection, email: str) -> list[Any]:
+        return conn.execute(conn.insert_into_table(User), ("Burst", email, "hash", None))
+
+    def burst(name: str, write: Callable[[int], Any]) -> dict[str, Any]:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(write, range(count)))
+        seconds = time.perf_counter() - start
+        results[name] = dict(rows=count, seconds=seconds, rows_per_second=count / seconds)
+        return results[name]
+
+    for profile in profiles:
+        local = threading.local()
+        connections = []
+
+        def commit_each(i: int) -> None:
+            if not hasattr(local, "conn"):
+                local.conn = SQLiteDBConnection(url, check_same_thread=False, profile=profile)
+                local.conn.connect()
+                connections.append(local.conn)
+            with local.conn.transaction():
+                insert(local.conn, f"{profile}.each{i}@mail.com")
+
+        each = burst(f"db.commit_each[{profile},{threads} threads]", commit_each)
+        for conn in connections:
+            conn.close_connection()
+        with GroupCommitWriter(lambda: SQLiteDBConnection(url, profile=profile)) as writer:
+            grouped = burst(f"db.group_commit[{profile},{threads} threads]", lambda i: writer.run(
+                lambda conn: insert(conn, f"{profile}.group{i}@mail.com")))
+        grouped["enabled"] = group_commit_enabled(profile)
+        grouped["speedup"] = grouped["rows_per_second"] / each["rows_per_second"]
+    return results
+
+
+def bench_breach(tmp: str, sizes: tuple[int, ...]) -> dict[str, Any]:
+    """Conversion of a corpus of random SHA-1 hashes and lookups in it (see password/breach.py)"""
+    results = {}
+    for size in sorted(sizes):
+        path = os.path.join(tmp, f"breached{size}.bin")
+        start = time.perf_counter()
+        convert((f"{os.urandom(20).hex().upper()}:1" for _ in range(size)), path)
+        seconds = time.perf_counter() - start
+        results[f"breach.convert[{size}]"] = dict(rows=size, seconds=seconds,
+                                                  rows_per_second=size / seconds)
+        with BreachChecker(path) as checker:
+            results[f"breach.check[{size}]"] = measure(
+                lambda: checker.times_breached("correct horse battery staple"), number=1_000)
+        os.unlink(path)
+    return results
+
+
+def run(sizes: tuple[int, ...], costs: tuple[int, ...]) -> dict[str, Any]:
+    """Run all the benchmarks and return the results with the metadata of the run"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = SQLiteDBConnection(os.path.join(tmp, "bench.db"))
+        conn.connect()
+        migrate(conn, MODELS, MIGRATIONS)
+
+        results.update(bench_sql_builders(conn))
+        results.update(bench_validation())
+        results.update(bench_bcrypt(costs))
+        results.update(bench_auth(conn))
+        results.update(bench_vault(conn, sizes))
+        results.update(bench_memory(sizes))
+        results.update(bench_group_commit(os.path.join(tmp, "bench.db")))
+        results.update(bench_breach(tmp, sizes))
+
+        conn.close_connection()
+    get_hashing_service().shutdown()
+
+    return dict(
+        meta=dict(timestamp=time.time(), python=platform.python_version(),
+                  sqlite=sqlite3.sqlite_version, platform=platform.platform(),
+                  sizes=list(sizes), costs=list(costs)),
+        results=results,
+    )
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    """Return a description of every benchmark of 'current' whose p50 is slower than the
+    one in 'baseline' by more than 'threshold' (a fraction), or whose rows_per_second is
+    lower by more than 'threshold'"""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        if "p50" in result and "p50" in base:
+            if result["p50"] > base["p50"] * (1 + threshold):
+                regressions.append(f"{name}: {base['p50']:.3g}s -> {result['p50']:.3g}s "
+                                   + f"(+{result['p50'] / base['p50'] - 1:.0%})")
+        elif "rows_per_second" in result and "rows_per_second" in base:
+            before, after = base["rows_per_second"], result["rows_per_second"]
+            if after < before * (1 - threshold):
+                regressions.append(f"{name}: {before:.0f} rows/s -> {after:.0f} rows/s "
+                                   + f"({after / before - 1:.0%})")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the auth, model and DB layers")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated number of rows of the vault")
+    parser.add_argument("--costs", default=",".join(map(str, DEFAULT_COSTS)),
+                        help="comma separated bcrypt costs")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="file where the results are written")
+    parser.add_argument("--baseline", help="results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown (or throughput loss) against the baseline (fraction)")
+    args = parser.parse_args(argv)
+
+    sizes = tuple(int(size) for size in args.sizes.split(","))
+    costs = tuple(int(cost) for cost in args.costs.split(","))
+    current = run(sizes, costs)
+
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+
+    for name, result in current["results"].items():
+        if "p50" in result:
+            print(f"{name:<45} {result['p50'] * 1e6:>14.1f} us")
+        elif "speedup" in result:
+            print(f"{name:<45} {result['rows_per_second']:>14.0f} rows/s "
+                  + f"(x{result['speedup']:.2f} vs commit each, "
+                  + f"{'used' if result['enabled'] else 'not used'} by the service)")
+        else:
+            print(f"{name:<45} {result['rows_per_second']:>14.0f} rows/s")
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
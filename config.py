@@ -1,5 +1,115 @@
-# DATABASE engine to use: "sqlite3", ...
+# DATABASE engine to use: "sqlite3" or "memory" (see db/memory.py: nothing is persisted)
 DB_ENGINE = "sqlite3"
 
 # DATABASE URL
 DATABASE_URL = "password.db"
+
+# Maximum number of sql statements memoized by each DB connection
+STATEMENT_CACHE_SIZE = 256
+
+# Size of the sqlite3 prepared statements cache (sqlite3 default is 128)
+SQLITE_CACHED_STATEMENTS = 512
+
+# Number of rows sent to the database in each executemany call by bulk_insert
+BULK_INSERT_BATCH_SIZE = 1000
+
+# Connection pool: maximum number of connections, seconds to wait for a free
+# connection and seconds after which a connection is recycled (None = never)
+POOL_SIZE = 8
+POOL_TIMEOUT = 5.0
+POOL_MAX_LIFETIME = 3600.0
+
+# Password hashing workers: "process" or "thread" pool, number of workers
+# (None = number of cpus) and maximum number of queued hashing jobs
+HASH_EXECUTOR = "process"
+HASH_WORKERS = None
+HASH_MAX_PENDING = 256
+
+# Number of rows fetched at once when streaming query results
+FETCH_CHUNK_SIZE = 500
+
+# SQLITE performance profile: "durable", "balanced" or "throughput" (see db/profiles.py)
+SQLITE_PROFILE = "balanced"
+
+# Number of rows copied at once when a migration rebuilds a table
+MIGRATION_BATCH_SIZE = 10000
+
+# user_id given to the passwords saved before the vault was per user (migration 1). None
+# gives them to the only user of the database, and the migration fails if there are several
+LEGACY_PASSWORDS_OWNER = None
+
+# Query instrumentation: per statement counts, latencies and errors (see
+# db/instrumentation.py). Statements slower than SLOW_QUERY_MS milliseconds are
+# written to SLOW_QUERY_LOG (None = logging only; SLOW_QUERY_MS None or 0 = no log)
+QUERY_INSTRUMENTATION = False
+SLOW_QUERY_MS = 100.0
+SLOW_QUERY_LOG = "slow_queries.log"
+
+# Vault encryption: seconds the key of a logged in user is kept in memory and
+# log2 of the scrypt cost used to derive it from the master password
+VAULT_KEY_TTL = 900.0
+VAULT_KDF_COST = 14
+
+# bcrypt cost of new password hashes. Written by the calibration (python -m auth.calibration
+# --write) as the highest cost whose hash takes at most BCRYPT_TARGET_MS milliseconds on this
+# host, never below BCRYPT_MIN_COST. Hashes stored with another cost are rehashed on login
+BCRYPT_COST = 12
+BCRYPT_TARGET_MS = 250.0
+BCRYPT_MIN_COST = 10
+BCRYPT_MAX_COST = 16
+
+# Login rate limits (token buckets): attempts allowed at once (burst) and attempts
+# refilled per second, by email and by client, and maximum number of emails and
+# clients tracked (the least recently seen are forgotten first)
+LOGIN_EMAIL_BURST = 5
+LOGIN_EMAIL_RATE = 0.1
+LOGIN_CLIENT_BURST = 20
+LOGIN_CLIENT_RATE = 1.0
+LOGIN_LIMITER_MAX_KEYS = 100_000
+
+# Full-text search of the vault (see password/search.py): maximum number of entries returned
+# by one search
+SEARCH_PAGE_SIZE = 20
+
+# Cache of the user records used by the login and the sign up (see auth/user_cache.py):
+# maximum number of users, seconds a user is kept and seconds a missing email is kept
+USER_CACHE_SIZE = 10_000
+USER_CACHE_TTL = 300.0
+USER_CACHE_NEGATIVE_TTL = 30.0
+
+# Number of vault entries in each page of the listings (see password.page_passwords)
+VAULT_PAGE_SIZE = 50
+
+# Service mode (python main.py --serve, see service/): path of the Unix socket, seconds a
+# session token stays valid, maximum size of a request (bytes) and of concurrent requests
+SERVICE_SOCKET = "password_manager.sock"
+SERVICE_SESSION_TTL = 900.0
+SERVICE_MAX_REQUEST = 64 * 1024
+SERVICE_MAX_CONCURRENCY = 1024
+
+# Backups (see db/backup.py): pages copied at each step of the online backup, rows of each
+# frame of the exports and zlib compression level of the exports (0-9)
+BACKUP_PAGES = 1024
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_COMPRESSION = 6
+
+# Maximum milliseconds from the start of the interpreter to the first prompt of the app
+# (python main.py --profile-startup, checked by test_startup.py)
+STARTUP_BUDGET_MS = 500.0
+
+# Group commit (see db/writer.py): seconds the writer waits for more writes after the first
+# one of a batch, and maximum number of writes committed together
+GROUP_COMMIT_WINDOW = 0.002
+GROUP_COMMIT_MAX_BATCH = 512
+# Whether the service commits the sign ups with the group commit writer. None uses it only
+# when SQLITE_PROFILE fsyncs every commit (synchronous FULL or EXTRA): without that fsync a
+# commit is cheap and handing the writes to the writer thread is slower than committing each
+# one (see the db.group_commit benchmarks)
+GROUP_COMMIT = None
+
+# Breached passwords check (see password/breach.py): path of the corpus converted with
+# python -m password.breach convert (None or a missing file disables the check), bytes of each
+# hash kept by the conversion and bits of the hash prefix index of the converted file
+BREACH_CORPUS = "breached_passwords.bin"
+BREACH_PREFIX_BYTES = 10
+BREACH_INDEX_BITS = 16
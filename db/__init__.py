@@ -1 +1,20 @@
-from .db import DBConnectionFactory, DBConnection
+from helper import lazy_exports
+from .db import DBConnectionFactory, DBConnection, BulkResult, WriteEvent
+from .pool_manager import ReusablePool, PoolManager, PoolTimeout, create_sqlite_pool
+
+# asyncio, the query builder, the memory engine and the group commit writer are only
+# imported when they are first used
+__getattr__ = lazy_exports(__name__, {
+    "AsyncDBConnectionFactory": ".aio",
+    "AsyncDBConnection": ".aio",
+    "AsyncSQLiteDBConnection": ".aio",
+    "AsyncConnectionPool": ".aio",
+    "create_async_sqlite_pool": ".aio",
+    "MemoryDBConnection": ".memory",
+    "GroupCommitWriter": ".writer",
+    "WriterClosed": ".writer",
+    "group_commit_enabled": ".writer",
+    "Query": ".query",
+    "Column": ".query",
+    "Predicate": ".query",
+})
@@ -0,0 +1,326 @@
+"""
+Asyncio connections to the database.
+
+An AsyncSQLiteDBConnection owns a SQLiteDBConnection and a dedicated worker thread: every
+statement runs in the worker, so sqlite3 never blocks the event loop and one loop can serve
+many sessions at once:
+
+    conn = AsyncSQLiteDBConnection("password.db")
+    await conn.connect()
+    await conn.run_sync(migrate, MODELS, MIGRATIONS)
+
+    rows = await conn.execute(conn.select_from_table_where(User, dict(email=email)), (email,))
+    async for row in conn.iter_query(*conn.build_query(query)):
+        ...
+    async with conn.transaction():
+        await conn.execute(conn.insert_into_table(User), values)
+
+The statement builders don't touch the database and stay synchronous. The connection is
+shared by all the tasks of the loop, so the writes should be made inside transaction(): the
+statements of the other tasks wait until the transaction is committed or rolled back.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Protocol, Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator
+
+from config import STATEMENT_CACHE_SIZE, BULK_INSERT_BATCH_SIZE, FETCH_CHUNK_SIZE, SQLITE_PROFILE, \
+    POOL_SIZE
+from models.base import Table
+from .db import SQLiteDBConnection, BulkResult, WriteEvent
+from .instrumentation import QueryInstrumentation
+from .query import Query
+from .pool_manager import PoolClosed
+
+
+class AsyncDBConnection(Protocol):
+    """The asyncio counterpart of DBConnection. The statement builders are the same (and
+    synchronous), the methods that use the database are coroutines (see DBConnection for
+    the documentation of each method)."""
+
+    async def connect(self) -> None:
+        """Create a connection with the database"""
+
+    def create_table(self, table: Table) -> str: ...
+
+    def create_indexes(self, table: Table) -> list[str]: ...
+
+    def insert_into_table(self, table: Table) -> str: ...
+
+    def select_all_from_table(self, table: Table) -> str: ...
+
+    def select_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str: ...
+
+    def update_from_table_where(self, table: Table, conditions: dict[str, Any], data: dict[str, Any]) -> str: ...
+
+    def delete_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str: ...
+
+    def create_search_index(self, table: Table) -> list[str]: ...
+
+    def rebuild_search_index(self, table: Table) -> str: ...
+
+    def search_table(self, table: Table, conditions: dict[str, Any]) -> str: ...
+
+    def build_query(self, query: Query) -> tuple[str, tuple[Any, ...]]: ...
+
+    async def execute(self, sql: str, parameters: tuple[Any, ...] = (),
+                      row_type: type[tuple] | None = None) -> list[Any]: ...
+
+    def iter_query(self, sql: str, parameters: tuple[Any, ...] = (),
+                   chunk_size: int = FETCH_CHUNK_SIZE,
+                   row_type: type[tuple] | None = None) -> AsyncIterator[Any]:
+        """Execute the sql statement and yield the resulting rows, fetching them from the
+        database 'chunk_size' rows at a time. The loop is free while a chunk is fetched."""
+
+    async def fetch_columns(self, sql: str, parameters: tuple[Any, ...] = (),
+                            chunk_size: int = FETCH_CHUNK_SIZE) -> dict[str, list[Any]]: ...
+
+    async def bulk_insert(self, table: Table, rows: Iterable[dict[str, Any]],
+                          batch_size: int = BULK_INSERT_BATCH_SIZE, upsert: bool = False) -> BulkResult: ...
+
+    def add_write_listener(self, listener: Callable[[WriteEvent], None]) -> None:
+        """See DBConnection.add_write_listener. The listeners may be called from another thread."""
+
+    def transaction(self) -> contextlib.AbstractAsyncContextManager["AsyncDBConnection"]:
+        """Return a context manager that commits the statements executed inside it, or rolls
+        them back if an exception is raised. The statements of other tasks wait until it ends.
+        A nested transaction (in the same task) is a savepoint of the outer one (see
+        DBConnection.transaction)."""
+
+    async def run_sync[T](self, func: Callable[..., T], *args: Any) -> T:
+        """Run 'func(conn, *args)' with the synchronous DBConnection (e.g. migrate) without
+        blocking the loop, and return its result"""
+
+    async def commit(self) -> None: ...
+
+    async def rollback(self) -> None: ...
+
+    async def close_connection(self) -> None: ...
+
+
+def _next_chunk(rows: Iterator[Any], chunk_size: int) -> list[Any]:
+    return list(itertools.islice(rows, chunk_size))
+
+
+class AsyncSQLiteDBConnection:
+    """AsyncDBConnection to a sqlite3 database (see module docstring).
+
+    Args:
+        url (str) : The url of the sqlite3 database.
+        statement_cache_size (int) : Maximum number of sql statements memoized.
+        profile (str) : Name of the sqlite3 pragmas profile (see ./db/profiles.py).
+        instrumentation (QueryInstrumentation | None) : Where the statements are recorded.
+    """
+
+    def __init__(self, url: str, statement_cache_size: int = STATEMENT_CACHE_SIZE,
+                 profile: str = SQLITE_PROFILE,
+                 instrumentation: QueryInstrumentation | None = None) -> None:
+        self.url = url
+        # only used from the worker thread, so sqlite3's same thread check is kept
+        self._conn = SQLiteDBConnection(url, statement_cache_size, profile=profile,
+                                        instrumentation=instrumentation)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite")
+        # held by the task running a transaction
+        self._lock = asyncio.Lock()
+        self._in_transaction = contextvars.ContextVar(f"in_transaction_{id(self)}", default=False)
+
+    @property
+    def statement_cache(self):
+        return self._conn.statement_cache
+
+    @property
+    def instrumentation(self) -> QueryInstrumentation:
+        return self._conn.instrumentation
+
+    async def _submit[T](self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _run[T](self, func: Callable[..., T], *args: Any) -> T:
+        if self._lock.locked() and not self._in_transaction.get():
+            # wait for the transaction of another task
+            async with self._lock:
+                return await self._submit(func, *args)
+        return await self._submit(func, *args)
+
+    async def connect(self) -> None:
+        await self._submit(self._conn.connect)
+
+    def profile_report(self) -> str:
+        return self._conn.profile_report()
+
+    def create_table(self, table: Table) -> str:
+        return self._conn.create_table(table)
+
+    def create_indexes(self, table: Table) -> list[str]:
+        return self._conn.create_indexes(table)
+
+    def insert_into_table(self, table: Table) -> str:
+        return self._conn.insert_into_table(table)
+
+    def select_all_from_table(self, table: Table) -> str:
+        return self._conn.select_all_from_table(table)
+
+    def select_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str:
+        return self._conn.select_from_table_where(table, conditions)
+
+    def update_from_table_where(self, table: Table, conditions: dict[str, Any], data: dict[str, Any]) -> str:
+        return self._conn.update_from_table_where(table, conditions, data)
+
+    def delete_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str:
+        return self._conn.delete_from_table_where(table, conditions)
+
+    def create_search_index(self, table: Table) -> list[str]:
+        return self._conn.create_search_index(table)
+
+    def rebuild_search_index(self, table: Table) -> str:
+        return self._conn.rebuild_search_index(table)
+
+    def search_table(self, table: Table, conditions: dict[str, Any]) -> str:
+        return self._conn.search_table(table, conditions)
+
+    def build_query(self, query: Query) -> tuple[str, tuple[Any, ...]]:
+        return self._conn.build_query(query)
+
+    def add_write_listener(self, listener: Callable[[WriteEvent], None]) -> None:
+        self._conn.add_write_listener(listener)
+
+    async def execute(self, sql: str, parameters: tuple[Any, ...] = (),
+                      row_type: type[tuple] | None = None) -> list[Any]:
+        return await self._run(self._conn.execute, sql, parameters, row_type)
+
+    async def iter_query(self, sql: str, parameters: tuple[Any, ...] = (),
+                         chunk_size: int = FETCH_CHUNK_SIZE,
+                         row_type: type[tuple] | None = None) -> AsyncIterator[Any]:
+        # the generator of the connection is started and advanced in the worker
+        rows = self._conn.iter_query(sql, parameters, chunk_size, row_type)
+        try:
+            while chunk := await self._run(_next_chunk, rows, chunk_size):
+                for row in chunk:
+                    yield row
+        finally:
+            await self._submit(rows.close)
+
+    async def fetch_columns(self, sql: str, parameters: tuple[Any, ...] = (),
+                            chunk_size: int = FETCH_CHUNK_SIZE) -> dict[str, list[Any]]:
+        return await self._run(self._conn.fetch_columns, sql, parameters, chunk_size)
+
+    async def explain_query_plan(self, sql: str, parameters: tuple[Any, ...] = ()) -> list[str]:
+        return await self._run(self._conn.explain_query_plan, sql, parameters)
+
+    async def bulk_insert(self, table: Table, rows: Iterable[dict[str, Any]],
+                          batch_size: int = BULK_INSERT_BATCH_SIZE, upsert: bool = False) -> BulkResult:
+        return await self._run(self._conn.bulk_insert, table, rows, batch_size, upsert)
+
+    async def run_sync[T](self, func: Callable[..., T], *args: Any) -> T:
+        return await self._run(func, self._conn, *args)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator["AsyncSQLiteDBConnection"]:
+        if self._in_transaction.get():
+            async with self._scope():
+                yield self
+            return
+
+        async with self._lock:
+            token = self._in_transaction.set(True)
+            try:
+                async with self._scope():
+                    yield self
+            finally:
+                self._in_transaction.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def _scope(self) -> AsyncIterator["AsyncSQLiteDBConnection"]:
+        # the transaction of the connection is entered and exited in the worker
+        scope = self._conn.transaction()
+        await self._submit(scope.__enter__)
+        try:
+            yield self
+        except BaseException as e:
+            await self._submit(scope.__exit__, type(e), e, e.__traceback__)
+            raise
+        else:
+            await self._submit(scope.__exit__, None, None, None)
+
+    async def commit(self) -> None:
+        await self._run(self._conn.commit)
+
+    async def rollback(self) -> None:
+        await self._run(self._conn.rollback)
+
+    async def close_connection(self) -> None:
+        await self._submit(self._conn.close_connection)
+        self._executor.shutdown(wait=False)
+
+
+class AsyncConnectionPool:
+    """A fixed number of AsyncDBConnections shared by the tasks of a loop. All the
+    connections are opened by open(), so no request pays for connecting.
+
+        async with pool.connection() as conn:
+            rows = await conn.execute(sql, parameters)
+
+    An AsyncDBConnection can be used by many tasks at once (their statements are queued in
+    its worker), so connections are not borrowed exclusively: each block gets the connection
+    with the fewest tasks using it, and a task awaiting e.g. bcrypt doesn't hold one back.
+
+    Args:
+        factory (Callable[[], AsyncDBConnection]) : Creates a (not connected) connection.
+        size (int) : Number of connections.
+    """
+
+    def __init__(self, factory: Callable[[], AsyncDBConnection], size: int = POOL_SIZE) -> None:
+        if size <= 0:
+            raise ValueError("'size' should be greater than zero")
+        self.factory = factory
+        self.size = size
+        self.closed = False
+        # connection -> number of tasks using it
+        self._users: dict[AsyncDBConnection, int] = {}
+
+    async def open(self, setup: Callable[[AsyncDBConnection], Awaitable[Any]] | None = None) -> None:
+        """Connect all the connections. 'setup' is awaited with the first one before the
+        others are opened (e.g. to migrate the database)"""
+        for i in range(self.size):
+            conn = self.factory()
+            await conn.connect()
+            if i == 0 and setup is not None:
+                await setup(conn)
+            self._users[conn] = 0
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncDBConnection]:
+        """Use the least busy connection for the duration of the block
+
+        Raises:
+            PoolClosed: If the pool is closed (or was not opened).
+        """
+        if self.closed or not self._users:
+            raise PoolClosed("The pool is closed")
+        conn = min(self._users, key=self._users.__getitem__)
+        self._users[conn] += 1
+        try:
+            yield conn
+        finally:
+            if conn in self._users:
+                self._users[conn] -= 1
+
+    async def close(self) -> None:
+        self.closed = True
+        connections, self._users = list(self._users), {}
+        for conn in connections:
+            await conn.close_connection()
+
+
+def create_async_sqlite_pool(url: str, size: int = POOL_SIZE) -> AsyncConnectionPool:
+    """Create a pool of AsyncSQLiteDBConnection to the database in 'url' (call open before using it)"""
+    return AsyncConnectionPool(lambda: AsyncSQLiteDBConnection(url), size)
+
+
+def AsyncDBConnectionFactory(db_engine: str, db_url: str) -> AsyncDBConnection:
+    match db_engine:
+        case "sqlite3":
+            return AsyncSQLiteDBConnection(db_url)
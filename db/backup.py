@@ -0,0 +1,373 @@
+"""
+Backup and restore of sqlite3 databases, and logical export and import of the models.
+
+Two formats:
+
+- backup/restore: a copy of the database file made with the sqlite3 online backup API,
+  BACKUP_PAGES pages at a time, so the database stays usable while it is copied (copying
+  password.db while the app runs can give a torn file). The copy is written to a temporary
+  file and renamed when it is complete.
+
+- export/import: the rows of the models, streamed in chunks of EXPORT_CHUNK_ROWS rows. Each
+  chunk is a frame with its own zlib compression and crc32 checksum, so memory use doesn't
+  depend on the size of the database and corruption is detected. The export reads a single
+  snapshot (one read transaction), and the import is applied in one transaction: a corrupted
+  file leaves the database unchanged. An export can be imported in a database with a newer
+  schema (the columns are matched by name).
+
+    python -m db.backup backup password.backup.db
+    python -m db.backup restore password.backup.db
+    python -m db.backup export vault.export
+    python -m db.backup import vault.export [--replace]
+
+File format of the exports: MAGIC followed by frames. A frame is a FRAME header (kind, size of
+the compressed payload, crc32 of the payload) and the zlib-compressed JSON payload:
+
+    HEAD {"version": 1, "tables": {tablename: [column, ...]}}
+    ROWS {"table": tablename, "rows": [[value, ...], ...]}       (any number)
+    END  {"rows": {tablename: count}}
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
+
+from config import DATABASE_URL, BACKUP_PAGES, EXPORT_CHUNK_ROWS, EXPORT_COMPRESSION
+from models.base import Table
+from models.models import MODELS
+from models.migrations import MIGRATIONS
+from .db import SQLiteDBConnection
+from .migrations import SQLiteConnection, migrate, build_search_index
+
+
+MAGIC = b"PMEXPORT"
+FORMAT_VERSION = 1
+# kind, size of the compressed payload, crc32 of the payload
+FRAME = struct.Struct(">4sII")
+# frames bigger than this are rejected as corrupted
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+
+class BackupError(Exception):
+    """Raised when a backup or an export can't be read or applied"""
+
+
+@dataclass
+class TransferResult:
+    """Summary of a backup, restore, export or import.
+
+    Attributes:
+        rows (int) : Number of rows exported or imported (0 for backups and restores).
+        bytes (int) : Size of the file written or read.
+        seconds (float) : Wall-clock time spent.
+    """
+    rows: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes / 1e6 / self.seconds if self.seconds > 0 else 0.0
+
+    def report(self) -> str:
+        report = f"{self.bytes / 1e6:.1f} MB in {self.seconds:.2f} s ({self.megabytes_per_second:.1f} MB/s"
+        if self.rows:
+            report += f", {self.rows} rows, {self.rows_per_second:.0f} rows/s"
+        return report + ")"
+
+
+def backup(conn: SQLiteConnection, path: str, pages: int = BACKUP_PAGES,
+           progress: Callable[[int, int], None] | None = None) -> TransferResult:
+    """Copy the database of 'conn' to the file 'path' with the online backup API.
+
+    Args:
+        conn (SQLiteConnection) : A connected SQLiteDBConnection.
+        path (str) : The file written (replaced if it exists).
+        pages (int) : Number of pages copied at each step. The database is only locked
+            during a step.
+        progress (Callable[[int, int], None] | None) : Called after each step with the
+            number of pages remaining and the total number of pages.
+
+    Return:
+        The size of the copy and the time spent
+    """
+    start = time.perf_counter()
+    tmp = f"{path}.tmp"
+    target = sqlite3.connect(tmp)
+    try:
+        conn.conn.backup(target, pages=pages,
+                         progress=(lambda status, remaining, total: progress(remaining, total))
+                         if progress else None)
+    except BaseException:
+        target.close()
+        os.unlink(tmp)
+        raise
+    target.close()
+    os.replace(tmp, path)
+    return TransferResult(bytes=os.path.getsize(path), seconds=time.perf_counter() - start)
+
+
+def restore(conn: SQLiteConnection, path: str, pages: int = BACKUP_PAGES,
+            progress: Callable[[int, int], None] | None = None) -> TransferResult:
+    """Replace the database of 'conn' with the backup in 'path' (see backup). The backup is
+    checked with PRAGMA quick_check first. The caches of running applications (e.g. the user
+    cache) don't see the restore: restart them.
+
+    Raises:
+        BackupError: If 'path' is not a valid sqlite3 database.
+    """
+    start = time.perf_counter()
+    if not os.path.exists(path):
+        raise BackupError(f"{path} doesn't exist")
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        try:
+            check = source.execute("PRAGMA quick_check;").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise BackupError(f"{path} is not a valid database: {e}") from e
+        if check != "ok":
+            raise BackupError(f"{path} is corrupted: {check}")
+        conn.conn.commit()
+        source.backup(conn.conn, pages=pages,
+                      progress=(lambda status, remaining, total: progress(remaining, total))
+                      if progress else None)
+    finally:
+        source.close()
+    return TransferResult(bytes=os.path.getsize(path), seconds=time.perf_counter() - start)
+
+
+def write_frame(file: BinaryIO, kind: bytes, payload: Any,
+                level: int = EXPORT_COMPRESSION) -> int:
+    """Write 'payload' (JSON serializable) as a frame. Return the number of bytes written"""
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    compressed = zlib.compress(data, level)
+    file.write(FRAME.pack(kind, len(compressed), zlib.crc32(data)))
+    file.write(compressed)
+    return FRAME.size + len(compressed)
+
+
+def read_frames(file: BinaryIO) -> Iterator[tuple[bytes, Any]]:
+    """Yield the (kind, payload) of the frames of an export, checking their checksums
+
+    Raises:
+        BackupError: If the file is not an export or a frame is corrupted or truncated.
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise BackupError("Not an export file")
+    while header := file.read(FRAME.size):
+        if len(header) < FRAME.size:
+            raise BackupError("Truncated frame header")
+        kind, size, crc = FRAME.unpack(header)
+        if size > MAX_FRAME_SIZE:
+            raise BackupError(f"Corrupted frame: {size} bytes")
+        compressed = file.read(size)
+        if len(compressed) < size:
+            raise BackupError("Truncated frame")
+        try:
+            data = zlib.decompress(compressed)
+        except zlib.error as e:
+            raise BackupError(f"Corrupted frame: {e}") from e
+        if zlib.crc32(data) != crc:
+            raise BackupError("Corrupted frame: checksum mismatch")
+        yield kind, json.loads(data)
+
+
+def export(conn: SQLiteConnection, models: Iterable[Table], path: str,
+           chunk_rows: int = EXPORT_CHUNK_ROWS, level: int = EXPORT_COMPRESSION) -> TransferResult:
+    """Export the rows of 'models' to the file 'path' (see module docstring).
+
+    Args:
+        conn (SQLiteConnection) : A connected SQLiteDBConnection.
+        models (Iterable[Table]) : The models exported, referenced tables first.
+        path (str) : The file written (replaced if it exists).
+        chunk_rows (int) : Number of rows of each frame.
+        level (int) : zlib compression level.
+
+    Return:
+        The number of rows, the size of the file and the time spent
+    """
+    start = time.perf_counter()
+    models = list(models)
+    raw = conn.conn
+    result = TransferResult()
+    counts = {}
+    tmp = f"{path}.tmp"
+
+    # a single read transaction: every table is read from the same snapshot
+    raw.commit()
+    raw.execute("BEGIN;")
+    try:
+        with open(tmp, "wb") as file:
+            file.write(MAGIC)
+            result.bytes = len(MAGIC)
+            result.bytes += write_frame(file, b"HEAD", dict(
+                version=FORMAT_VERSION,
+                tables={m.__tablename__: list(m.__compiled__.column_names) for m in models}), level)
+
+            for model in models:
+                schema = model.__compiled__
+                order = f" ORDER BY {schema.primary_key}" if schema.primary_key else ""
+                cur = raw.execute(f"SELECT {', '.join(schema.column_names)} "
+                                  + f"FROM {model.__tablename__}{order};")
+                count = 0
+                while rows := cur.fetchmany(chunk_rows):
+                    result.bytes += write_frame(file, b"ROWS", dict(table=model.__tablename__,
+                                                                    rows=rows), level)
+                    count += len(rows)
+                counts[model.__tablename__] = count
+                result.rows += count
+
+            result.bytes += write_frame(file, b"END ", dict(rows=counts), level)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    finally:
+        raw.rollback()
+
+    os.replace(tmp, path)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def import_(conn: SQLiteConnection, models: Iterable[Table], path: str,
+            replace: bool = False) -> TransferResult:
+    """Import the export in 'path' into the tables of 'models', in one transaction. The rows
+    are written with sql of their own, so the write listeners of the connections and the caches
+    of running applications (e.g. the user cache) don't see the import: restart them.
+
+    Args:
+        conn (SQLiteConnection) : A connected SQLiteDBConnection, with the tables created.
+        models (Iterable[Table]) : The models imported, referenced tables first.
+        path (str) : The export file.
+        replace (bool) : If True, the rows of the tables are deleted first. If False, the
+            import fails when a row conflicts with an existing one.
+
+    Return:
+        The number of rows, the size of the file and the time spent
+
+    Raises:
+        BackupError: If the file is not a valid export or can't be imported. Nothing is imported.
+    """
+    start = time.perf_counter()
+    models = {m.__tablename__: m for m in models}
+    raw = conn.conn
+    result = TransferResult(bytes=os.path.getsize(path))
+    inserts: dict[str, tuple[str, list[int]]] = {}
+    # rows read of each table, checked against the counts of the end frame
+    counts: dict[str, int] = {}
+    finished = False
+
+    raw.commit()
+    raw.execute("BEGIN;")
+    try:
+        with open(path, "rb") as file:
+            for kind, payload in read_frames(file):
+                if finished:
+                    raise BackupError("Corrupted export: frames after the end frame")
+                match kind:
+                    case b"HEAD":
+                        if payload.get("version") != FORMAT_VERSION:
+                            raise BackupError(f"Unsupported export version {payload.get('version')}")
+                        inserts = _import_statements(models, payload["tables"])
+                        # the full-text indexes are rebuilt once at the end, instead of
+                        # being updated by their triggers for every row
+                        for model in models.values():
+                            search = model.__compiled__.search
+                            if search is not None:
+                                for trigger in ("ai", "ad", "au"):
+                                    raw.execute(f"DROP TRIGGER IF EXISTS {search.name}_{trigger};")
+                        if replace:
+                            for name in reversed(list(models)):
+                                raw.execute(f"DELETE FROM {name};")
+                    case b"ROWS":
+                        counts[payload["table"]] = counts.get(payload["table"], 0) + len(payload["rows"])
+                        if payload["table"] not in inserts:
+                            continue
+                        sql, positions = inserts[payload["table"]]
+                        raw.executemany(sql, ([row[i] for i in positions] for row in payload["rows"]))
+                        result.rows += len(payload["rows"])
+                    case b"END ":
+                        # a ROWS frame dropped or repeated passes the checksums of the frames
+                        for table in payload["rows"].keys() | counts.keys():
+                            read, exported = counts.get(table, 0), payload["rows"].get(table, 0)
+                            if read != exported:
+                                raise BackupError(f"Corrupted export: {read} rows of {table} "
+                                                  + f"read, {exported} exported")
+                        finished = True
+        if not finished:
+            raise BackupError("Truncated export: the end frame is missing")
+        for model in models.values():
+            build_search_index(conn, model)
+        raw.commit()
+    except BaseException as e:
+        raw.rollback()
+        if isinstance(e, sqlite3.Error):
+            raise BackupError(str(e)) from e
+        raise
+
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _import_statements(models: dict[str, Table],
+                       tables: dict[str, list[str]]) -> dict[str, tuple[str, list[int]]]:
+    """Return the INSERT of each exported table that is a model, and the positions of its
+    columns in the exported rows (the columns that no longer exist are dropped)"""
+    inserts = {}
+    for name, exported in tables.items():
+        model = models.get(name)
+        if model is None:
+            continue
+        columns = [c for c in exported if c in model.__compiled__.columns]
+        placeholders = ", ".join("?" for _ in columns)
+        inserts[name] = (f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({placeholders});",
+                         [exported.index(c) for c in columns])
+    return inserts
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Backup, restore, export and import the database")
+    parser.add_argument("command", choices=("backup", "restore", "export", "import"))
+    parser.add_argument("path", help="the backup or export file")
+    parser.add_argument("--database", default=DATABASE_URL, help="the sqlite3 database")
+    parser.add_argument("--replace", action="store_true",
+                        help="import: delete the existing rows first")
+    args = parser.parse_args(argv)
+
+    conn = SQLiteDBConnection(args.database)
+    conn.connect()
+    try:
+        match args.command:
+            case "backup":
+                result = backup(conn, args.path)
+            case "restore":
+                result = restore(conn, args.path)
+            case "export":
+                result = export(conn, MODELS, args.path)
+            case "import":
+                migrate(conn, MODELS, MIGRATIONS)
+                result = import_(conn, MODELS, args.path, args.replace)
+    except (BackupError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close_connection()
+
+    print(f"{args.command}: {result.report()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,77 @@
+import contextlib
+import functools
+import logging
 import sqlite3
-from typing import Protocol, Any
-
-from models.base import Table
+import time
+from dataclasses import dataclass
+from itertools import batched
+from typing import Protocol, Any, Callable, Iterable, Iterator
+
+from config import STATEMENT_CACHE_SIZE, SQLITE_CACHED_STATEMENTS, BULK_INSERT_BATCH_SIZE, \
+    FETCH_CHUNK_SIZE, SQLITE_PROFILE
+from models.base import Table, Index, SearchIndex
+from .statement_cache import StatementCache
+from .profiles import get_profile, normalize_pragma
+from .instrumentation import QueryInstrumentation, get_instrumentation
+from .query import Query
+
+
+# errors of the write listeners (a write is never undone because a listener failed)
+logger = logging.getLogger("db.write_listeners")
+
+
+@dataclass
+class BulkResult:
+    """Summary of a bulk insert.
+
+    Attributes:
+        inserted (int) : Number of new rows.
+        updated (int) : Number of existing rows updated by an upsert.
+        rejected (int) : Number of rows that failed the validation against the model or
+            that conflicted with existing rows (when not upserting).
+        seconds (float) : Wall-clock time spent in the bulk insert.
+    """
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return self.inserted + self.updated + self.rejected
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+@dataclass(frozen=True)
+class WriteEvent:
+    """A write to a table made with a statement of the builders, as seen by the
+    write listeners of a connection (e.g. to invalidate a cache of the table).
+
+    Attributes:
+        table (Table) : The model of the table written.
+        operation (str) : "insert", "update", "delete" or "bulk_insert".
+        keys (dict[str, Any]) : The values inserted (insert) or the conditions of the
+            statement (update and delete). Empty for bulk inserts.
+        data (dict[str, Any]) : The new values of an update. Empty otherwise.
+    """
+    table: Table
+    operation: str
+    keys: dict[str, Any]
+    data: dict[str, Any]
+
+
+@functools.cache
+def record_factory(row_type: type[tuple]) -> Callable[[sqlite3.Cursor, tuple], tuple]:
+    """Return the sqlite3 row factory that builds the rows directly as 'row_type'
+    (e.g. the record class of a model, see models.base.make_record)"""
+    new = tuple.__new__
+
+    def factory(cursor: sqlite3.Cursor, row: tuple) -> tuple:
+        return new(row_type, row)
+    return factory
 
 
 class DBConnection(Protocol):
@@ -18,6 +88,17 @@ class DBConnection(Protocol):
             The sql statement for creating the new table
         """
 
+    def create_indexes(self, table: Table) -> list[str]:
+        """Return the sql statements for creating the indexes declared by the model 'table'
+        (see models.base.Index). They should be executed after the statement of create_table.
+
+        Args:
+            table (Table) : A class of type Table
+
+        Return:
+            A list with one sql statement for each index of the table
+        """
+
     def insert_into_table(self, table: Table) -> str:
         """Return the sql statement for inserting 'data' into the 'table'.
 
@@ -86,55 +167,400 @@ class DBConnection(Protocol):
             y the dictionary 'conditions'.
         """
 
-    def execute(self, sql: str, parameters: tuple[Any, ...] = ()) -> list[Any]:
+    def create_search_index(self, table: Table) -> list[str]:
+        """Return the sql statements for creating the full-text index declared by the model 'table'
+        (see models.base.SearchIndex) and the triggers that keep it in sync with the table. They
+        should be executed after the statement of create_table.
+
+        Args:
+            table (Table) : A class of type Table
+
+        Return:
+            A list of sql statements (empty if the model has no full-text index)
+        """
+
+    def rebuild_search_index(self, table: Table) -> str:
+        """Return the sql statement for rebuilding the full-text index of 'table' from the rows
+        already stored in the table.
+
+        Args:
+            table (Table) : A class of type Table with a full-text index
+
+        Return:
+            The sql statement for rebuilding the index
+        """
+
+    def search_table(self, table: Table, conditions: dict[str, Any]) -> str:
+        """Return the sql statement for a full-text search over 'table', restricted to the entries
+        matching the conditions given by the dictionary 'conditions'. The best matches come first.
+        Its parameters are the match expression, the values of 'conditions', the maximum number
+        of entries returned and the number of entries skipped. Every match is ranked. If the
+        first condition is the owner of the full-text index (see models.base.SearchIndex), only
+        the entries of that owner are read.
+
+        Args:
+            table (Table) : A class of type Table with a full-text index
+            conditions (dict[str, Any]) : A dictionary where (1) its keys represent the names of the columns
+                that are called in the selection and (2) its values are regular python datatype values that
+                are part of the condition.
+
+        Return:
+            The sql statement for searching 'table'
+        """
+
+    def build_query(self, query: Query) -> tuple[str, tuple[Any, ...]]:
+        """Return the sql statement of 'query' (see db/query.py) and its parameters, as executed
+        by this connection.
+
+        Args:
+            query (Query) : The query. Its predicates must be built with Column to run on the
+                engines that don't execute sql (e.g. the memory engine).
+
+        Return:
+            The sql statement and its parameters
+        """
+
+    def execute(self, sql: str, parameters: tuple[Any, ...] = (),
+                row_type: type[tuple] | None = None) -> list[Any]:
         """Execute the sql statement with the parameters given in the arguments.
 
         Args:
             sql (str) : The sql statement.
             parameters (tuple[Any, ...]) : The parameters that will be replaced in the sql statement placeholders.
+            row_type (type[tuple] | None) : The record class the rows are built as (e.g. User.__record__
+                for SELECT * FROM users, or Query.record). None returns plain tuples.
 
         Return:
             A list with the data requested in the sql statement or an empty list if no data was requested in the sql statement
         """
 
+    def iter_query(self, sql: str, parameters: tuple[Any, ...] = (),
+                   chunk_size: int = FETCH_CHUNK_SIZE,
+                   row_type: type[tuple] | None = None) -> Iterator[Any]:
+        """Execute the sql statement and yield the resulting rows lazily, fetching them
+        from the database 'chunk_size' rows at a time, so that memory use doesn't depend on
+        the size of the result.
+
+        Args:
+            sql (str) : The sql statement.
+            parameters (tuple[Any, ...]) : The parameters that will be replaced in the sql statement placeholders.
+            chunk_size (int) : Number of rows fetched from the database at once.
+            row_type (type[tuple] | None) : The record class the rows are built as (see execute).
+
+        Return:
+            An iterator over the rows requested in the sql statement
+        """
+
+    def fetch_columns(self, sql: str, parameters: tuple[Any, ...] = (),
+                      chunk_size: int = FETCH_CHUNK_SIZE) -> dict[str, list[Any]]:
+        """Execute the sql statement and return the result by columns instead of by rows,
+        for bulk reads: a list per column holds the values without the object of every row.
+
+        Args:
+            sql (str) : The sql statement.
+            parameters (tuple[Any, ...]) : The parameters that will be replaced in the sql statement placeholders.
+            chunk_size (int) : Number of rows fetched from the database at once.
+
+        Return:
+            A dictionary with the list of the values of each column, by column name
+        """
+
+    def bulk_insert(self, table: Table, rows: Iterable[dict[str, Any]],
+                    batch_size: int = BULK_INSERT_BATCH_SIZE, upsert: bool = False) -> BulkResult:
+        """Insert all the 'rows' into 'table' inside a single transaction.
+
+        The rows are validated against the model and sent to the database in chunks of
+        'batch_size' rows. Invalid rows are skipped and counted as rejected.
+
+        Args:
+            table (Table) : A class of type Table
+            rows (Iterable[dict[str, Any]]) : The data to be inserted. Each element has the
+                same format as the data given to Table.validate_data.
+            batch_size (int) : Number of rows sent to the database at once.
+            upsert (bool) : If True, rows that conflict with an existing row on one of the UNIQUE
+                columns of the model update that row. If False, they are rejected.
+
+        Return:
+            A BulkResult with the number of inserted, updated and rejected rows
+        """
+
+    def add_write_listener(self, listener: Callable[[WriteEvent], None]) -> None:
+        """Call 'listener' with a WriteEvent after every insert, update or delete executed
+        with the statements of insert_into_table, update_from_table_where,
+        delete_from_table_where and bulk_insert. The events of a transaction are delivered
+        again when it is committed or rolled back. Writes with other sql are not reported.
+
+        Args:
+            listener (Callable[[WriteEvent], None]) : The function called with every event.
+        """
+
+    def transaction(self) -> contextlib.AbstractContextManager["DBConnection"]:
+        """Return a context manager that commits the statements executed inside it, or rolls
+        them back if an exception is raised:
+
+            with conn.transaction():
+                conn.execute(conn.insert_into_table(User), values)
+
+        Inside a transaction the statements that fail raise their error (instead of printing
+        it and returning no rows), so that the transaction is rolled back. A nested
+        transaction is a savepoint of the outer one: an exception raised inside it only rolls
+        back its own statements, the rest are committed with the outer transaction.
+        """
+
     def commit(self):
         """Commit changes of the current session"""
 
+    def rollback(self):
+        """Discard the uncommitted changes of the current session"""
+
     def close_connection(self):
         """Close the connection"""
 
 
-class SQLiteDBConnection:
-    def __init__(self, url: str):
+class WriteListeners:
+    """Delivery of the WriteEvents of a connection to its write listeners (see
+    DBConnection.add_write_listener). The connection registers the sql of the write
+    statements it builds, and reports every statement it executes with _notify_write."""
+    write_listeners: list[Callable[[WriteEvent], None]]
+    # sql of the write statements built by the connection -> (table, operation,
+    # columns of the parameters, number of parameters of the SET clause)
+    _writes: dict[str, tuple[Table, str, tuple[str, ...], int]]
+    _pending_writes: list[WriteEvent]
+
+    def add_write_listener(self, listener: Callable[[WriteEvent], None]) -> None:
+        self.write_listeners.append(listener)
+
+    def _register_write(self, sql: str, table: Table, operation: str,
+                        columns: tuple[str, ...], data_count: int = 0) -> str:
+        self._writes[sql] = (table, operation, columns, data_count)
+        return sql
+
+    def _notify_write(self, sql: str, parameters: tuple[Any, ...]) -> None:
+        write = self._writes.get(sql)
+        if write is None:
+            return
+        table, operation, columns, data_count = write
+        if operation == "update":
+            data = dict(zip(columns[:data_count], parameters))
+            keys = dict(zip(columns[data_count:], parameters[data_count:]))
+        else:
+            data, keys = {}, dict(zip(columns, parameters))
+        self._dispatch(WriteEvent(table, operation, keys, data))
+
+    def _dispatch(self, event: WriteEvent, pending: bool = True) -> None:
+        if pending:
+            self._pending_writes.append(event)
+        for listener in self.write_listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Write listener %r failed on %s %s", listener,
+                                 event.operation, event.table.__tablename__)
+
+    def _flush_writes(self) -> None:
+        # the readers of other connections may have seen the old rows until now
+        events, self._pending_writes = self._pending_writes, []
+        for event in events:
+            self._dispatch(event, pending=False)
+
+
+class SQLiteDBConnection(WriteListeners):
+    def __init__(self, url: str, statement_cache_size: int = STATEMENT_CACHE_SIZE,
+                 check_same_thread: bool = True, profile: str = SQLITE_PROFILE,
+                 instrumentation: QueryInstrumentation | None = None):
         self.url = url
+        self.instrumentation = instrumentation or get_instrumentation()
+        self.statement_cache = StatementCache(statement_cache_size)
+        # Pooled connections are handed over between threads (one at a time), so the
+        # pool disables sqlite3's same thread check.
+        self.check_same_thread = check_same_thread
+        self.profile = profile
+        # Values of the profile pragmas read back from sqlite3 after connecting
+        self.pragmas: dict[str, Any] = {}
+        self.write_listeners = []
+        self._writes = {}
+        self._pending_writes = []
+        # number of transaction() scopes entered (the nested ones are savepoints)
+        self._transaction_depth = 0
 
     def connect(self):
-        self.conn = sqlite3.connect(self.url)
+        self.conn = sqlite3.connect(self.url,
+                                    cached_statements=SQLITE_CACHED_STATEMENTS,
+                                    check_same_thread=self.check_same_thread)
         cur = self.conn.cursor()
         cur.execute("PRAGMA foreign_keys = ON;")
 
+        for name, value in get_profile(self.profile).items():
+            cur.execute(f"PRAGMA {name} = {value};")
+            # some pragmas are not reported for some databases (e.g. mmap_size in memory)
+            row = cur.execute(f"PRAGMA {name};").fetchone()
+            self.pragmas[name] = row[0] if row else None
+
+    def profile_mismatches(self) -> dict[str, tuple[Any, Any]]:
+        """Return the pragmas of the profile that sqlite3 did not apply as (expected, applied).
+        For example, in-memory databases can't use journal_mode = WAL."""
+        return {
+            name: (expected, self.pragmas.get(name))
+            for name, value in get_profile(self.profile).items()
+            if (expected := normalize_pragma(name, value)) != self.pragmas.get(name)
+        }
+
+    def profile_report(self) -> str:
+        """Return a one line summary of the applied profile, including the mismatches"""
+        applied = ", ".join(f"{k}={v}" for k, v in self.pragmas.items())
+        report = f"sqlite3 profile '{self.profile}': {applied}"
+        mismatches = self.profile_mismatches()
+        if mismatches:
+            report += "; not applied: " + ", ".join(
+                f"{k} (expected {expected}, got {got})"
+                for k, (expected, got) in mismatches.items())
+        return report
+
     def create_table(self, table: Table) -> str:
-        columns = list(table.__schema__.keys())
-        d_types = [v.d_type for v in table.__schema__.values()]
-        contraints = [v.constraints for v in table.__schema__.values()]
+        return self.statement_cache.get_or_build(
+            (table, "create", ()), lambda: self._build_create_table(table))
 
-        column_stmts = map(
-            lambda item: f"{item[0]} {item[1]} {' '.join(item[2])}",
-            zip(columns, d_types, contraints),
-        )
+    def create_indexes(self, table: Table) -> list[str]:
+        return [
+            self.statement_cache.get_or_build(
+                (table, "create_index", idx.name),
+                lambda: self._build_create_index(table, idx))
+            for idx in table.__compiled__.indexes
+        ]
+
+    def insert_into_table(self, table: Table) -> str:
+        return self.statement_cache.get_or_build(
+            (table, "insert", ()),
+            lambda: self._register_write(self._build_insert_into_table(table), table, "insert",
+                                         table.__compiled__.insert_columns))
+
+    def select_all_from_table(self, table: Table) -> str:
+        return self.statement_cache.get_or_build(
+            (table, "select_all", ()), lambda: self._build_select_all_from_table(table))
+
+    def select_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str:
+        columns = tuple(conditions)
+        return self.statement_cache.get_or_build(
+            (table, "select", columns),
+            lambda: self._build_select_from_table_where(table, columns))
+
+    def update_from_table_where(self, table: Table, conditions: dict[str, Any], data: dict[str, Any]) -> str:
+        columns = tuple(conditions)
+        data_columns = tuple(data)
+        return self.statement_cache.get_or_build(
+            (table, "update", columns, data_columns),
+            lambda: self._register_write(
+                self._build_update_from_table_where(table, columns, data_columns), table,
+                "update", data_columns + columns, len(data_columns)))
 
+    def delete_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str:
+        columns = tuple(conditions)
+        return self.statement_cache.get_or_build(
+            (table, "delete", columns),
+            lambda: self._register_write(self._build_delete_from_table_where(table, columns),
+                                         table, "delete", columns))
+
+    def create_search_index(self, table: Table) -> list[str]:
+        search = table.__compiled__.search
+        if search is None:
+            return []
+        return list(self.statement_cache.get_or_build(
+            (table, "create_search", ()), lambda: self._build_create_search_index(table, search)))
+
+    def rebuild_search_index(self, table: Table) -> str:
+        search = self._search_index(table)
+        return self.statement_cache.get_or_build(
+            (table, "rebuild_search", ()), lambda: f"INSERT INTO {search.name}({search.name}) "
+                                                   + "VALUES ('rebuild');")
+
+    def search_table(self, table: Table, conditions: dict[str, Any]) -> str:
+        search = self._search_index(table)
+        columns = tuple(conditions)
+        return self.statement_cache.get_or_build(
+            (table, "search", columns),
+            lambda: self._build_search_table(table, search, columns))
+
+    def build_query(self, query: Query) -> tuple[str, tuple[Any, ...]]:
+        return query.build()
+
+    @staticmethod
+    def _search_index(table: Table) -> SearchIndex:
+        search = table.__compiled__.search
+        if search is None:
+            raise ValueError(f"Table {table.__tablename__!r} has no search index")
+        return search
+
+    def _build_create_table(self, table: Table) -> str:
         sql = f"CREATE TABLE IF NOT EXISTS {table.__tablename__} (\n\t"
-        sql += f"{', \n\t'.join(list(column_stmts))}"
+        sql += f"{', \n\t'.join(table.__compiled__.ddl)}"
         sql += ");"
 
         return sql
 
-    def insert_into_table(self, table: Table) -> str:
+    def _build_create_index(self, table: Table, idx: Index) -> str:
+        sql = f"CREATE {'UNIQUE ' if idx.unique else ''}INDEX IF NOT EXISTS {idx.name} \n"
+        sql += f"ON {table.__tablename__} ({', '.join(idx.columns)});"
+
+        return sql
 
-        filtered_dict = dict(filter(lambda item: not item[1].primary_key,
-                                    table.__schema__.items()))
+    def _build_create_search_index(self, table: Table, search: SearchIndex) -> tuple[str, ...]:
+        # external content FTS5 table: the text is only stored once, in the table itself
+        name = search.name
+        tablename = table.__tablename__
+        rowid = table.__compiled__.primary_key or "rowid"
+        indexed = search.columns + ((search.owner,) if search.owner is not None else ())
+        columns = ", ".join(indexed)
+        new = ", ".join(f"new.{c}" for c in indexed)
+        old = ", ".join(f"old.{c}" for c in indexed)
+        delete = f"INSERT INTO {name}({name}, rowid, {columns}) VALUES ('delete', old.{rowid}, {old});"
+        insert = f"INSERT INTO {name}(rowid, {columns}) VALUES (new.{rowid}, {new});"
+
+        return (
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(\n\t{columns}, \n\t"
+            + f"content='{tablename}', content_rowid='{rowid}', \n\t"
+            + f"prefix='{' '.join(map(str, search.prefix))}', \n\t"
+            + "tokenize='unicode61 remove_diacritics 2');",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {tablename} BEGIN \n\t"
+            + f"{insert} \nEND;",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {tablename} BEGIN \n\t"
+            + f"{delete} \nEND;",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {columns} ON {tablename} "
+            + f"BEGIN \n\t{delete} \n\t{insert} \nEND;",
+        )
+
+    def _build_search_table(self, table: Table, search: SearchIndex,
+                            columns: tuple[str, ...]) -> str:
+        tablename = table.__tablename__
+        rowid = table.__compiled__.primary_key or "rowid"
+        column_names = table.__compiled__.column_names
+        weights = ", ".join(map(str, search.weights + ((0.0,) if search.owner is not None else ())))
+
+        # The words of the expression only match the text columns. If the search is restricted
+        # to a value of the owner column (its first condition, whose parameter follows the
+        # expression), that value is ANDed into the match: FTS5 then only reads and ranks the
+        # postings of the owner, not the matches of the whole table.
+        match = f"'{{{' '.join(search.columns)}}} : (' || ? || ')"
+        if search.owner is not None and columns[:1] == (search.owner,):
+            match += f" AND {search.owner} : \"' || replace(?, '\"', '\"\"') || '\""
+            columns = columns[1:]
+        match += "'"
+
+        # CROSS JOIN keeps the full-text index as the outer loop (otherwise sqlite may scan the
+        # table by the conditions and evaluate the match for every row). Every match is ranked
+        # by the rank column of FTS5, with the weights of the model as its bm25 arguments.
+        conditions = [f"{search.name} MATCH ({match})",
+                      f"{search.name}.rank MATCH 'bm25({weights})'"]
+        sql = f"SELECT {', '.join(f't.{c}' for c in column_names)} \n"
+        sql += f"FROM {search.name} CROSS JOIN {tablename} AS t "
+        sql += f"ON t.{rowid} = {search.name}.rowid \n"
+        sql += f"WHERE {' AND '.join(conditions + [f't.{k} = ?' for k in columns])} \n"
+        sql += f"ORDER BY {search.name}.rank \n"
+        sql += "LIMIT ? OFFSET ?;"
+
+        return sql
 
-        columns = list(filtered_dict.keys())
+    def _build_insert_into_table(self, table: Table) -> str:
+        columns = table.__compiled__.insert_columns
 
         sql = f"INSERT INTO {table.__tablename__} \n"
         sql += f"({', '.join(columns)}) \n"
@@ -142,44 +568,281 @@ class SQLiteDBConnection:
 
         return sql
 
-    def select_all_from_table(self, table: Table) -> str:
+    def _build_select_all_from_table(self, table: Table) -> str:
         sql = f"SELECT * FROM {table.__tablename__};"
 
         return sql
 
-    def select_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str:
-        columns = list(conditions.keys())
-
+    def _build_select_from_table_where(self, table: Table, columns: tuple[str, ...]) -> str:
         sql = f"SELECT * FROM {table.__tablename__} \n\t"
-        sql += f"WHERE {', \n\t'.join([f'{k} = ?' for k in columns])};"
+        sql += f"WHERE {' \n\tAND '.join([f'{k} = ?' for k in columns])};"
 
         return sql
 
-    def update_from_table_where(self, table: Table, conditions: dict[str, Any], data: dict[str, Any]) -> str:
+    def _build_update_from_table_where(self, table: Table, columns: tuple[str, ...],
+                                       data_columns: tuple[str, ...]) -> str:
         sql = f"UPDATE {table.__tablename__} \n"
-        sql += f"SET {', \n\t'.join([f'{k} = ?' for k in data.keys()])} \n"
-        sql += f"WHERE {', \n\t'.join([f'{k} = ?' for k in conditions.keys()])};"
+        sql += f"SET {', \n\t'.join([f'{k} = ?' for k in data_columns])} \n"
+        sql += f"WHERE {' \n\tAND '.join([f'{k} = ?' for k in columns])};"
 
         return sql
 
-    def delete_from_table_where(self, table: Table, conditions: dict[str, Any]) -> str:
+    def _build_delete_from_table_where(self, table: Table, columns: tuple[str, ...]) -> str:
         sql = f"DELETE FROM {table.__tablename__} \n"
-        sql += f"WHERE {', \n\t'.join([f'{k} = ?' for k in conditions.keys()])};"
+        sql += f"WHERE {' \n\tAND '.join([f'{k} = ?' for k in columns])};"
 
         return sql
 
-    def execute(self, sql: str, parameters: tuple[Any, ...] = ()) -> list[Any]:
+    def execute(self, sql: str, parameters: tuple[Any, ...] = (),
+                row_type: type[tuple] | None = None) -> list[Any]:
+        instrumented = self.instrumentation.enabled
+        if instrumented:
+            start = time.perf_counter()
+
         try:
             cur = self.conn.cursor()
+            if row_type is not None:
+                cur.row_factory = record_factory(row_type)
             cur.execute(sql, parameters)
-            return cur.fetchall()
+            result = cur.fetchall()
         except Exception as e:
+            if instrumented:
+                self.instrumentation.record(sql, time.perf_counter() - start,
+                                            parameters=len(parameters), error=e)
+            if self._transaction_depth:
+                raise
             print(e)
             print(sql)
             return []
 
+        if instrumented:
+            self.instrumentation.record(sql, time.perf_counter() - start,
+                                        len(result), len(parameters))
+        if self.write_listeners:
+            self._notify_write(sql, parameters)
+        return result
+
+    def iter_query(self, sql: str, parameters: tuple[Any, ...] = (),
+                   chunk_size: int = FETCH_CHUNK_SIZE,
+                   row_type: type[tuple] | None = None) -> Iterator[Any]:
+        instrumented = self.instrumentation.enabled
+        # only the time spent in the database is recorded, not the time of the consumer
+        elapsed = 0.0
+        count = 0
+
+        start = time.perf_counter()
+        try:
+            cur = self.conn.cursor()
+            if row_type is not None:
+                cur.row_factory = record_factory(row_type)
+            cur.execute(sql, parameters)
+        except Exception as e:
+            if instrumented:
+                self.instrumentation.record(sql, time.perf_counter() - start,
+                                            parameters=len(parameters), error=e)
+            if self._transaction_depth:
+                raise
+            print(e)
+            print(sql)
+            return
+        elapsed += time.perf_counter() - start
+
+        try:
+            while True:
+                start = time.perf_counter()
+                rows = cur.fetchmany(chunk_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+        finally:
+            cur.close()
+            if instrumented:
+                self.instrumentation.record(sql, elapsed, count, len(parameters))
+
+    def fetch_columns(self, sql: str, parameters: tuple[Any, ...] = (),
+                      chunk_size: int = FETCH_CHUNK_SIZE) -> dict[str, list[Any]]:
+        instrumented = self.instrumentation.enabled
+        start = time.perf_counter()
+        try:
+            cur = self.conn.cursor()
+            cur.execute(sql, parameters)
+            names = [description[0] for description in cur.description or ()]
+            columns: list[list[Any]] = [[] for _ in names]
+            count = 0
+            # only a chunk of rows is alive at once, the values end up in the column lists
+            while rows := cur.fetchmany(chunk_size):
+                count += len(rows)
+                for column, values in zip(columns, zip(*rows)):
+                    column.extend(values)
+            cur.close()
+        except Exception as e:
+            if instrumented:
+                self.instrumentation.record(sql, time.perf_counter() - start,
+                                            parameters=len(parameters), error=e)
+            if self._transaction_depth:
+                raise
+            print(e)
+            print(sql)
+            return {}
+
+        if instrumented:
+            self.instrumentation.record(sql, time.perf_counter() - start, count, len(parameters))
+        return dict(zip(names, columns))
+
+    def explain_query_plan(self, sql: str, parameters: tuple[Any, ...] = ()) -> list[str]:
+        """Return the steps of the plan chosen by sqlite3 for the sql statement
+        (e.g. 'SEARCH passwords USING INDEX idx_passwords_user_id_app_url (user_id=?)').
+        Useful to check that the hot queries use the indexes instead of scanning the table.
+        """
+        return [row[-1] for row in self.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+
+    def bulk_insert(self, table: Table, rows: Iterable[dict[str, Any]],
+                    batch_size: int = BULK_INSERT_BATCH_SIZE, upsert: bool = False) -> BulkResult:
+        if batch_size <= 0:
+            raise ValueError("'batch_size' should be greater than zero")
+
+        start = time.perf_counter()
+        result = BulkResult()
+        columns = table.__compiled__.insert_columns
+        sql = self.statement_cache.get_or_build(
+            (table, "bulk_insert", upsert),
+            lambda: self._build_bulk_insert_into_table(table, upsert))
+        unique = table.__compiled__.unique_columns if upsert else ()
+
+        accepted = changed = 0
+        # committed on success and rolled back on error (a savepoint inside a transaction)
+        with self.transaction():
+            cur = self.conn.cursor()
+            for batch in batched(rows, batch_size):
+                values = [tuple(map(row.get, columns))
+                          for row, valid in zip(batch, table.validate_many(batch))
+                          if valid]
+                result.rejected += len(batch) - len(values)
+                if not values:
+                    continue
+                if unique:
+                    # probed through the unique indexes before the batch is written
+                    result.updated += self._count_conflicts(cur, table, columns, unique, values)
+                batch_start = time.perf_counter()
+                cur.executemany(sql, values)
+                if self.instrumentation.enabled:
+                    self.instrumentation.record(sql, time.perf_counter() - batch_start,
+                                                parameters=len(columns))
+                accepted += len(values)
+                # the changes of the batch: every inserted or updated row counts once
+                changed += cur.rowcount
+
+            if unique:
+                result.inserted = changed - result.updated
+            else:
+                # conflicting rows are ignored by the database
+                result.inserted = changed
+                result.rejected += accepted - changed
+
+        if self.write_listeners and changed:
+            self._dispatch(WriteEvent(table, "bulk_insert", {}, {}), pending=False)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    def _count_conflicts(cur: sqlite3.Cursor, table: Table, columns: tuple[str, ...],
+                         unique: tuple[str, ...], values: list[tuple]) -> int:
+        """Return the number of rows of 'values' that an upsert updates instead of inserting:
+        the rows with a UNIQUE value already stored or used by an earlier row of 'values'"""
+        positions = [columns.index(column) for column in unique]
+        taken = []
+        for column, position in zip(unique, positions):
+            keys = list({row[position] for row in values if row[position] is not None})
+            stored = set()
+            # bounded by the number of variables of a statement
+            for chunk in batched(keys, 500):
+                sql = f"SELECT {column} FROM {table.__tablename__} " \
+                      + f"WHERE {column} IN ({', '.join('?' * len(chunk))});"
+                stored.update(row[0] for row in cur.execute(sql, chunk))
+            taken.append(stored)
+
+        conflicts = 0
+        for row in values:
+            keys = [row[position] for position in positions]
+            if any(key in stored for key, stored in zip(keys, taken)):
+                conflicts += 1
+            for key, stored in zip(keys, taken):
+                if key is not None:
+                    stored.add(key)
+        return conflicts
+
+    def _build_bulk_insert_into_table(self, table: Table, upsert: bool) -> str:
+        schema = table.__compiled__
+        columns = schema.insert_columns
+
+        if not upsert or not schema.unique_columns:
+            sql = f"INSERT OR IGNORE INTO {table.__tablename__} \n"
+            sql += f"({', '.join(columns)}) \n"
+            sql += f"VALUES ({', '.join(['?' for _ in columns])});"
+            return sql
+
+        sql = f"INSERT INTO {table.__tablename__} \n"
+        sql += f"({', '.join(columns)}) \n"
+        sql += f"VALUES ({', '.join(['?' for _ in columns])})"
+        for unique in schema.unique_columns:
+            updates = [f"{k} = excluded.{k}" for k in columns if k != unique]
+            sql += f" \nON CONFLICT({unique}) DO UPDATE SET {', '.join(updates)}"
+        sql += ";"
+
+        return sql
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator["SQLiteDBConnection"]:
+        depth = self._transaction_depth
+        savepoint = f"transaction_{depth}"
+        cur = self.conn.cursor()
+        if depth:
+            cur.execute(f"SAVEPOINT {savepoint};")
+        elif not self.conn.in_transaction:
+            cur.execute("BEGIN;")
+
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth = depth
+            if depth:
+                cur.execute(f"ROLLBACK TO {savepoint};")
+                cur.execute(f"RELEASE {savepoint};")
+            else:
+                self.rollback()
+            raise
+        self._transaction_depth = depth
+        if depth:
+            cur.execute(f"RELEASE {savepoint};")
+            return
+        try:
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+
     def commit(self):
-        self.conn.commit()
+        if not self.instrumentation.enabled:
+            self.conn.commit()
+        else:
+            start = time.perf_counter()
+            try:
+                self.conn.commit()
+            except Exception as e:
+                self.instrumentation.record("COMMIT;", time.perf_counter() - start, error=e)
+                raise
+            self.instrumentation.record("COMMIT;", time.perf_counter() - start)
+
+        if self._pending_writes:
+            self._flush_writes()
+
+    def rollback(self):
+        self.conn.rollback()
+        if self._pending_writes:
+            self._flush_writes()
 
     def close_connection(self):
         self.conn.close()
@@ -189,3 +852,6 @@ def DBConnectionFactory(db_engine: str, db_url: str) -> DBConnection:
     match db_engine:
         case "sqlite3":
             return SQLiteDBConnection(db_url)
+        case "memory":
+            from .memory import MemoryDBConnection
+            return MemoryDBConnection(db_url)
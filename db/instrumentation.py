@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from config import QUERY_INSTRUMENTATION, SLOW_QUERY_MS, SLOW_QUERY_LOG
+from metrics import LatencyRecorder
+
+
+# guards the handlers of the slow-query logger, shared by all the instrumentations
+_log_lock = threading.Lock()
+# without a file (or a handler configured by the application), the slow statements are dropped
+# instead of reaching the last resort handler of logging (stderr)
+logging.getLogger("db.slow_queries").addHandler(logging.NullHandler())
+
+
+@dataclass
+class QueryEvent:
+    """A statement executed by a DBConnection, as seen by the instrumentation hooks.
+
+    Attributes:
+        shape (str) : The sql statement with normalized whitespace. Values are always given
+            as parameters, so statements with the same shape only differ in their parameters.
+        seconds (float) : Time spent in the database.
+        rows (int) : Number of rows returned.
+        parameters (int) : Number of bound parameters (their values are never recorded).
+        error (str | None) : The error raised by the database, if any.
+    """
+    shape: str
+    seconds: float
+    rows: int
+    parameters: int
+    error: str | None = None
+
+
+class StatementStats:
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.errors: int = 0
+        self.rows: int = 0
+        self.latency = LatencyRecorder()
+
+    def snapshot(self) -> dict[str, Any]:
+        return dict(count=self.count, errors=self.errors, rows=self.rows,
+                    latency=self.latency.snapshot())
+
+
+class QueryInstrumentation:
+    """Collects per statement shape counts, latencies, rows and errors of the statements
+    executed by the DB connections, writes the slow-query log and forwards every QueryEvent
+    to the registered hooks (e.g. to export metrics).
+
+    When it is disabled, the connections skip it completely (a single attribute check).
+
+    Args:
+        enabled (bool) : If False, nothing is recorded.
+        slow_query_ms (float | None) : Statements slower than this (in milliseconds) are written to
+            the slow-query log. None or 0 disables the log.
+        slow_query_log (str | None) : File of the slow-query log (relative paths are resolved
+            when the instrumentation is created). None only logs to the 'db.slow_queries'
+            logger. The file handler is added to the logger, once per file, when the first
+            slow statement is recorded.
+    """
+
+    def __init__(self, enabled: bool = QUERY_INSTRUMENTATION,
+                 slow_query_ms: float | None = SLOW_QUERY_MS,
+                 slow_query_log: str | None = SLOW_QUERY_LOG) -> None:
+        self.enabled: bool = enabled
+        self.slow_query_ms = slow_query_ms
+        self.hooks: list[Callable[[QueryEvent], None]] = []
+        self.logger = logging.getLogger("db.slow_queries")
+        self.slow_query_log = os.path.abspath(slow_query_log) if slow_query_log else None
+        # the file handler is attached lazily (see _attach_log)
+        self._log_attached = False
+
+        self._stats: dict[str, StatementStats] = {}
+        self._shapes: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[QueryEvent], None]) -> None:
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[QueryEvent], None]) -> None:
+        self.hooks.remove(hook)
+
+    def record(self, sql: str, seconds: float, rows: int = 0, parameters: int = 0,
+               error: Exception | None = None) -> None:
+        """Record one execution of the statement 'sql'"""
+        shape = self._shapes.get(sql)
+        if shape is None:
+            shape = " ".join(sql.split())
+            with self._lock:
+                # statements come from the builders, but guard against unbounded ad-hoc sql
+                if len(self._shapes) > 4096:
+                    self._shapes.clear()
+                self._shapes[sql] = shape
+
+        stats = self._stats.get(shape)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(shape, StatementStats())
+        with self._lock:
+            stats.count += 1
+            stats.rows += rows
+            if error is not None:
+                stats.errors += 1
+        stats.latency.record(seconds)
+
+        if self.slow_query_ms and seconds * 1000 >= self.slow_query_ms:
+            if not self._log_attached:
+                self._attach_log()
+            self.logger.warning("%.1f ms | %d params | %d rows | %s",
+                                seconds * 1000, parameters, rows, shape)
+
+        if self.hooks:
+            event = QueryEvent(shape, seconds, rows, parameters,
+                               None if error is None else str(error))
+            for hook in self.hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    print(e)
+
+    def _attach_log(self) -> None:
+        self._log_attached = True
+        if not self.slow_query_log:
+            return
+        with _log_lock:
+            if any(getattr(h, "baseFilename", None) == self.slow_query_log
+                   for h in self.logger.handlers):
+                return
+            handler = logging.FileHandler(self.slow_query_log, delay=True)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.WARNING)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Return a snapshot of the statistics of every statement shape: count, errors,
+        rows and latency (count, mean, max, p50, p95 and p99 in seconds)"""
+        with self._lock:
+            items = list(self._stats.items())
+        return {shape: stats.snapshot() for shape, stats in items}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+_instrumentation: QueryInstrumentation | None = None
+_instrumentation_lock = threading.Lock()
+
+
+def get_instrumentation() -> QueryInstrumentation:
+    """Return the instrumentation shared by all the connections (created on first use)"""
+    global _instrumentation
+    with _instrumentation_lock:
+        if _instrumentation is None:
+            _instrumentation = QueryInstrumentation()
+        return _instrumentation
@@ -0,0 +1,262 @@
+"""
+Schema fingerprinting and versioned migrations for sqlite3 databases.
+
+The fingerprint of the compiled models (see models.base.TableSchema) is stored in
+PRAGMA user_version. When the fingerprint of the database matches the models, startup
+costs a single read and no DDL is executed. When it doesn't, the pending migrations are
+applied in order inside one transaction, the missing tables and indexes are created and
+the new fingerprint is stored.
+
+Migrations are declared in ./models/migrations.py. Every time a model changes in a way that
+CREATE TABLE IF NOT EXISTS can't handle (new, removed or modified columns), add a Migration
+with the next version number that brings the existing tables up to date, e.g. with add_column
+or rebuild_table. A new full-text index (models.base.SearchIndex) needs a migration that indexes
+the existing rows with build_search_index.
+"""
+
+import hashlib
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Protocol
+
+from config import MIGRATION_BATCH_SIZE
+from models.base import Table
+
+
+class SQLiteConnection(Protocol):
+    """The part of SQLiteDBConnection used by the migrations"""
+    conn: sqlite3.Connection
+
+    def create_table(self, table: Table) -> str: ...
+
+    def create_indexes(self, table: Table) -> list[str]: ...
+
+    def create_search_index(self, table: Table) -> list[str]: ...
+
+    def rebuild_search_index(self, table: Table) -> str: ...
+
+
+@dataclass(frozen=True)
+class Migration:
+    """A change of the schema of an existing database.
+
+    Attributes:
+        version (int) : Position of the migration. Migrations are applied in increasing order.
+        description (str) : Human readable description of the change.
+        apply (Callable[[SQLiteConnection], None]) : Function that performs the change. It runs
+            inside the migration transaction and must raise on errors.
+    """
+    version: int
+    description: str
+    apply: Callable[[SQLiteConnection], None]
+
+
+class MigrationError(Exception):
+    """Raised when the migrations can't be applied. The database is left unchanged"""
+
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+
+def schema_fingerprint(models: Iterable[Table], migrations: Iterable[Migration] = ()) -> int:
+    """Return a (positive, non zero) 31 bits fingerprint of the compiled schema of 'models'
+    and of the versions of 'migrations', suitable for PRAGMA user_version.
+    """
+    digest = hashlib.sha256()
+    for model in models:
+        schema = model.__compiled__
+        digest.update(f"table {model.__tablename__}\n".encode())
+        for ddl in schema.ddl:
+            digest.update(f"{ddl}\n".encode())
+        for idx in schema.indexes:
+            digest.update(f"index {idx.name} {idx.unique} {idx.columns}\n".encode())
+        if schema.search is not None:
+            search = schema.search
+            digest.update(f"search {search.name} {search.columns} {search.prefix}\n".encode())
+    for migration in migrations:
+        digest.update(f"migration {migration.version}\n".encode())
+
+    return int.from_bytes(digest.digest()[:4], "big") & 0x7FFFFFFF or 1
+
+
+def migrate(conn: SQLiteConnection, models: Iterable[Table],
+            migrations: Iterable[Migration] = ()) -> str:
+    """Bring the database of 'conn' up to date with 'models'.
+
+    Args:
+        conn (SQLiteConnection) : A connected SQLiteDBConnection.
+        models (Iterable[Table]) : The models of the application.
+        migrations (Iterable[Migration]) : All the migrations of the application.
+
+    Return:
+        "unchanged" if the database already matched the models, "created" if the tables were
+        created in an empty database or "migrated" if an existing database was updated.
+
+    Raises:
+        MigrationError: If a migration fails or leaves foreign key violations.
+    """
+    models = list(models)
+    migrations = sorted(migrations, key=lambda m: m.version)
+    fingerprint = schema_fingerprint(models, migrations)
+
+    raw = conn.conn
+    if raw.execute("PRAGMA user_version;").fetchone()[0] == fingerprint:
+        return "unchanged"
+
+    # foreign keys can't be toggled inside a transaction and must be off while tables
+    # are rebuilt (otherwise dropping a table would cascade to the tables referencing it)
+    raw.commit()
+    raw.execute("PRAGMA foreign_keys = OFF;")
+    try:
+        raw.execute("BEGIN;")
+        try:
+            outcome = _migrate(conn, models, migrations)
+            violations = raw.execute("PRAGMA foreign_key_check;").fetchall()
+            if violations:
+                raise MigrationError(f"Foreign key violations after migrating: {violations}")
+            raw.execute(f"PRAGMA user_version = {fingerprint};")
+            raw.commit()
+        except BaseException as e:
+            raw.rollback()
+            if isinstance(e, sqlite3.Error):
+                raise MigrationError(str(e)) from e
+            raise
+    finally:
+        raw.execute("PRAGMA foreign_keys = ON;")
+
+    return outcome
+
+
+def _migrate(conn: SQLiteConnection, models: list[Table], migrations: list[Migration]) -> str:
+    raw = conn.conn
+    existing = {row[0] for row in raw.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table';")}
+    fresh = not any(model.__tablename__ in existing for model in models)
+
+    raw.execute(f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+                + "version INTEGER PRIMARY KEY, description TEXT NOT NULL, "
+                + "applied_at REAL NOT NULL);")
+    applied = {row[0] for row in raw.execute(f"SELECT version FROM {MIGRATIONS_TABLE};")}
+    record = f"INSERT INTO {MIGRATIONS_TABLE} (version, description, applied_at) VALUES (?, ?, ?);"
+
+    for migration in migrations:
+        if migration.version in applied:
+            continue
+        # an empty database is created directly with the latest schema,
+        # so its migrations are only recorded
+        if not fresh:
+            migration.apply(conn)
+        raw.execute(record, (migration.version, migration.description, time.time()))
+
+    for model in models:
+        raw.execute(conn.create_table(model))
+        for sql in conn.create_indexes(model):
+            raw.execute(sql)
+        for sql in conn.create_search_index(model):
+            raw.execute(sql)
+
+    return "created" if fresh else "migrated"
+
+
+def column_names(conn: SQLiteConnection, tablename: str) -> list[str]:
+    """Return the names of the columns of the table 'tablename' in the database"""
+    return [row[1] for row in conn.conn.execute(f"PRAGMA table_info({tablename});")]
+
+
+def add_column(conn: SQLiteConnection, table: Table, column: str) -> None:
+    """Add the column 'column' of the model 'table' to the existing table (if it is missing).
+
+    Only columns that sqlite3 can add with ALTER TABLE can be added this way (e.g. nullable
+    columns without UNIQUE). Use rebuild_table for the rest.
+    """
+    if column in column_names(conn, table.__tablename__):
+        return
+    ddl = table.__compiled__.ddl[table.__compiled__.column_names.index(column)]
+    conn.conn.execute(f"ALTER TABLE {table.__tablename__} ADD COLUMN {ddl};")
+
+
+def rebuild_table(conn: SQLiteConnection, table: Table,
+                  expressions: dict[str, str] | None = None,
+                  batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Rebuild the existing table of the model 'table' so that it matches the current model.
+
+    A new table is created with the schema of the model, the rows are copied in batches of
+    'batch_size' rows (in rowid order, so every batch is a range scan), the old table is dropped,
+    the new one renamed and the indexes recreated. Must run inside the migration transaction.
+
+    Args:
+        conn (SQLiteConnection) : A connected SQLiteDBConnection.
+        table (Table) : The model of the table.
+        expressions (dict[str, str] | None) : sql expressions over the old columns used to fill
+            the new columns, e.g. {"user_id": "1"}. Columns of the model that also exist in the old
+            table are copied as they are.
+        batch_size (int) : Number of rows copied at once.
+
+    Return:
+        The number of rows copied
+    """
+    raw = conn.conn
+    schema = table.__compiled__
+    name = table.__tablename__
+    tmp = f"{name}__rebuild"
+    expressions = expressions or {}
+
+    old_columns = set(column_names(conn, name))
+    if not old_columns:
+        # the table doesn't exist yet, it will be created with the latest schema
+        return 0
+    columns = [c for c in schema.column_names if c in expressions or c in old_columns]
+    select = ", ".join(expressions.get(c, c) for c in columns)
+
+    raw.execute(f"DROP TABLE IF EXISTS {tmp};")
+    raw.execute(f"CREATE TABLE {tmp} (\n\t{', \n\t'.join(schema.ddl)});")
+
+    copied = 0
+    last_rowid = None
+    while True:
+        if last_rowid is None:
+            row = raw.execute(f"SELECT max(rowid), count(*) FROM (SELECT rowid FROM {name} "
+                              + "ORDER BY rowid LIMIT ?);", (batch_size,)).fetchone()
+            where, parameters = "rowid <= ?", (row[0],)
+        else:
+            row = raw.execute(f"SELECT max(rowid), count(*) FROM (SELECT rowid FROM {name} "
+                              + "WHERE rowid > ? ORDER BY rowid LIMIT ?);",
+                              (last_rowid, batch_size)).fetchone()
+            where, parameters = "rowid > ? AND rowid <= ?", (last_rowid, row[0])
+        if not row[1]:
+            break
+
+        raw.execute(f"INSERT INTO {tmp} ({', '.join(columns)}) "
+                    + f"SELECT {select} FROM {name} WHERE {where};", parameters)
+        copied += row[1]
+        last_rowid = row[0]
+
+    raw.execute(f"DROP TABLE {name};")
+    raw.execute(f"ALTER TABLE {tmp} RENAME TO {name};")
+    for sql in conn.create_indexes(table):
+        raw.execute(sql)
+    # the triggers of the full-text index were dropped with the old table
+    build_search_index(conn, table)
+
+    return copied
+
+
+def build_search_index(conn: SQLiteConnection, table: Table, replace: bool = False) -> None:
+    """Create the full-text index of the model 'table' (see models.base.SearchIndex) with its
+    triggers, and index the rows already stored in the table. Nothing is done if the model
+    has no full-text index or the table doesn't exist yet.
+
+    If 'replace', the existing index and its triggers are dropped first (e.g. when the
+    SearchIndex of the model changed).
+    """
+    search = table.__compiled__.search
+    if search is None or not column_names(conn, table.__tablename__):
+        return
+    if replace:
+        for trigger in ("ai", "ad", "au"):
+            conn.conn.execute(f"DROP TRIGGER IF EXISTS {search.name}_{trigger};")
+        conn.conn.execute(f"DROP TABLE IF EXISTS {search.name};")
+    for sql in conn.create_search_index(table):
+        conn.conn.execute(sql)
+    conn.conn.execute(conn.rebuild_search_index(table))
@@ -1,41 +1,300 @@
-from typing import TypeVar, Generic
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import TypeVar, Generic, Callable, Literal
+
+from config import POOL_SIZE, POOL_TIMEOUT, POOL_MAX_LIFETIME
+from .db import SQLiteDBConnection
 
 
 T = TypeVar("T")
 
 
+class _Default(Enum):
+    TIMEOUT = "timeout"
+
+
+# default of the 'timeout' arguments: the timeout of the pool
+POOL_DEFAULT_TIMEOUT = _Default.TIMEOUT
+Timeout = float | None | Literal[_Default.TIMEOUT]
+
+
+class PoolTimeout(Exception):
+    """Raised when no object becomes available before the timeout expires"""
+
+
+class PoolClosed(Exception):
+    """Raised when acquiring an object from a closed pool"""
+
+
+@dataclass
+class PoolStats:
+    """Snapshot of the usage of a ReusablePool.
+
+    Attributes:
+        size (int) : Maximum number of objects of the pool.
+        created (int) : Number of objects currently alive (free + in use).
+        free (int) : Number of idle objects.
+        in_use (int) : Number of objects checked out.
+        acquisitions (int) : Number of successful calls to acquire.
+        timeouts (int) : Number of calls to acquire that timed out.
+        recycled (int) : Number of objects replaced because they failed the health check or
+            exceeded their maximum lifetime.
+        discarded (int) : Number of objects removed from the pool after an error.
+        total_wait (float) : Seconds spent waiting in acquire, summed over all the calls.
+        max_wait (float) : Longest wait in acquire, in seconds.
+    """
+    size: int
+    created: int
+    free: int
+    in_use: int
+    acquisitions: int
+    timeouts: int
+    recycled: int
+    discarded: int
+    total_wait: float
+    max_wait: float
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.acquisitions if self.acquisitions else 0.0
+
+    @property
+    def utilization(self) -> float:
+        return self.in_use / self.size
+
+
 class ReusablePool(Generic[T]):
-    def __init__(self, size: int) -> None:
+    """Thread safe bounded pool of reusable objects (e.g. database connections).
+
+    Objects are created lazily with 'factory' up to 'size' objects. When all of them are in use,
+    acquire blocks until one is released or the timeout expires.
+
+    Args:
+        size (int) : Maximum number of objects in the pool.
+        factory (Callable[[], T]) : Function that creates a new object.
+        check (Callable[[T], bool] | None) : Health check run on every checkout. Objects that
+            fail it are disposed and replaced by a new one.
+        reset (Callable[[T], None] | None) : Function that restores an object to a clean state
+            when it is returned by a PoolManager (e.g. rollback).
+        dispose (Callable[[T], None] | None) : Function that frees the resources of an object
+            removed from the pool (e.g. close the connection).
+        max_lifetime (float | None) : Seconds after which an object is recycled on checkout.
+        timeout (float | None) : Default seconds to wait in acquire (None waits forever).
+    """
+
+    def __init__(self, size: int, factory: Callable[[], T],
+                 check: Callable[[T], bool] | None = None,
+                 reset: Callable[[T], None] | None = None,
+                 dispose: Callable[[T], None] | None = None,
+                 max_lifetime: float | None = None,
+                 timeout: float | None = POOL_TIMEOUT) -> None:
         if size <= 0:
             raise ValueError("'size' should be greater than zero")
         self.size: int = size
-        self.free: list[T] = []
-        self.in_use: list[T] = []
+        self.factory = factory
+        self.check = check
+        self.reset = reset
+        self.dispose = dispose
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+
+        # free objects are reused LIFO so that the most recently used (warm) ones go first
+        self.free: deque[T] = deque()
+        self.in_use: dict[int, T] = {}
+        self._created_at: dict[int, float] = {}
+        self._created: int = 0
+        self._closed: bool = False
+        self._cond = threading.Condition()
+
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
 
-        for _ in range(size):
-            self.free.append(T())
+    def acquire(self, timeout: Timeout = POOL_DEFAULT_TIMEOUT) -> T:
+        """Check out an object, waiting for one to be released if the pool is exhausted.
 
-    def acquire(self) -> T:
-        if len(self.free) <= 0:
-            raise Exception("No more objects are available")
+        Args:
+            timeout (float | None) : Seconds to wait. Defaults to the timeout of the pool and
+                None waits forever.
 
-        obj = self.free[0]
-        self.free.remove(obj)
-        self.in_use.append(obj)
+        Return:
+            An object of the pool
+        """
+        if timeout is POOL_DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosed("The pool is closed")
+                if self.free:
+                    obj = self.free.pop()
+                    break
+                if self._created < self.size:
+                    # reserve the slot, the object is created outside the lock
+                    self._created += 1
+                    obj = None
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No object was available after {timeout} seconds")
+                self._cond.wait(remaining)
+
+        try:
+            if obj is None:
+                obj = self._create()
+            elif not self._is_usable(obj):
+                self._dispose(obj)
+                obj = self._create()
+                with self._cond:
+                    self._recycled += 1
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self.in_use[id(obj)] = obj
+            self._acquisitions += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
         return obj
 
     def release(self, obj: T) -> None:
-        self.in_use.remove(obj)
-        self.free.append(obj)
+        """Return 'obj' to the pool so that it can be reused"""
+        with self._cond:
+            if self.in_use.pop(id(obj), None) is None:
+                raise ValueError("The object does not belong to the pool or was already released")
+            if self._closed:
+                self._created -= 1
+            else:
+                self.free.append(obj)
+                self._cond.notify()
+                return
+        self._dispose(obj)
+
+    def discard(self, obj: T) -> None:
+        """Remove 'obj' (which is in use) from the pool, e.g. after an unrecoverable error"""
+        with self._cond:
+            if self.in_use.pop(id(obj), None) is None:
+                raise ValueError("The object does not belong to the pool or was already released")
+            self._created -= 1
+            self._discarded += 1
+            self._cond.notify()
+        self._dispose(obj)
+
+    def close(self) -> None:
+        """Dispose the free objects. Objects in use are disposed when they are released"""
+        with self._cond:
+            self._closed = True
+            free = list(self.free)
+            self.free.clear()
+            self._created -= len(free)
+            self._cond.notify_all()
+        for obj in free:
+            self._dispose(obj)
+
+    def stats(self) -> PoolStats:
+        """Return a snapshot of the usage of the pool"""
+        with self._cond:
+            return PoolStats(
+                size=self.size, created=self._created, free=len(self.free),
+                in_use=len(self.in_use), acquisitions=self._acquisitions,
+                timeouts=self._timeouts, recycled=self._recycled,
+                discarded=self._discarded, total_wait=self._total_wait,
+                max_wait=self._max_wait,
+            )
+
+    def _create(self) -> T:
+        obj = self.factory()
+        self._created_at[id(obj)] = time.monotonic()
+        return obj
+
+    def _dispose(self, obj: T) -> None:
+        self._created_at.pop(id(obj), None)
+        if self.dispose is not None:
+            try:
+                self.dispose(obj)
+            except Exception as e:
+                print(e)
+
+    def _is_usable(self, obj: T) -> bool:
+        if self.max_lifetime is not None:
+            age = time.monotonic() - self._created_at.get(id(obj), 0.0)
+            if age > self.max_lifetime:
+                return False
+        if self.check is not None:
+            try:
+                return self.check(obj)
+            except Exception:
+                return False
+        return True
 
 
 class PoolManager:
-    def __init__(self, pool: ReusablePool):
+    """Context manager that checks out an object from 'pool' and always returns it.
+
+    The object is reset (e.g. the open transaction of a connection is rolled back) before
+    being returned to the pool, and if the reset fails the object is discarded.
+    """
+
+    def __init__(self, pool: ReusablePool, timeout: Timeout = POOL_DEFAULT_TIMEOUT):
         self.pool = pool
+        self.timeout = timeout
 
     def __enter__(self) -> T:
-        self.obj = self.pool.acquire()
+        self.obj = self.pool.acquire(self.timeout)
         return self.obj
 
     def __exit__(self, type, value, traceback):
-        self.pool.release(self.obj)
+        obj = self.obj
+        del self.obj
+
+        # also on a clean exit: a block that didn't commit mustn't leak its writes
+        # (or its locks) to the next user of the object
+        if self.pool.reset is not None:
+            try:
+                self.pool.reset(obj)
+            except Exception:
+                self.pool.discard(obj)
+                return
+        self.pool.release(obj)
+
+
+def create_sqlite_pool(url: str, size: int = POOL_SIZE,
+                       timeout: float | None = POOL_TIMEOUT,
+                       max_lifetime: float | None = POOL_MAX_LIFETIME) -> ReusablePool[SQLiteDBConnection]:
+    """Create a pool of SQLiteDBConnection to the database in 'url'.
+
+    Args:
+        url (str) : The url of the sqlite3 database.
+        size (int) : Maximum number of connections.
+        timeout (float | None) : Default seconds to wait for a free connection.
+        max_lifetime (float | None) : Seconds after which a connection is recycled.
+
+    Return:
+        The pool of connections
+    """
+    def factory() -> SQLiteDBConnection:
+        conn = SQLiteDBConnection(url, check_same_thread=False)
+        conn.connect()
+        return conn
+
+    def check(conn: SQLiteDBConnection) -> bool:
+        return conn.execute("SELECT 1;") == [(1,)]
+
+    return ReusablePool(size, factory, check=check,
+                        reset=SQLiteDBConnection.rollback,
+                        dispose=SQLiteDBConnection.close_connection,
+                        max_lifetime=max_lifetime, timeout=timeout)
@@ -0,0 +1,70 @@
+"""
+Named performance profiles for sqlite3 connections.
+
+Each profile is a dictionary of PRAGMA names and values that SQLiteDBConnection applies
+when connecting. Select one with SQLITE_PROFILE in config.py:
+
+- "durable": every commit is fsynced (synchronous=FULL). Safest, slowest writes.
+- "balanced": WAL with synchronous=NORMAL. A crash can lose the last commits but never
+corrupts the database. Readers don't block writers and vice versa.
+- "throughput": WAL without fsync, bigger caches. For benchmarks and rebuildable data only.
+"""
+
+from typing import Any
+
+
+SQLITE_PROFILES: dict[str, dict[str, Any]] = {
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2_000,  # negative values are KiB
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5_000,  # milliseconds
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16_000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5_000,
+    },
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64_000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10_000,
+    },
+}
+
+# sqlite3 reports these pragmas as integers when they are read back
+_PRAGMA_ENUMS = {
+    "synchronous": {"OFF": 0, "NORMAL": 1, "FULL": 2, "EXTRA": 3},
+    "temp_store": {"DEFAULT": 0, "FILE": 1, "MEMORY": 2},
+}
+
+
+def normalize_pragma(name: str, value: Any) -> Any:
+    """Return 'value' in the format sqlite3 uses when the pragma 'name' is read back"""
+    if name in _PRAGMA_ENUMS and isinstance(value, str):
+        return _PRAGMA_ENUMS[name][value.upper()]
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def syncs_every_commit(name: str) -> bool:
+    """Return True if the profile 'name' fsyncs every commit (synchronous FULL or EXTRA,
+    FULL being the default of sqlite3)"""
+    return normalize_pragma("synchronous", get_profile(name).get("synchronous", "FULL")) >= 2
+
+
+def get_profile(name: str) -> dict[str, Any]:
+    try:
+        return SQLITE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown sqlite3 profile {name!r}. "
+                         + f"Available profiles: {', '.join(SQLITE_PROFILES)}") from None
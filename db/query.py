@@ -0,0 +1,335 @@
+"""
+Composable, parameterized SELECT statements over the models (see models.base.Table).
+
+    query = (Query(Password)
+             .select("app_name", "app_url", "username")
+             .where(Column("user_id") == user_id,
+                    Column("app_name").in_(["GitHub", "GitLab"]) | (Column("app_url") >= "https://m"))
+             .order_by("app_url")
+             .limit(20))
+    sql, parameters = conn.build_query(query)
+    rows = conn.execute(sql, parameters)
+
+Queries are immutable: every method returns a new query, so a base query can be reused.
+They are built through the connection (build_query) so that every engine can run them: the
+memory engine (see db/memory.py) evaluates the predicates built with Column in python.
+
+The rows can be read as records of the projection (named fields, the memory of a tuple):
+
+    for entry in conn.iter_query(*conn.build_query(query), row_type=query.record):
+        print(entry.app_name, entry.app_url)
+
+Pagination is done with keysets (seek) instead of OFFSET: the next page starts after the last
+row of the previous one, query.after(query.cursor(rows[-1])), so that reading a page deep into
+a big table costs the same as reading the first one (with an index matching the ORDER BY).
+The primary key is appended to the ORDER BY unless the ordered columns (with the columns fixed
+by equality conditions) cover a unique key, so that the order is total and no row is skipped or
+repeated between pages.
+"""
+
+import functools
+import operator
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Iterable
+
+from models.base import Table, make_record
+
+
+# Evaluates a predicate in python: test(value, parameters) with 'value' returning the value of
+# a column of the row. The result follows the three-valued logic of sql (None is unknown).
+Test = Callable[[Callable[[str], Any], tuple[Any, ...]], bool | None]
+
+
+def _and(left: bool | None, right: bool | None) -> bool | None:
+    if left is False or right is False:
+        return False
+    return None if left is None or right is None else True
+
+
+def _or(left: bool | None, right: bool | None) -> bool | None:
+    if left is True or right is True:
+        return True
+    return None if left is None or right is None else False
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """A parameterized sql condition, combined with & (AND), | (OR) and ~ (NOT).
+
+    Attributes:
+        sql (str) : The condition, with a ? placeholder for each parameter.
+        parameters (tuple[Any, ...]) : The values of the placeholders.
+        columns (frozenset[str]) : The columns used by the condition.
+        test (Test | None) : The condition evaluated in python, over the values of the
+            placeholders given as argument (so that it holds for any predicate with the same
+            sql). None if the condition is only known as sql.
+    """
+    sql: str
+    parameters: tuple[Any, ...] = ()
+    columns: frozenset[str] = frozenset()
+    test: Test | None = None
+
+    @property
+    def equality(self) -> str | None:
+        """The column of a 'column = ?' condition, None for any other condition"""
+        if len(self.columns) != 1:
+            return None
+        column = next(iter(self.columns))
+        return column if self.sql == f"{column} = ?" else None
+
+    def __and__(self, other: "Predicate") -> "Predicate":
+        return Predicate(f"({self.sql} AND {other.sql})", self.parameters + other.parameters,
+                         self.columns | other.columns, self._combine(other, _and))
+
+    def __or__(self, other: "Predicate") -> "Predicate":
+        return Predicate(f"({self.sql} OR {other.sql})", self.parameters + other.parameters,
+                         self.columns | other.columns, self._combine(other, _or))
+
+    def __invert__(self) -> "Predicate":
+        test = self.test
+
+        def negation(value, parameters):
+            result = test(value, parameters)
+            return None if result is None else not result
+        return Predicate(f"NOT {self.sql}", self.parameters, self.columns,
+                         None if test is None else negation)
+
+    def _combine(self, other: "Predicate",
+                 combine: Callable[[bool | None, bool | None], bool | None]) -> Test | None:
+        left, right, n = self.test, other.test, len(self.parameters)
+        if left is None or right is None:
+            return None
+        return lambda value, parameters: combine(left(value, parameters[:n]),
+                                                 right(value, parameters[n:]))
+
+
+class Column:
+    """A column in a predicate, e.g. Column("user_id") == 1 or Column("app_url").in_(urls).
+    Comparing with None gives IS NULL / IS NOT NULL."""
+
+    __hash__ = None
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def _compare(self, sql_operator: str, compare: Callable[[Any, Any], bool],
+                 value: Any) -> Predicate:
+        name = self.name
+
+        def test(row, parameters):
+            current = row(name)
+            if current is None or parameters[0] is None:
+                return None
+            return compare(current, parameters[0])
+        return Predicate(f"{name} {sql_operator} ?", (value,), frozenset((name,)), test)
+
+    def __eq__(self, value: Any) -> Predicate:
+        if value is None:
+            return Predicate(f"{self.name} IS NULL", (), frozenset((self.name,)),
+                             lambda row, parameters: row(self.name) is None)
+        return self._compare("=", operator.eq, value)
+
+    def __ne__(self, value: Any) -> Predicate:
+        if value is None:
+            return Predicate(f"{self.name} IS NOT NULL", (), frozenset((self.name,)),
+                             lambda row, parameters: row(self.name) is not None)
+        return self._compare("!=", operator.ne, value)
+
+    def __lt__(self, value: Any) -> Predicate:
+        return self._compare("<", operator.lt, value)
+
+    def __le__(self, value: Any) -> Predicate:
+        return self._compare("<=", operator.le, value)
+
+    def __gt__(self, value: Any) -> Predicate:
+        return self._compare(">", operator.gt, value)
+
+    def __ge__(self, value: Any) -> Predicate:
+        return self._compare(">=", operator.ge, value)
+
+    def in_(self, values: Iterable[Any]) -> Predicate:
+        values = tuple(values)
+        if not values:
+            # IN () is not valid sql, and nothing is in an empty list
+            return Predicate("0", (), frozenset((self.name,)), lambda row, parameters: False)
+
+        def test(row, parameters):
+            current = row(self.name)
+            if current is None:
+                return None
+            return True if current in parameters else None if None in parameters else False
+        return Predicate(f"{self.name} IN ({', '.join('?' for _ in values)})", values,
+                         frozenset((self.name,)), test)
+
+    def between(self, low: Any, high: Any) -> Predicate:
+        test = ((self >= low) & (self <= high)).test
+        return Predicate(f"{self.name} BETWEEN ? AND ?", (low, high), frozenset((self.name,)), test)
+
+
+@dataclass(frozen=True)
+class Query:
+    """A SELECT statement over the table of a model (see module docstring).
+
+    Attributes:
+        table (Table) : The model of the table.
+        columns (tuple[str, ...]) : The projection. Empty selects every column of the model.
+        predicates (tuple[Predicate, ...]) : The conditions, joined with AND.
+        order (tuple[tuple[str, bool], ...]) : The ORDER BY as (column, descending).
+        limit_ (int | None) : Maximum number of rows.
+        after_ (tuple[Any, ...] | None) : The keyset of the last row of the previous page.
+    """
+    table: Table
+    columns: tuple[str, ...] = ()
+    predicates: tuple[Predicate, ...] = ()
+    order: tuple[tuple[str, bool], ...] = ()
+    limit_: int | None = None
+    after_: tuple[Any, ...] | None = None
+
+    def _check(self, columns: Iterable[str]) -> None:
+        known = self.table.__compiled__.columns
+        for column in columns:
+            if column not in known:
+                raise ValueError(f"Unknown column {column!r} of table {self.table.__tablename__!r}")
+
+    def select(self, *columns: str) -> "Query":
+        """Read only 'columns' (in this order)"""
+        self._check(columns)
+        return replace(self, columns=columns)
+
+    def where(self, *predicates: Predicate, **equals: Any) -> "Query":
+        """Add conditions (joined with AND). Keyword arguments are equality conditions,
+        e.g. where(user_id=1) is where(Column("user_id") == 1)"""
+        predicates += tuple(Column(k) == v for k, v in equals.items())
+        for predicate in predicates:
+            self._check(predicate.columns)
+        return replace(self, predicates=self.predicates + predicates)
+
+    def order_by(self, *columns: str) -> "Query":
+        """Sort the rows by 'columns'. A leading '-' sorts the column in descending order"""
+        order = tuple((c.removeprefix("-"), c.startswith("-")) for c in columns)
+        self._check(c for c, _ in order)
+        return replace(self, order=order, after_=None)
+
+    def limit(self, limit: int) -> "Query":
+        if limit <= 0:
+            raise ValueError("'limit' should be greater than zero")
+        return replace(self, limit_=limit)
+
+    def after(self, keyset: tuple[Any, ...] | None) -> "Query":
+        """Start after the row with 'keyset' (see cursor). None starts from the first row"""
+        if keyset is not None and len(keyset) != len(self.keyset_columns):
+            raise ValueError(f"The keyset should have the values of {self.keyset_columns}")
+        return replace(self, after_=keyset)
+
+    @property
+    def record(self) -> type[tuple]:
+        """The record class of the rows of this query (see models.base.make_record)"""
+        return _projection_record(self.table, self.columns)
+
+    @property
+    def keyset_columns(self) -> tuple[str, ...]:
+        """The columns of the ORDER BY, including the primary key added as tie breaker"""
+        schema = self.table.__compiled__
+        columns = tuple(c for c, _ in self.order)
+        if schema.primary_key is None:
+            return columns
+
+        # e.g. where(user_id=1).order_by("app_url") is total with a unique (user_id, app_url)
+        fixed = {p.equality for p in self.predicates if p.equality}
+        covered = set(columns) | fixed
+        keys = [(c,) for c in (*schema.unique_columns, schema.primary_key)]
+        keys += [idx.columns for idx in schema.indexes if idx.unique]
+        if any(set(columns) & set(key) and covered.issuperset(key) for key in keys):
+            return columns
+        return columns + (schema.primary_key,)
+
+    def _order(self) -> tuple[tuple[str, bool], ...]:
+        columns = self.keyset_columns
+        if len(columns) > len(self.order):
+            # the tie breaker follows the direction of the last column
+            return self.order + ((columns[-1], self.order[-1][1] if self.order else False),)
+        return self.order
+
+    def cursor(self, row: tuple[Any, ...]) -> tuple[Any, ...]:
+        """Return the keyset of 'row' (a row returned by this query), to be given to after"""
+        selected = self.columns or self.table.__compiled__.column_names
+        try:
+            return tuple(row[selected.index(c)] for c in self.keyset_columns)
+        except ValueError:
+            raise ValueError(f"The columns {self.keyset_columns} should be selected "
+                             + "to paginate") from None
+
+    def _keyset_predicate(self) -> Predicate:
+        order = self._order()
+        columns = tuple(c for c, _ in order)
+        if len({descending for _, descending in order}) == 1:
+            # a row value comparison can be answered with a single index range
+            sign = "<" if order[0][1] else ">"
+            if len(columns) == 1:
+                column = Column(columns[0])
+                return column < self.after_[0] if order[0][1] else column > self.after_[0]
+            compare = operator.lt if order[0][1] else operator.gt
+
+            def test(row, parameters):
+                values = tuple(row(c) for c in columns)
+                if None in values or None in parameters:
+                    return None
+                return compare(values, parameters)
+            placeholders = ", ".join("?" for _ in columns)
+            return Predicate(f"({', '.join(columns)}) {sign} ({placeholders})",
+                             self.after_, frozenset(columns), test)
+
+        # mixed directions: (a > ?) OR (a = ? AND b < ?) OR ...
+        terms = []
+        tests = []
+        parameters: tuple[Any, ...] = ()
+        for i, (column, descending) in enumerate(order):
+            equal = [f"{c} = ?" for c in columns[:i]]
+            terms.append(" AND ".join(equal + [f"{column} {'<' if descending else '>'} ?"]))
+            parameters += self.after_[:i + 1]
+            # the same term built with Column, for its test
+            tests.append(functools.reduce(Predicate.__and__, [
+                *(Column(c) == v for c, v in zip(columns[:i], self.after_)),
+                Column(column) < self.after_[i] if descending else Column(column) > self.after_[i]]))
+        return Predicate(f"({' OR '.join(f'({t})' for t in terms)})", parameters,
+                         frozenset(columns), functools.reduce(Predicate.__or__, tests).test)
+
+    @property
+    def sort(self) -> tuple[tuple[str, bool], ...]:
+        """The ORDER BY as (column, descending), with the tie breaker. Empty if the rows
+        are not sorted"""
+        if self.order or self.after_ is not None:
+            return self._order()
+        return ()
+
+    @property
+    def conditions(self) -> tuple[Predicate, ...]:
+        """The predicates of the WHERE clause: the conditions of where and, with after,
+        the condition of the keyset"""
+        if self.after_ is None:
+            return self.predicates
+        return self.predicates + (self._keyset_predicate(),)
+
+    def build(self) -> tuple[str, tuple[Any, ...]]:
+        """Return the sql statement and its parameters"""
+        predicates = self.conditions
+        parameters = tuple(p for predicate in predicates for p in predicate.parameters)
+
+        sql = f"SELECT {', '.join(self.columns) or '*'} FROM {self.table.__tablename__}"
+        if predicates:
+            sql += f" \n\tWHERE {' \n\tAND '.join(p.sql for p in predicates)}"
+        if self.sort:
+            order = ", ".join(f"{c}{' DESC' if d else ''}" for c, d in self.sort)
+            sql += f" \n\tORDER BY {order}"
+        if self.limit_ is not None:
+            sql += " \n\tLIMIT ?"
+            parameters += (self.limit_,)
+
+        return sql + ";", parameters
+
+
+@functools.cache
+def _projection_record(table: Table, columns: tuple[str, ...]) -> type[tuple]:
+    if not columns or columns == table.__compiled__.column_names:
+        return table.__record__
+    return make_record(f"{table.__name__}Row", columns, table.__module__)
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class StatementCache:
+    """Bounded LRU cache for the sql statements built by a DBConnection.
+
+    The statements built by the DBConnection only depend on the table and on the
+    names of the columns involved (never on the values, which are passed as parameters),
+    so they can be memoized with a key like (table, operation, columns).
+
+    The cache can be used from several threads (e.g. by an AsyncSQLiteDBConnection, which
+    builds statements in the event loop while its worker runs bulk inserts).
+
+    Args:
+        maxsize (int) : Maximum number of statements kept in the cache. When the cache is
+            full the least recently used statement is evicted.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        if maxsize <= 0:
+            raise ValueError("'maxsize' should be greater than zero")
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._statements: OrderedDict[Hashable, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], str]) -> str:
+        """Return the statement stored under 'key', building it with 'build' if it is not cached.
+
+        Args:
+            key (Hashable) : The key of the statement, e.g. (table, "select", ("email",))
+            build (Callable[[], str]) : Function that builds the statement on a cache miss.
+
+        Return:
+            The sql statement
+        """
+        with self._lock:
+            sql = self._statements.get(key)
+            if sql is not None:
+                self.hits += 1
+                self._statements.move_to_end(key)
+                return sql
+            self.misses += 1
+
+        # the statement is built without holding the lock
+        sql = build()
+        with self._lock:
+            self._statements[key] = sql
+            self._statements.move_to_end(key)
+            if len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+                self.evictions += 1
+        return sql
+
+    def clear(self) -> None:
+        """Remove all the statements and reset the counters"""
+        with self._lock:
+            self._statements.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict[str, Any]:
+        """Return a snapshot of the cache counters"""
+        lookups = self.hits + self.misses
+        return dict(size=len(self._statements), maxsize=self.maxsize,
+                    hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_ratio=self.hits / lookups if lookups else 0.0)
+
+    def __len__(self) -> int:
+        return len(self._statements)
@@ -0,0 +1,195 @@
+"""
+Group commit of the writes of concurrent callers.
+
+Every commit waits for the database to reach the disk, so a burst of sign ups that commit one
+insert each is bound by the syncs of the disk. A GroupCommitWriter owns a connection and a
+writer thread: the callers hand over their writes, and the writer runs the writes that arrive
+within 'window' seconds of the first one (up to 'max_batch') in one transaction, commits them
+together and then gives every caller the result of its own write:
+
+    writer = GroupCommitWriter()
+    user_id = writer.run(lambda conn: conn.execute(conn.insert_into_table(User), values))
+
+A write is as durable when run returns (or its future is done) as with a commit of its own.
+Each write runs in a savepoint (see DBConnection.transaction): a write that raises is rolled
+back alone and its caller gets the exception, the other writes of the batch are committed. If
+the commit itself fails, all the writes of the batch get the error.
+
+The writer only pays off when every commit waits for an fsync: see group_commit_enabled.
+
+The writes run in the writer thread with the connection of the writer, so they should build
+their statements with the connection they are given (the write listeners only see the
+statements built by the connection that executes them, see add_write_listener). With the
+"memory" engine the writer has a database of its own.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from config import DB_ENGINE, DATABASE_URL, GROUP_COMMIT_WINDOW, GROUP_COMMIT_MAX_BATCH, \
+    GROUP_COMMIT, SQLITE_PROFILE
+from .db import DBConnection, DBConnectionFactory, WriteEvent
+from .profiles import syncs_every_commit
+
+
+def group_commit_enabled(profile: str = SQLITE_PROFILE) -> bool:
+    """Return True if the writes should go through a GroupCommitWriter: GROUP_COMMIT if it is
+    set, otherwise only when the sqlite3 'profile' fsyncs every commit"""
+    if GROUP_COMMIT is not None:
+        return GROUP_COMMIT
+    return syncs_every_commit(profile)
+
+
+class WriterClosed(Exception):
+    """Raised when a write is submitted to a closed GroupCommitWriter"""
+
+
+class GroupCommitWriter:
+    """Writer thread that commits the writes of concurrent callers together (see module docstring).
+
+    Args:
+        connection (Callable[[], DBConnection] | None) : Returns the (not connected) connection
+            of the writer, which is connected and used in the writer thread only. By default
+            a connection to DATABASE_URL with DB_ENGINE.
+        window (float) : Seconds the writer waits for more writes after the first one of a batch.
+        max_batch (int) : Maximum number of writes committed together.
+
+    Raises:
+        The error of the connection if it can't be connected.
+    """
+
+    def __init__(self, connection: Callable[[], DBConnection] | None = None,
+                 window: float = GROUP_COMMIT_WINDOW,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH) -> None:
+        if max_batch <= 0:
+            raise ValueError("'max_batch' should be greater than zero")
+        self.window = window
+        self.max_batch = max_batch
+        # number of batches committed and of writes in them
+        self.commits: int = 0
+        self.writes: int = 0
+
+        # (write, future) of the callers, None when the writer is closed
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._closed = False
+        self._lock = threading.Lock()
+
+        factory = connection or (lambda: DBConnectionFactory(DB_ENGINE, DATABASE_URL))
+        ready: Future[DBConnection] = Future()
+        self._thread = threading.Thread(target=self._loop, args=(factory, ready),
+                                        name="group-commit", daemon=True)
+        self._thread.start()
+        self.conn = ready.result()
+
+    @property
+    def batch_size(self) -> float:
+        """Average number of writes committed together"""
+        return self.writes / self.commits if self.commits else 0.0
+
+    def add_write_listener(self, listener: Callable[[WriteEvent], None]) -> None:
+        """See DBConnection.add_write_listener. The listeners are called from the writer thread."""
+        self.conn.add_write_listener(listener)
+
+    def submit[T](self, write: Callable[[DBConnection], T]) -> Future[T]:
+        """Queue 'write(conn)' to run with the connection of the writer.
+
+        Return:
+            A future with the result of 'write' (or its exception), done once the batch of
+            the write is committed
+
+        Raises:
+            WriterClosed: If the writer is closed.
+        """
+        future: Future[T] = Future()
+        with self._lock:
+            if self._closed:
+                raise WriterClosed("The writer is closed")
+            self._queue.put((write, future))
+        return future
+
+    def run[T](self, write: Callable[[DBConnection], T], timeout: float | None = None) -> T:
+        """Run 'write(conn)' with the connection of the writer and wait until it is committed.
+
+        Return:
+            The result of 'write'
+
+        Raises:
+            The exception raised by 'write' or by the commit of its batch.
+        """
+        return self.submit(write).result(timeout)
+
+    def close(self) -> None:
+        """Commit the writes already queued and close the connection of the writer"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self) -> "GroupCommitWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def _loop(self, factory: Callable[[], DBConnection], ready: Future) -> None:
+        try:
+            conn = factory()
+            conn.connect()
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(conn)
+
+        closed = False
+        while not closed:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                batch.append(item)
+            self._commit(conn, batch)
+        conn.close_connection()
+
+    def _commit(self, conn: DBConnection, batch: list[tuple[Callable, Future]]) -> None:
+        # (future, result, exception) of the writes that weren't cancelled
+        outcomes: list[tuple[Future, Any, BaseException | None]] = []
+        try:
+            with conn.transaction():
+                for write, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with conn.transaction():
+                            outcomes.append((future, write(conn), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except BaseException as e:
+            # the commit failed: nothing of the batch was saved
+            for _, future in batch:
+                if future.running() or (not future.done() and future.set_running_or_notify_cancel()):
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        self.commits += 1
+        self.writes += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
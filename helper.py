@@ -1,5 +1,7 @@
+import importlib
+import sys
 from dataclasses import dataclass
-from typing import Callable
+from typing import Any, Callable
 
 
 @dataclass
@@ -21,3 +23,25 @@ def choice(options: list[Option]) -> Option | None:
     if not (0 <= int(index) - 1 < len(options)):
         return None
     return options[int(index) - 1]
+
+
+def lazy_exports(package: str, exports: dict[str, str]) -> Callable[[str], Any]:
+    """Return a module __getattr__ (PEP 562) for 'package' that imports the submodule of
+    an exported name the first time the name is used, so that importing the package
+    doesn't import its heavy dependencies (see main.py --profile-startup).
+
+    Args:
+        package (str) : The name of the package (its __name__).
+        exports (dict[str, str]) : The relative name of the submodule of each exported name,
+            e.g. {"search": ".search"}.
+
+    Return:
+        The __getattr__ of the package
+    """
+    def __getattr__(name: str) -> Any:
+        if name not in exports:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(exports[name], package), name)
+        setattr(sys.modules[package], name, value)
+        return value
+    return __getattr__
@@ -1,13 +1,20 @@
+import sys
+
 import auth
 import db
 import password as pw
 
+from db.migrations import migrate
 from messages import Message, Messages
 from models import MODELS
+from models.migrations import MIGRATIONS
 
 # Important: First check config.py if DB_ENGINE and DATABASE_URL
 # are defined.
-from config import DB_ENGINE, DATABASE_URL
+from config import DB_ENGINE, DATABASE_URL, SERVICE_SOCKET
+
+# Only what the first prompt needs is imported on startup: argparse, asyncio, the service,
+# bcrypt and the vault are imported when they are first used (see startup.py).
 
 
 def greet():
@@ -19,8 +26,39 @@ def farewell():
     print(f"{'  Created by Eduardo Nuñez  '::^50}\n")
 
 
-def main():
+def parse_args(argv: list[str]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Password manager")
+    parser.add_argument("--serve", action="store_true",
+                        help="run the service on a Unix socket instead of the interactive app "
+                             + "(see service/)")
+    parser.add_argument("--socket", default=SERVICE_SOCKET, help="path of the socket of the service")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report the import time of each package and the time to the first "
+                             + "prompt (see startup.py)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
     """App entry point"""
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv) if argv else None
+
+    if args is not None and args.profile_startup:
+        from startup import profile_startup
+        print(profile_startup().report())
+        return
+
+    if args is not None and args.serve:
+        import asyncio
+        from service import serve
+        try:
+            asyncio.run(serve(args.socket, DATABASE_URL))
+        except KeyboardInterrupt:
+            pass
+        return
+
     greet()
 
     # create db connection
@@ -28,26 +66,40 @@ def main():
 
     # create connection
     conn.connect()
-
-    # create tables based on the models
-    for model in MODELS:
-        sql = conn.create_table(model)
-        conn.execute(sql)
-
-    while True:
-        # enter auth application
-        response: Message = auth.mainloop(conn)
-
-        match response.message:
-            case Messages.LOGIN_SUCCESS:
-                # enter password manager application with authenticated user
-                user = response.data
-                print(user)
-                print(response.message)
-                # pw.mainloop(conn, user)
-
-            case Messages.QUIT:
-                break
+    if hasattr(conn, "profile_report"):
+        print(conn.profile_report())
+
+    if DB_ENGINE == "sqlite3":
+        # create or migrate the tables based on the models (nothing is done
+        # if the schema of the database already matches the models)
+        migrate(conn, MODELS, MIGRATIONS)
+    else:
+        # the other engines start empty (see db/memory.py)
+        for model in MODELS:
+            for sql in [conn.create_table(model), *conn.create_indexes(model),
+                        *conn.create_search_index(model)]:
+                conn.execute(sql)
+
+    try:
+        while True:
+            # enter auth application
+            response: Message = auth.mainloop(conn)
+
+            match response.message:
+                case Messages.LOGIN_SUCCESS:
+                    # enter password manager application with authenticated user
+                    user = response.data
+                    while pw.mainloop(conn, user).message != Messages.LOGOUT:
+                        pass
+
+                case Messages.QUIT:
+                    break
+    except (EOFError, KeyboardInterrupt):
+        # the input was closed (Ctrl-D) or interrupted (Ctrl-C)
+        print()
+
+    # save the passwords still being rehashed with the current bcrypt cost
+    auth.save_rehashes(conn, wait=True)
     farewell()
 
 
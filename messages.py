@@ -7,6 +7,9 @@ class Messages(Enum):
     SIGN_UP_FAILURE = "sign_up_failure"
     LOGIN_SUCCESS = "login_success"
     LOGIN_FAILURE = "login_failure"
+    LOGOUT = "logout"
+    VAULT_SUCCESS = "vault_success"
+    VAULT_FAILURE = "vault_failure"
     QUIT = "quit"
 
 
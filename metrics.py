@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+from typing import Any
+
+
+def _pick(sorted_samples: list[float], p: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class LatencyRecorder:
+    """Thread safe recorder of latencies (in seconds).
+
+    It keeps exact count, total and max values, and the last 'window' samples to
+    estimate percentiles, so that memory stays bounded no matter how many samples are recorded.
+
+    Args:
+        window (int) : Number of recent samples kept to compute the percentiles.
+    """
+
+    def __init__(self, window: int = 1024) -> None:
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        """Return the 'p' percentile (0 <= p <= 100) of the recent samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        return _pick(samples, p)
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return count, mean, max, p50, p95 and p99 (in seconds)"""
+        with self._lock:
+            count, total, max_, samples = self.count, self.total, self.max, sorted(self._samples)
+        return dict(count=count, mean=total / count if count else 0.0, max=max_,
+                    p50=_pick(samples, 50), p95=_pick(samples, 95), p99=_pick(samples, 99))
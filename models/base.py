@@ -1,5 +1,173 @@
-from typing import Any
-from .typing import SQLDataType
+from collections import namedtuple
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping
+from .typing import SQLDataType, ForeignKey
+
+
+@dataclass(frozen=True)
+class Index:
+    """Index over one or more columns of a model. Models declare their indexes in the
+    class attribute __indexes__, e.g. __indexes__ = (Index("user_id", "app_url"),)
+
+    Attributes:
+        columns (tuple[str, ...]) : The indexed columns, in order.
+        unique (bool) : If True, the combination of the columns must be unique.
+        name (str | None) : The name of the index. Defaults to idx_<tablename>_<columns>.
+    """
+    columns: tuple[str, ...]
+    unique: bool = False
+    name: str | None = None
+
+    def __init__(self, *columns: str, unique: bool = False, name: str | None = None):
+        if not columns:
+            raise ValueError("An index needs at least one column")
+        object.__setattr__(self, "columns", columns)
+        object.__setattr__(self, "unique", unique)
+        object.__setattr__(self, "name", name)
+
+
+@dataclass(frozen=True)
+class SearchIndex:
+    """Full-text index (sqlite3 FTS5) over text columns of a model, kept in sync with the
+    table by triggers. Models declare it in the class attribute __search__, e.g.
+    __search__ = SearchIndex("app_name", "app_url", weights=(10.0, 5.0), owner="user_id")
+
+    Attributes:
+        columns (tuple[str, ...]) : The indexed columns, in order.
+        weights (tuple[float, ...]) : The weight of each column when ranking the matches
+            (missing weights are 1.0).
+        prefix (tuple[int, ...]) : Lengths of the prefixes indexed to make prefix queries fast.
+        name (str | None) : The name of the index table. Defaults to <tablename>_fts.
+        owner (str | None) : A column whose value is also indexed, so that a search restricted
+            to one value of it (e.g. the entries of a user) only reads the postings of that value.
+    """
+    columns: tuple[str, ...]
+    weights: tuple[float, ...] = ()
+    prefix: tuple[int, ...] = (2, 3, 4)
+    name: str | None = None
+    owner: str | None = None
+
+    def __init__(self, *columns: str, weights: tuple[float, ...] = (),
+                 prefix: tuple[int, ...] = (2, 3, 4), name: str | None = None,
+                 owner: str | None = None):
+        if not columns:
+            raise ValueError("A search index needs at least one column")
+        if len(weights) > len(columns):
+            raise ValueError("A search index can't have more weights than columns")
+        if owner in columns:
+            raise ValueError("The owner of a search index can't be one of its columns")
+        object.__setattr__(self, "columns", columns)
+        object.__setattr__(self, "weights", weights + (1.0,) * (len(columns) - len(weights)))
+        object.__setattr__(self, "prefix", prefix)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "owner", owner)
+
+
+@dataclass(frozen=True, slots=True)
+class TableSchema:
+    """Compiled (immutable) version of the schema of a Table. It is built only once,
+    when the class of the model is created, so that the hot paths (validation, sql
+    building, etc...) don't have to inspect the class attributes again.
+
+    Attributes:
+        columns (Mapping[str, SQLDataType]) : The columns of the table in declaration order.
+        column_names (tuple[str, ...]) : The names of the columns in declaration order.
+        primary_key (str | None) : The name of the primary key column (if any).
+        insert_columns (tuple[str, ...]) : The columns that can be given when inserting data
+            (every column except the primary key).
+        required (frozenset[str]) : The columns that must be given when inserting data.
+        unique_columns (tuple[str, ...]) : The columns with the UNIQUE constraint.
+        py_types (Mapping[str, type]) : The python type expected by each insertable column.
+        ddl (tuple[str, ...]) : The rendered sql definition of each column.
+        indexes (tuple[Index, ...]) : The indexes declared by the model, with their names resolved.
+        foreign_keys (Mapping[str, ForeignKey]) : The columns that reference other tables.
+        search (SearchIndex | None) : The full-text index of the model, with its name resolved.
+    """
+    columns: Mapping[str, SQLDataType]
+    column_names: tuple[str, ...]
+    primary_key: str | None
+    insert_columns: tuple[str, ...]
+    required: frozenset[str]
+    unique_columns: tuple[str, ...]
+    py_types: Mapping[str, type]
+    ddl: tuple[str, ...]
+    indexes: tuple[Index, ...]
+    foreign_keys: Mapping[str, ForeignKey]
+    search: SearchIndex | None = None
+
+
+def compile_schema(columns: dict[str, SQLDataType], tablename: str | None = None,
+                   indexes: Iterable[Index] = (),
+                   search: SearchIndex | None = None) -> TableSchema:
+    """Compile the columns of a model into a TableSchema.
+
+    Args:
+        columns (dict[str, SQLDataType]) : The columns of the model in declaration order.
+        tablename (str | None) : The name of the table, used to name the indexes.
+        indexes (Iterable[Index]) : The indexes declared by the model.
+        search (SearchIndex | None) : The full-text index declared by the model.
+
+    Return:
+        The compiled schema of the model
+    """
+    resolved_indexes = []
+    for idx in indexes:
+        for column in idx.columns:
+            if column not in columns:
+                raise ValueError(f"Index on unknown column {column!r} of table {tablename!r}")
+        name = idx.name or f"idx_{tablename}_{'_'.join(idx.columns)}"
+        resolved_indexes.append(Index(*idx.columns, unique=idx.unique, name=name))
+
+    if search is not None:
+        for column in search.columns:
+            if column not in columns or columns[column].py_type is not str:
+                raise ValueError(f"Search index on unknown or non text column {column!r} "
+                                 + f"of table {tablename!r}")
+        if search.owner is not None and search.owner not in columns:
+            raise ValueError(f"Search index owned by unknown column {search.owner!r} "
+                             + f"of table {tablename!r}")
+        search = SearchIndex(*search.columns, weights=search.weights, prefix=search.prefix,
+                             name=search.name or f"{tablename}_fts", owner=search.owner)
+
+    primary_key = next((k for k, v in columns.items() if v.primary_key), None)
+    insert_columns = tuple(k for k in columns if k != primary_key)
+
+    return TableSchema(
+        columns=MappingProxyType(dict(columns)),
+        column_names=tuple(columns),
+        primary_key=primary_key,
+        insert_columns=insert_columns,
+        required=frozenset(k for k in insert_columns if not columns[k].nullable),
+        unique_columns=tuple(k for k, v in columns.items() if v.unique),
+        py_types=MappingProxyType({
+            # NullType columns store python None values
+            k: type(None) if columns[k].py_type is None else columns[k].py_type
+            for k in insert_columns
+        }),
+        ddl=tuple(f"{k} {v.d_type} {' '.join(v.constraints)}".rstrip()
+                  for k, v in columns.items()),
+        indexes=tuple(resolved_indexes),
+        foreign_keys=MappingProxyType({k: v.references for k, v in columns.items()
+                                       if v.references is not None}),
+        search=search,
+    )
+
+
+def make_record(name: str, columns: Iterable[str], module: str | None = None) -> type[tuple]:
+    """Return a record class for rows with 'columns': a tuple subclass without instance
+    dictionary (namedtuple), so a record takes the memory of the plain tuple of the row
+    while its values can be read by name (record.email) or position (record[2]).
+
+    Args:
+        name (str) : The name of the class.
+        columns (Iterable[str]) : The names of the columns, in the order of the rows.
+        module (str | None) : The module the class is reported to belong to.
+
+    Return:
+        The record class
+    """
+    return namedtuple(name, columns, module=module)
 
 
 class Table(type):
@@ -10,6 +178,12 @@ class Table(type):
 
     2) Create new properties based on the class attributes that are generalized across
     all tables.
+
+    3) Compile the schema of the table once (see TableSchema) so that it is not
+    recomputed every time it is used, and generate the record class of its rows
+    (__record__, see make_record). Models can declare indexes in the attribute
+    __indexes__ (see Index), a full-text index in __search__ (see SearchIndex) and foreign keys with the 'references' argument of the
+    columns (see ./models/typing.py).
     """
     __tablename__ = None
 
@@ -24,22 +198,26 @@ class Table(type):
                 raise TypeError(f"{key} must be of type SQLDataType."
                                 + f"Failed with {key=}, {value=}.")
 
-        return super().__new__(cls, name, bases, attrs)
+        new_cls = super().__new__(cls, name, bases, attrs)
+        new_cls.__compiled__ = compile_schema(filtered_dict, attrs.get("__tablename__"),
+                                              attrs.get("__indexes__", ()),
+                                              attrs.get("__search__"))
+        record = make_record(f"{name}Record", new_cls.__compiled__.column_names,
+                             attrs.get("__module__"))
+        # found by pickle as <model>.__record__
+        record.__qualname__ = f"{attrs.get('__qualname__', name)}.__record__"
+        new_cls.__record__ = record
+        return new_cls
 
     @property
-    def __schema__(cls) -> dict[str, SQLDataType]:
-        """Returns the schema of this table as a dictionary where:
+    def __schema__(cls) -> Mapping[str, SQLDataType]:
+        """Returns the schema of this table as a (read only) dictionary where:
 
         1) The keys are the columns names of the table.
 
         2) The values are elements of type SQLDataType that represent the data type
         and its sql modifiers (e.g. PRIMARY KEY, NOT NULL, UNIQUE, etc...)"""
-
-        # Filter the attributes to those created by the user
-        filtered_dict = dict(filter(lambda item: not item[0].startswith("__"),
-                                    cls.__dict__.items()))
-
-        return filtered_dict
+        return cls.__compiled__.columns
 
     def validate_data(cls, data: dict[str, Any]) -> bool:
         """Validates 'data' against this Table type so that it respects the schema defined by this model.
@@ -50,30 +228,45 @@ class Table(type):
         Return:
             True if 'data' is successfully validated and False if not.
         """
-        table_schema = cls.__schema__
-        # Check if keys exist in the table
-        for key in data:
-            if key not in table_schema:
-                return False
+        schema = cls.__compiled__
+        py_types = schema.py_types
 
-        # Check type of values
+        # Check that keys exist in the table (the primary key shouldn't be part of data)
+        # and the type of values, in a single pass
         for key, value in data.items():
-            sql_data_type = table_schema.get(key, None)
-            if not isinstance(value, sql_data_type.py_type):
+            py_type = py_types.get(key)
+            if py_type is None or not isinstance(value, py_type):
                 return False
 
-        for key, value in table_schema.items():
-            # Check primary key (it shouldn't be part of data)
-            if value.primary_key and key in data:
-                return False
-            elif value.primary_key and key not in data:
-                continue
-            # Check nullability
-            if not value.nullable and key not in data:
-                return False
-            # TODO: Check uniqueness (HOW? Probably we should leave that to the DBConnection)
+        # Check nullability
+        # TODO: Check uniqueness (HOW? Probably we should leave that to the DBConnection)
+        return schema.required <= data.keys()
+
+    def validate_many(cls, rows: Iterable[dict[str, Any]]) -> list[bool]:
+        """Validates every element of 'rows' against this Table type (see validate_data).
+
+        Args:
+            rows (Iterable[dict[str, Any]]) : data to be validated against the model.
+
+        Return:
+            A list with the result of the validation of each element of 'rows', in the same order.
+        """
+        schema = cls.__compiled__
+        py_types = schema.py_types
+        required = schema.required
+        results = []
+
+        for data in rows:
+            valid = required <= data.keys()
+            if valid:
+                for key, value in data.items():
+                    py_type = py_types.get(key)
+                    if py_type is None or not isinstance(value, py_type):
+                        valid = False
+                        break
+            results.append(valid)
 
-        return True
+        return results
 
 
 class TableModel(metaclass=Table):
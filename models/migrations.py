@@ -0,0 +1,54 @@
+"""Declare the migrations of the schema here (see ./db/migrations.py).
+
+Every time a model changes in a way that CREATE TABLE IF NOT EXISTS can't apply to
+an existing database (new, removed or modified columns), append a Migration with the
+next version number to the list MIGRATIONS. Never modify or remove a migration that
+was already released.
+"""
+
+from config import LEGACY_PASSWORDS_OWNER
+from db.migrations import Migration, MigrationError, SQLiteConnection, rebuild_table, \
+    add_column, build_search_index, column_names
+from .models import User, Password
+
+
+def add_passwords_owner(conn: SQLiteConnection) -> None:
+    """Rebuild passwords with the NOT NULL column user_id. The existing passwords are given to
+    LEGACY_PASSWORDS_OWNER, or to the only user of the database if it is None.
+
+    Raises:
+        MigrationError: If there are passwords and their owner can't be decided.
+    """
+    raw = conn.conn
+    if not column_names(conn, "passwords") \
+            or raw.execute("SELECT 1 FROM passwords LIMIT 1;").fetchone() is None:
+        rebuild_table(conn, Password)
+        return
+
+    owner = LEGACY_PASSWORDS_OWNER
+    users = [row[0] for row in raw.execute("SELECT user_id FROM users LIMIT 2;")] \
+        if column_names(conn, "users") else []
+    if owner is None and len(users) != 1:
+        raise MigrationError("The passwords saved before the vault was per user need an owner, "
+                             + f"but the database has {'several' if users else 'no'} users: "
+                             + "set LEGACY_PASSWORDS_OWNER in config.py to the user_id that owns them")
+    if owner is None:
+        owner = users[0]
+    elif raw.execute("SELECT 1 FROM users WHERE user_id = ?;", (owner,)).fetchone() is None:
+        raise MigrationError(f"LEGACY_PASSWORDS_OWNER is {owner!r}, which is not a user_id of "
+                             + "the database")
+    rebuild_table(conn, Password, {"user_id": str(int(owner))})
+
+
+MIGRATIONS = [
+    Migration(1, "Add passwords.user_id (references users) and its index",
+              add_passwords_owner),
+    Migration(2, "Add users.kdf_salt (salt of the vault key)",
+              lambda conn: add_column(conn, User, "kdf_salt")),
+    Migration(3, "Add the full-text index passwords_fts (app_name, app_url, username)",
+              lambda conn: build_search_index(conn, Password)),
+    Migration(4, "Make passwords.app_url unique per user instead of globally",
+              lambda conn: rebuild_table(conn, Password)),
+    Migration(5, "Index the owner (user_id) of the entries in passwords_fts",
+              lambda conn: build_search_index(conn, Password, replace=True)),
+]
@@ -10,13 +10,18 @@ __tablename__ of type str, where you should put the name of the table you want
 to use for it in the database.
 
 4) Create all the attributes you want of type SQLDataType (Integer, Text
-Float or NullType). You should select one as a primary key.
+Float or NullType). You should select one as a primary key. Columns that
+reference other tables take a ForeignKey in the argument 'references'.
 
-5) Finally, add the models to the list MODELS at the end of this module.
+5) Optionally, declare the indexes of the table in the attribute __indexes__
+as a tuple of Index (one or more columns each), and a full-text index over
+text columns in the attribute __search__ as a SearchIndex.
+
+6) Finally, add the models to the list MODELS at the end of this module.
 """
 
-from .base import TableModel
-from .typing import SQLDataType, Integer, Text, Float, NullType
+from .base import TableModel, Index, SearchIndex
+from .typing import SQLDataType, ForeignKey, Integer, Text, Float, NullType
 
 
 # Create your models here
@@ -29,16 +34,27 @@ class User(TableModel):
     name: SQLDataType = Text(nullable=False)
     email: SQLDataType = Text(nullable=False, unique=True)
     hashed_pw: SQLDataType = Text(nullable=False)
+    # salt of the key derived from the master password to encrypt the vault
+    kdf_salt: SQLDataType = Text()
 
 
 class Password(TableModel):
     __tablename__ = "passwords"
 
+    # an app is saved once per user, different users can save the same app and username
+    __indexes__ = (Index("user_id", "app_url", unique=True),)
+    # the search of a user only reads the postings of its user_id
+    __search__ = SearchIndex("app_name", "app_url", "username", weights=(10.0, 5.0, 1.0),
+                             owner="user_id")
+
     password_id: SQLDataType = Integer(primary_key=True,
                                        unique=True)
+    user_id: SQLDataType = Integer(nullable=False,
+                                   references=ForeignKey("users", "user_id", on_delete="CASCADE"))
     app_name: SQLDataType = Text(nullable=False)
-    app_url: SQLDataType = Text(nullable=False, unique=True)
-    username: SQLDataType = Text(nullable=False, unique=True)
+    app_url: SQLDataType = Text(nullable=False)
+    username: SQLDataType = Text(nullable=False)
+    # encrypted with the vault key of the user (see ./password/vault.py)
     password: SQLDataType = Text(nullable=False)
 
 
@@ -15,7 +15,9 @@ that every entry in that column should be entered only once.
 Each item in the dictionary should follow the example: ('not_null': 'NOT NULL'), where 'not null' is the key that is used in
 tge definition of SQLDataType and 'NOT NULL' is the sqlite3 str representation of the contraint.
 
-At the moment there are 3 constraints supported, those are 'not_null', 'primary_key' and 'unique'.
+At the moment there are 5 constraints supported, those are 'not_null', 'primary_key', 'unique', 'references'
+and 'on_delete'. The last two are templates formatted with the attributes of a ForeignKey, e.g.
+('references': 'REFERENCES {table}({column})').
 
 3. Add the bindings between the database engine and the type bindings in the TYPE_BINDINGS dictionary. The
 binding should follow the example: ("sqlite3": sqlite_type_binding) where the str "sqlite3" is the key that
@@ -28,6 +30,7 @@ and sqlite_constraints is the dictionary created in step 2 (in this case for 'sq
 """
 
 from __future__ import annotations
+from dataclasses import dataclass
 from config import DB_ENGINE
 
 # Create your bindings here
@@ -45,6 +48,26 @@ sqlite_constraints = {
     "not_null": "NOT NULL",
     "primary_key": "PRIMARY KEY",
     "unique": "UNIQUE",
+    "references": "REFERENCES {table}({column})",
+    "on_delete": "ON DELETE {on_delete}",
+}
+
+# in-memory engine type bindings (see ./db/memory.py): the values are stored as python
+# objects, the names only render the schema of the tables
+memory_type_binding = {
+    int: "INTEGER",
+    float: "REAL",
+    str: "TEXT",
+    None: "NULL",
+}
+
+# in-memory engine constraints, enforced from the compiled schema (see models.base.TableSchema)
+memory_constraints = {
+    "not_null": "NOT NULL",
+    "primary_key": "PRIMARY KEY",
+    "unique": "UNIQUE",
+    "references": "REFERENCES {table}({column})",
+    "on_delete": "ON DELETE {on_delete}",
 }
 
 # Create your bindings here
@@ -52,74 +75,105 @@ sqlite_constraints = {
 # Relationship between engines and type relationships
 TYPE_BINDINGS = {
     "sqlite3": sqlite_type_binding,
+    "memory": memory_type_binding,
 }
 
 # Relationship between engines and type constraints
 SQL_CONSTRAINTS = {
     "sqlite3": sqlite_constraints,
+    "memory": memory_constraints,
 }
 
 
+@dataclass(frozen=True)
+class ForeignKey:
+    """Reference from a column to the column 'column' of the table named 'table'.
+
+    Attributes:
+        table (str) : The name (__tablename__) of the referenced table.
+        column (str) : The referenced column.
+        on_delete (str | None) : The action when the referenced row is deleted, e.g. "CASCADE".
+    """
+    table: str
+    column: str
+    on_delete: str | None = None
+
+
 class SQLDataType:
     def __init__(self, py_type: type, nullable: bool = True,
-                 primary_key: bool = False, unique: bool = False):
+                 primary_key: bool = False, unique: bool = False,
+                 references: ForeignKey | None = None):
         self.db_engine = DB_ENGINE
         self.py_type = py_type
+        self.references = references
 
         if primary_key:
             # primary_key overrides nullable and unique attributes
             self.primary_key = primary_key
             self.nullable = True
             self.unique = False
-            return
-        
-        self.primary_key = primary_key
-        self.nullable = nullable
-        self.unique = unique
+        else:
+            self.primary_key = primary_key
+            self.nullable = nullable
+            self.unique = unique
+
+        # The sql representation never changes after creation, so it is rendered once
+        self._d_type = self._render_d_type()
+        self._constraints = self._render_constraints()
 
     @property
     def d_type(self) -> str:
+        return self._d_type
+
+    @property
+    def constraints(self) -> list[str]:
+        return self._constraints
+
+    def _render_d_type(self) -> str:
         return TYPE_BINDINGS\
             .get(self.db_engine, None)\
             .get(self.py_type, None)
 
-    @property
-    def constraints(self) -> list[str]:
+    def _render_constraints(self) -> list[str]:
+        engine_constraints = SQL_CONSTRAINTS.get(self.db_engine, None)
         mods = []
         if not self.nullable:
-            mods.append(SQL_CONSTRAINTS
-                        .get(self.db_engine, None)
-                        .get("not_null", None))
+            mods.append(engine_constraints.get("not_null", None))
         if self.primary_key:
-            mods.append(SQL_CONSTRAINTS
-                        .get(self.db_engine, None)
-                        .get("primary_key", None))
+            mods.append(engine_constraints.get("primary_key", None))
         if self.unique:
-            mods.append(SQL_CONSTRAINTS
-                        .get(self.db_engine, None)
-                        .get("unique", None))
+            mods.append(engine_constraints.get("unique", None))
+        if self.references:
+            mods.append(engine_constraints.get("references", None)
+                        .format(table=self.references.table, column=self.references.column))
+            if self.references.on_delete:
+                mods.append(engine_constraints.get("on_delete", None)
+                            .format(on_delete=self.references.on_delete))
         return mods
 
     def __eq__(self, obj: SQLDataType):
         """Returns True if  obj is equal to self and False if not"""
-        return (obj.py_type, obj.nullable, obj.primary_key, obj.unique) == \
-            (self.py_type, self.nullable, self.primary_key, self.unique)
+        return (obj.py_type, obj.nullable, obj.primary_key, obj.unique, obj.references) == \
+            (self.py_type, self.nullable, self.primary_key, self.unique, self.references)
 
 
 class Integer(SQLDataType):
-    def __init__(self, nullable: bool = True, primary_key: bool = False, unique: bool = False):
+    def __init__(self, nullable: bool = True, primary_key: bool = False, unique: bool = False,
+                 references: ForeignKey | None = None):
         super().__init__(int, nullable=nullable,
-                         primary_key=primary_key, unique=unique)
+                         primary_key=primary_key, unique=unique, references=references)
 
 
 class Float(SQLDataType):
-    def __init__(self, nullable: bool = True, unique: bool = False):
-        super().__init__(float, nullable=nullable, unique=unique)
+    def __init__(self, nullable: bool = True, unique: bool = False,
+                 references: ForeignKey | None = None):
+        super().__init__(float, nullable=nullable, unique=unique, references=references)
 
 
 class Text(SQLDataType):
-    def __init__(self, nullable: bool = True, unique: bool = False):
-        super().__init__(str, nullable=nullable, unique=unique)
+    def __init__(self, nullable: bool = True, unique: bool = False,
+                 references: ForeignKey | None = None):
+        super().__init__(str, nullable=nullable, unique=unique, references=references)
 
 
 class NullType(SQLDataType):
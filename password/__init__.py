@@ -0,0 +1,5 @@
+from helper import lazy_exports
+from .search import search
+
+# the vault menus are only imported when they are first used
+__getattr__ = lazy_exports(__name__, {"mainloop": ".password"})
@@ -0,0 +1,359 @@
+"""
+Offline check of passwords against a corpus of breached passwords (e.g. the SHA-1 or NTLM
+files of Have I Been Pwned, "HASH:COUNT" per line, hundreds of millions of lines).
+
+The text corpus is converted once into a sorted binary file:
+
+    python -m password.breach convert pwned-passwords-sha1.txt breached_passwords.bin
+    python -m password.breach convert --ntlm pwned-passwords-ntlm.txt breached_passwords.bin
+    python -m password.breach convert --plaintext common-passwords.txt breached_passwords.bin
+
+and BREACH_CORPUS points to it. The file is opened with mmap, so there is nothing to load: a
+lookup reads the index entry of the first BREACH_INDEX_BITS bits of the hash and does a binary
+search over the records of that bucket (~14 steps with a billion hashes and 16 bits), touching a
+few pages of the file. The pages stay in the page cache of the system, not in the memory of the
+process. Only the first BREACH_PREFIX_BYTES bytes of each hash are kept (10 bytes = 80 bits, the
+chance that a password matches another hash of the corpus is negligible), which makes the file
+about half the size of the full hashes.
+
+Layout of the file (little endian):
+
+    header   magic b"BREACH01", algorithm (1 = SHA-1, 2 = NTLM), prefix bytes, index bits,
+             5 padding bytes, number of records (uint64)
+    index    2 ** index bits + 1 record numbers (uint64): the first record of each bucket
+             of hash prefixes, and the number of records at the end
+    records  hash prefix (prefix bytes, sorted), number of times it was seen (uint32)
+
+Sign ups with a breached password are rejected (see auth.register) and the vault warns when a
+breached password is stored (see password.store_password). Without a corpus nothing is checked.
+"""
+
+import bisect
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Iterable
+
+from config import BREACH_CORPUS, BREACH_PREFIX_BYTES, BREACH_INDEX_BITS
+
+
+MAGIC = b"BREACH01"
+HEADER = struct.Struct("<8sBBB5xQ")
+OFFSET = struct.Struct("<Q")
+COUNT = struct.Struct("<I")
+MAX_COUNT = 0xFFFFFFFF
+
+# algorithm -> (id in the header, digest size)
+ALGORITHMS = {"sha1": (1, 20), "ntlm": (2, 16)}
+
+
+class BreachCorpusError(Exception):
+    """Raised when a file is not a corpus of breached passwords, or can't be converted into one"""
+
+
+def _md4(data: bytes) -> bytes:
+    """MD4 (RFC 1320), for the builds of OpenSSL without it (NTLM hashes are MD4)"""
+    mask = 0xFFFFFFFF
+
+    def rotl(x: int, n: int) -> int:
+        x &= mask
+        return ((x << n) | (x >> (32 - n))) & mask
+
+    bits = len(data) * 8
+    data += b"\x80" + b"\x00" * ((55 - len(data)) % 64) + struct.pack("<Q", bits & 0xFFFFFFFFFFFFFFFF)
+    a, b, c, d = 0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476
+    for offset in range(0, len(data), 64):
+        x = struct.unpack_from("<16I", data, offset)
+        aa, bb, cc, dd = a, b, c, d
+        for i in (0, 4, 8, 12):
+            a = rotl(a + ((b & c) | (~b & d)) + x[i], 3)
+            d = rotl(d + ((a & b) | (~a & c)) + x[i + 1], 7)
+            c = rotl(c + ((d & a) | (~d & b)) + x[i + 2], 11)
+            b = rotl(b + ((c & d) | (~c & a)) + x[i + 3], 19)
+        for i in (0, 1, 2, 3):
+            a = rotl(a + ((b & c) | (b & d) | (c & d)) + x[i] + 0x5A827999, 3)
+            d = rotl(d + ((a & b) | (a & c) | (b & c)) + x[i + 4] + 0x5A827999, 5)
+            c = rotl(c + ((d & a) | (d & b) | (a & b)) + x[i + 8] + 0x5A827999, 9)
+            b = rotl(b + ((c & d) | (c & a) | (d & a)) + x[i + 12] + 0x5A827999, 13)
+        for i in (0, 2, 1, 3):
+            a = rotl(a + (b ^ c ^ d) + x[i] + 0x6ED9EBA1, 3)
+            d = rotl(d + (a ^ b ^ c) + x[i + 8] + 0x6ED9EBA1, 9)
+            c = rotl(c + (d ^ a ^ b) + x[i + 4] + 0x6ED9EBA1, 11)
+            b = rotl(b + (c ^ d ^ a) + x[i + 12] + 0x6ED9EBA1, 15)
+        a, b, c, d = (a + aa) & mask, (b + bb) & mask, (c + cc) & mask, (d + dd) & mask
+    return struct.pack("<4I", a, b, c, d)
+
+
+def password_digest(password: str, algorithm: str = "sha1") -> bytes:
+    """Return the hash of 'password' used by the corpora of the algorithm ("sha1" or "ntlm")"""
+    if algorithm == "sha1":
+        return hashlib.sha1(password.encode("utf8")).digest()
+    if algorithm == "ntlm":
+        data = password.encode("utf-16-le")
+        if "md4" in hashlib.algorithms_available:
+            return hashlib.new("md4", data).digest()
+        return _md4(data)
+    raise ValueError(f"Unknown algorithm {algorithm!r}, should be one of {', '.join(ALGORITHMS)}")
+
+
+def _bucket(digest: bytes, index_bits: int) -> int:
+    return int.from_bytes(digest[:4], "big") >> (32 - index_bits)
+
+
+class _Records:
+    """The hash prefixes of the records of the file, as a sequence for bisect"""
+
+    def __init__(self, data: mmap.mmap, offset: int, prefix_bytes: int) -> None:
+        self.data = data
+        self.offset = offset
+        self.prefix_bytes = prefix_bytes
+        self.size = prefix_bytes + COUNT.size
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.offset + i * self.size
+        return self.data[start:start + self.prefix_bytes]
+
+    def count(self, i: int) -> int:
+        return COUNT.unpack_from(self.data, self.offset + i * self.size + self.prefix_bytes)[0]
+
+
+class BreachChecker:
+    """Lookups in a corpus of breached passwords converted by convert (see module docstring).
+
+    Args:
+        path (str) : The path of the converted corpus.
+
+    Raises:
+        BreachCorpusError: If the file is not a converted corpus.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER.size:
+                raise BreachCorpusError(f"{path} is not a corpus of breached passwords")
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_RANDOM"):
+            # the lookups jump around the file, reading ahead only wastes the page cache
+            self._data.madvise(mmap.MADV_RANDOM)
+
+        magic, algorithm, self.prefix_bytes, self.index_bits, self.count = \
+            HEADER.unpack_from(self._data)
+        algorithms = {number: name for name, (number, _) in ALGORITHMS.items()}
+        self._index = HEADER.size
+        records = self._index + (2 ** self.index_bits + 1) * OFFSET.size
+        expected = records + self.count * (self.prefix_bytes + COUNT.size)
+        if magic != MAGIC or algorithm not in algorithms or size != expected:
+            self._data.close()
+            raise BreachCorpusError(f"{path} is not a corpus of breached passwords")
+        self.algorithm = algorithms[algorithm]
+        self._records = _Records(self._data, records, self.prefix_bytes)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, digest: bytes) -> int:
+        """Return the number of times the hash 'digest' was seen in breaches (0 if never)"""
+        prefix = digest[:self.prefix_bytes]
+        bucket = _bucket(digest, self.index_bits) * OFFSET.size + self._index
+        lo, hi = struct.unpack_from("<2Q", self._data, bucket)
+        i = bisect.bisect_left(self._records, prefix, lo, hi)
+        if i < hi and self._records[i] == prefix:
+            return self._records.count(i)
+        return 0
+
+    def times_breached(self, password: str) -> int:
+        """Return the number of times 'password' was seen in breaches (0 if never)"""
+        return self.lookup(password_digest(password, self.algorithm))
+
+    def close(self) -> None:
+        self._data.close()
+
+    def __enter__(self) -> "BreachChecker":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _parse(lines: Iterable[str], algorithm: str, plaintext: bool) -> Iterable[tuple[bytes, int]]:
+    """(digest, count) of the lines of a text corpus. The lines that can't be parsed are skipped."""
+    digest_size = ALGORITHMS[algorithm][1]
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if plaintext:
+            if line:
+                yield password_digest(line, algorithm), 1
+            continue
+        hex_digest, _, count = line.strip().partition(":")
+        try:
+            digest = bytes.fromhex(hex_digest)
+            seen = int(count) if count else 1
+        except ValueError:
+            continue
+        if len(digest) == digest_size and seen > 0:
+            yield digest, seen
+
+
+def _merge(records: list[bytes], prefix_bytes: int) -> tuple[list[bytes], list[bytes]]:
+    """Merge the sorted records of the same hash prefix into one with the sum of their counts"""
+    merged: list[list] = []
+    for record in records:
+        prefix, seen = record[:prefix_bytes], COUNT.unpack_from(record, prefix_bytes)[0]
+        if merged and merged[-1][0] == prefix:
+            merged[-1][1] = min(merged[-1][1] + seen, MAX_COUNT)
+        else:
+            merged.append([prefix, seen])
+    return ([prefix + COUNT.pack(seen) for prefix, seen in merged],
+            [prefix for prefix, _ in merged])
+
+
+def convert(lines: Iterable[str], output: str, algorithm: str = "sha1",
+            plaintext: bool = False, prefix_bytes: int = BREACH_PREFIX_BYTES,
+            index_bits: int = BREACH_INDEX_BITS) -> int:
+    """Write the corpus of 'lines' into the file 'output' (see module docstring).
+
+    The lines are "HASH:COUNT" or "HASH" (hexadecimal, in any order and case), or passwords
+    if 'plaintext'. The hashes are first spread over 256 temporary files by their first byte,
+    so only 1/256 of the corpus is sorted in memory at once. The same hash prefix seen in
+    several lines is written once, with the sum of the counts.
+
+    Args:
+        lines (Iterable[str]) : The lines of the text corpus.
+        output (str) : The path of the converted corpus.
+        algorithm (str) : "sha1" or "ntlm", the hash of the corpus.
+        plaintext (bool) : True if the lines are passwords instead of hashes.
+        prefix_bytes (int) : Bytes of each hash that are kept.
+        index_bits (int) : Bits of the hash prefix index (from 1 to 24).
+
+    Return:
+        The number of records written
+    """
+    import tempfile
+
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm {algorithm!r}, should be one of {', '.join(ALGORITHMS)}")
+    if not 4 <= prefix_bytes <= ALGORITHMS[algorithm][1]:
+        raise ValueError(f"'prefix_bytes' should be between 4 and {ALGORITHMS[algorithm][1]}")
+    if not 1 <= index_bits <= 24:
+        raise ValueError("'index_bits' should be between 1 and 24")
+
+    size = prefix_bytes + COUNT.size
+    shift = 32 - index_bits
+    # the first key of every bucket of the index, by the partition (first byte) it falls in
+    starts: list[list[tuple[int, bytes]]] = [[] for _ in range(256)]
+    for bucket in range(2 ** index_bits):
+        key = (bucket << shift).to_bytes(4, "big")
+        starts[key[0]].append((bucket, key))
+    offsets = [0] * (2 ** index_bits + 1)
+    count = 0
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as tmp:
+        paths = [os.path.join(tmp, f"{i:02x}") for i in range(256)]
+        buffers = [bytearray() for _ in range(256)]
+        with contextlib.ExitStack() as stack:
+            parts = [stack.enter_context(open(path, "wb")) for path in paths]
+            for digest, seen in _parse(lines, algorithm, plaintext):
+                buffer = buffers[digest[0]]
+                buffer += digest[:prefix_bytes]
+                buffer += COUNT.pack(min(seen, MAX_COUNT))
+                if len(buffer) >= 1 << 16:
+                    parts[digest[0]].write(buffer)
+                    buffer.clear()
+            for part, buffer in zip(parts, buffers):
+                part.write(buffer)
+
+        with open(output, "wb") as file:
+            file.seek(HEADER.size + len(offsets) * OFFSET.size)
+            for partition, path in enumerate(paths):
+                with open(path, "rb") as data:
+                    records = data.read()
+                os.unlink(path)
+                # sorted by prefix (the count follows the prefix in the records)
+                records = sorted(records[i:i + size] for i in range(0, len(records), size))
+                prefixes = [record[:prefix_bytes] for record in records]
+                if len(set(prefixes)) < len(prefixes):
+                    records, prefixes = _merge(records, prefix_bytes)
+                file.write(b"".join(records))
+                for bucket, key in starts[partition]:
+                    offsets[bucket] = count + bisect.bisect_left(prefixes, key)
+                count += len(records)
+
+            offsets[-1] = count
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, ALGORITHMS[algorithm][0], prefix_bytes, index_bits, count))
+            file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+    return count
+
+
+_checker: BreachChecker | None = None
+_checker_loaded = False
+_checker_lock = threading.Lock()
+
+
+def get_breach_checker() -> BreachChecker | None:
+    """Return the checker of BREACH_CORPUS (opened on first use), or None if there is no corpus"""
+    global _checker, _checker_loaded
+    with _checker_lock:
+        if not _checker_loaded:
+            if BREACH_CORPUS is not None and os.path.exists(BREACH_CORPUS):
+                _checker = BreachChecker(BREACH_CORPUS)
+            _checker_loaded = True
+        return _checker
+
+
+def times_breached(password: str) -> int:
+    """Return the number of times 'password' was seen in breaches (0 if never or if there
+    is no corpus)"""
+    checker = get_breach_checker()
+    return 0 if checker is None else checker.times_breached(password)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    from getpass import getpass
+
+    parser = argparse.ArgumentParser(description="Check passwords against a corpus of breached passwords")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", help="convert a text corpus into the file read by the check")
+    convert_parser.add_argument("input", help="the text corpus, HASH:COUNT per line ('-' reads stdin)")
+    convert_parser.add_argument("output", help="the path of the converted corpus")
+    convert_parser.add_argument("--ntlm", action="store_true", help="the hashes are NTLM (default SHA-1)")
+    convert_parser.add_argument("--plaintext", action="store_true",
+                                help="the lines are passwords instead of hashes")
+    convert_parser.add_argument("--prefix-bytes", type=int, default=BREACH_PREFIX_BYTES,
+                                help="bytes of each hash that are kept")
+    convert_parser.add_argument("--index-bits", type=int, default=BREACH_INDEX_BITS,
+                                help="bits of the hash prefix index")
+    check_parser = commands.add_parser("check", help="check a password (asked without echo)")
+    check_parser.add_argument("--corpus", default=BREACH_CORPUS, help="the path of the converted corpus")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "convert":
+            algorithm = "ntlm" if args.ntlm else "sha1"
+            if args.input == "-":
+                count = convert(sys.stdin, args.output, algorithm, args.plaintext,
+                                args.prefix_bytes, args.index_bits)
+            else:
+                with open(args.input, encoding="utf8", errors="replace") as lines:
+                    count = convert(lines, args.output, algorithm, args.plaintext,
+                                    args.prefix_bytes, args.index_bits)
+            print(f"{count} hashes written to {args.output}.")
+        else:
+            with BreachChecker(args.corpus) as checker:
+                seen = checker.times_breached(getpass(f"{'Enter password: ':<25}"))
+            print(f"Seen {seen} times in breaches." if seen else "Not found in the corpus.")
+    except (BreachCorpusError, ValueError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,232 @@
-import bcrypt
+import csv
 from getpass import getpass
+from typing import Any, Iterable, Iterator, TextIO
 
 import db
+from models.models import Password
 from helper import Option, index, choice
 from messages import Messages, Message
+from config import SEARCH_PAGE_SIZE, VAULT_PAGE_SIZE
+from db.query import Query
+from .breach import times_breached
+from .search import search
+from .vault import PREFIX, VaultCipher, cipher_for, session_keys, VaultKeyError, \
+    VaultDecryptionError
 
 
-def print_all_passwords(conn: db.DBConnection, user: db.models.User):
-    passwords = conn.select_from_table_where("password", user_id=user.user_id)
-    for password in passwords:
-        print(password)
+# Columns read by the listings and the export (ids are never shown)
+LISTED_COLUMNS = ("app_name", "app_url", "username", "password")
 
 
-def print_password_by_url(conn: db.Connection, user: db.models.User):
+def store_password(conn: db.DBConnection, user: dict[str, Any], app_name: str,
+                   app_url: str, username: str, plain_pw: str) -> Message:
+    """Encrypt and save a new entry in the vault of the user (without prompting).
+
+    Return:
+        A VAULT_SUCCESS message with the number of times the password was seen in breaches as
+        data (see password/breach.py), or a VAULT_FAILURE message with the reason of the failure
+    """
+    entry = dict(user_id=user["user_id"], app_name=app_name, app_url=app_url,
+                 username=username, password=cipher_for(user["user_id"]).encrypt(plain_pw))
+
+    if not Password.validate_data(entry):
+        return Message(Messages.VAULT_FAILURE, "Data entered is invalid. Please, try again.")
+
+    sql = conn.insert_into_table(Password)
+    values = tuple(entry.get(column) for column in Password.__compiled__.insert_columns)
+    try:
+        with conn.transaction():
+            conn.execute(sql, values)
+    except Exception:
+        # e.g. the user already saved a password for this url
+        return Message(Messages.VAULT_FAILURE, "The password couldn't be saved. Is there "
+                       + "already a password for this url?")
+
+    # the password is saved anyway, it may be the one still used by the app
+    return Message(Messages.VAULT_SUCCESS, times_breached(plain_pw))
+
+
+def encrypt_legacy_passwords(conn: db.DBConnection, user_id: int, cipher: VaultCipher) -> int:
+    """Encrypt the passwords of the user that are stored in plain text: the passwords saved
+    before the vault was encrypted, given to the user by the migrations (see
+    models/migrations.py). Call it inside a transaction.
+
+    Return:
+        The number of passwords encrypted
+    """
+    sql, parameters = conn.build_query(
+        Query(Password).select("password_id", "password").where(user_id=user_id))
+    legacy = [(password_id, value) for password_id, value in conn.execute(sql, parameters)
+              if not value.startswith(PREFIX)]
+
+    update = conn.update_from_table_where(Password, dict(password_id=None), dict(password=None))
+    for password_id, value in legacy:
+        conn.execute(update, (cipher.encrypt(value), password_id))
+    return len(legacy)
+
+
+def _vault_query(user: dict[str, Any], columns: tuple[str, ...]) -> Query:
+    # ordered by the index (user_id, app_url): no sort, and pages are index seeks
+    return Query(Password).select(*columns).where(user_id=user["user_id"]).order_by("app_url")
+
+
+def _decrypt_rows(user: dict[str, Any], columns: tuple[str, ...],
+                  rows: Iterable[tuple[Any, ...]]) -> Iterator[dict[str, Any]]:
+    cipher = cipher_for(user["user_id"])
+    for row in rows:
+        entry = dict(zip(columns, row))
+        if "password" in entry:
+            entry["password"] = cipher.decrypt(entry["password"])
+        yield entry
+
+
+def iter_passwords(conn: db.DBConnection, user: dict[str, Any],
+                   columns: tuple[str, ...] = LISTED_COLUMNS,
+                   **conditions: Any) -> Iterator[dict[str, Any]]:
+    """Yield the 'columns' of the entries of the vault of the user matching 'conditions',
+    decrypted, in app_url order.
+
+    The rows are streamed from the database and decrypted as they are consumed with a
+    single cipher, so listing the vault costs no key derivation and constant memory.
+    """
+    sql, parameters = conn.build_query(_vault_query(user, columns).where(**conditions))
+    yield from _decrypt_rows(user, columns, conn.iter_query(sql, parameters))
+
+
+def page_passwords(conn: db.DBConnection, user: dict[str, Any], after: str | None = None,
+                   limit: int = VAULT_PAGE_SIZE, columns: tuple[str, ...] = LISTED_COLUMNS
+                   ) -> tuple[list[dict[str, Any]], str | None]:
+    """Return a page of the vault of the user (in app_url order), decrypted.
+
+    Pages are read with keyset pagination (see db/query.py), so reading a page deep into
+    the vault costs the same as reading the first one.
+
+    Args:
+        after (str | None) : The cursor returned with the previous page (None for the first page).
+        limit (int) : The number of entries of the page.
+        columns (tuple[str, ...]) : The columns read. Must include app_url.
+
+    Return:
+        The entries of the page and the cursor of the next page (None if it is the last one)
+    """
+    query = _vault_query(user, columns).limit(limit)
+    if after is not None:
+        query = query.after((after,))
+    rows = conn.execute(*conn.build_query(query))
+
+    cursor = query.cursor(rows[-1])[0] if len(rows) == limit else None
+    return list(_decrypt_rows(user, columns, rows)), cursor
+
+
+def write_passwords_csv(conn: db.DBConnection, user: dict[str, Any], file: TextIO) -> int:
+    """Write the decrypted vault of the user to 'file' as csv.
+
+    Return:
+        The number of entries written
+    """
+    writer = csv.writer(file)
+    writer.writerow(LISTED_COLUMNS)
+
+    count = 0
+    for entry in iter_passwords(conn, user):
+        writer.writerow([entry[column] for column in LISTED_COLUMNS])
+        count += 1
+    return count
+
+
+def _print_entry(entry: dict[str, Any]):
+    print(f"{entry['app_name']:<20} {entry['app_url']:<30} {entry['username']:<20} {entry['password']}")
+
+
+def add_password(conn: db.DBConnection, user: dict[str, Any]) -> Message:
+    app_name = input(f"{'Enter app name: ':<25}")
+    app_url = input(f"{'Enter url: ':<25}")
+    username = input(f"{'Enter username: ':<25}")
+    plain_pw = getpass(f"{'Enter password: ':<25}")
+
+    response = store_password(conn, user, app_name, app_url, username, plain_pw)
+    if response.message == Messages.VAULT_FAILURE:
+        print(f"\n{response.data}")
+    else:
+        print(f"\nPassword for {app_name} saved successfully.\n")
+        if response.data:
+            print(f"Warning: this password was seen {response.data} times in data breaches. "
+                  + "Consider changing it.\n")
+    return response
+
+
+def print_all_passwords(conn: db.DBConnection, user: dict[str, Any]) -> Message:
+    # one page at a time, the vault is never fully loaded in memory
+    cursor = None
+    while True:
+        entries, cursor = page_passwords(conn, user, cursor)
+        for entry in entries:
+            _print_entry(entry)
+        if cursor is None or input("\nShow more passwords? [y/N] ").lower() != "y":
+            break
+    return Message(Messages.VAULT_SUCCESS, None)
+
+
+def print_password_by_url(conn: db.DBConnection, user: dict[str, Any]) -> Message:
     url = input(f"{'Enter url':<25}")
-    password = conn.select_from_table_where("password", user_id=user.user_id, url=url)
-    print(password)
+    for entry in iter_passwords(conn, user, app_url=url):
+        _print_entry(entry)
+    return Message(Messages.VAULT_SUCCESS, None)
+
+
+def search_passwords(conn: db.DBConnection, user: dict[str, Any]) -> Message:
+    query = input(f"{'Search: ':<25}")
+    offset = 0
+    while True:
+        entries = search(conn, user, query, SEARCH_PAGE_SIZE, offset)
+        for entry in entries:
+            _print_entry(entry)
+        if len(entries) < SEARCH_PAGE_SIZE or input("\nShow more results? [y/N] ").lower() != "y":
+            break
+        offset += SEARCH_PAGE_SIZE
+    if offset == 0 and not entries:
+        print(f"\nNo passwords match {query!r}.\n")
+    return Message(Messages.VAULT_SUCCESS, None)
 
 
-def mainloop(conn: db.DBConnection, user: db.models.User) -> Message:
-    print(f"\n{'  AUTHENTICATION  '::^50}\n")
-    options = {
-        "1": Option("Print all passwords", print_all_passwords),
-        "2": Option("Print password by url", print_password_by_url),
-        "3": Option("Logout", lambda _: Message(Messages.LOGOUT, None)),
-    }
+def export_passwords(conn: db.DBConnection, user: dict[str, Any]) -> Message:
+    path = input(f"{'Enter csv file: ':<25}")
+    with open(path, "w", newline="") as f:
+        count = write_passwords_csv(conn, user, f)
+    print(f"\n{count} passwords exported to {path}.\n")
+    return Message(Messages.VAULT_SUCCESS, count)
+
+
+def logout(conn: db.DBConnection, user: dict[str, Any]) -> Message:
+    session_keys.wipe(user["user_id"])
+    return Message(Messages.LOGOUT, None)
+
+
+def mainloop(conn: db.DBConnection, user: dict[str, Any]) -> Message:
+    print(f"\n{'  VAULT  '::^50}\n")
+    options = [
+        Option("Add password", add_password),
+        Option("Print all passwords", print_all_passwords),
+        Option("Print password by url", print_password_by_url),
+        Option("Search passwords", search_passwords),
+        Option("Export passwords", export_passwords),
+        Option("Logout", logout),
+    ]
 
     index(options)
-    option: Option = choice(options)
+    option = choice(options)
+
+    if not option:
+        print("Invalid input. Please try again.")
+        return mainloop(conn, user)
 
-    response: Message = option.func(conn, user)
+    try:
+        response: Message = option.func(conn, user)
+    except VaultKeyError as e:
+        print(f"\n{e}")
+        return logout(conn, user)
+    except VaultDecryptionError as e:
+        print(f"\n{e}")
+        return Message(Messages.VAULT_FAILURE, str(e))
 
     return response
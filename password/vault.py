@@ -0,0 +1,186 @@
+"""
+Authenticated encryption of the vault entries.
+
+The key of a user is derived once from the master password (scrypt) when the user logs in,
+and kept in a session scoped cache (SessionKeyCache) until it expires or the user logs out.
+Every field is encrypted with AES-256-GCM using a random nonce, and bound to the user and the
+name of the field as associated data, so ciphertexts can't be swapped between users or fields.
+
+Encrypted values are stored as text: 'v1:' followed by the urlsafe base64 of nonce + ciphertext.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import secrets
+import threading
+import time
+from typing import Iterable, Iterator
+
+from config import VAULT_KEY_TTL, VAULT_KDF_COST
+
+
+PREFIX = "v1:"
+NONCE_SIZE = 12
+KEY_SIZE = 32
+
+
+class VaultKeyError(Exception):
+    """Raised when the key of a user is not available (not logged in or expired)"""
+
+
+class VaultDecryptionError(Exception):
+    """Raised when a value can't be authenticated with the key of the user"""
+
+
+def new_salt() -> str:
+    """Return a new random salt for derive_key (hex encoded)"""
+    return secrets.token_hex(16)
+
+
+def derive_key(master_password: str, salt: str, cost: int = VAULT_KDF_COST) -> bytes:
+    """Derive the vault key of a user from the master password with scrypt.
+
+    Args:
+        master_password (str) : The plain master password of the user.
+        salt (str) : The (hex encoded) salt of the user, see new_salt.
+        cost (int) : log2 of the scrypt CPU/memory cost parameter N.
+
+    Return:
+        The 32 bytes key
+    """
+    return hashlib.scrypt(master_password.encode("utf8"), salt=bytes.fromhex(salt),
+                          n=2 ** cost, r=8, p=1, maxmem=2 * 128 * 8 * 2 ** cost,
+                          dklen=KEY_SIZE)
+
+
+class SessionKeyCache:
+    """Keeps the vault keys of the logged in users for 'ttl' seconds.
+
+    Keys are stored in bytearrays that are overwritten with zeros when they expire or
+    are wiped, so they don't linger in memory after the session ends.
+
+    Args:
+        ttl (float) : Seconds a key stays available after the login.
+    """
+
+    def __init__(self, ttl: float = VAULT_KEY_TTL) -> None:
+        self.ttl = ttl
+        self._keys: dict[int, tuple[bytearray, float]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, user_id: int, key: bytes) -> None:
+        with self._lock:
+            self._wipe(user_id)
+            self._keys[user_id] = (bytearray(key), time.monotonic() + self.ttl)
+
+    def get(self, user_id: int) -> bytes:
+        """Return the key of the user
+
+        Raises:
+            VaultKeyError: If the user has no key or it expired.
+        """
+        with self._lock:
+            entry = self._keys.get(user_id)
+            if entry is None:
+                raise VaultKeyError("The vault is locked. Please, log in again.")
+            key, expires = entry
+            if time.monotonic() > expires:
+                self._wipe(user_id)
+                raise VaultKeyError("The session expired. Please, log in again.")
+            return bytes(key)
+
+    def wipe(self, user_id: int) -> None:
+        """Forget the key of the user (e.g. on logout)"""
+        with self._lock:
+            self._wipe(user_id)
+
+    def wipe_all(self) -> None:
+        with self._lock:
+            for user_id in list(self._keys):
+                self._wipe(user_id)
+
+    def _wipe(self, user_id: int) -> None:
+        entry = self._keys.pop(user_id, None)
+        if entry is not None:
+            key = entry[0]
+            key[:] = bytes(len(key))
+
+    def __contains__(self, user_id: int) -> bool:
+        with self._lock:
+            entry = self._keys.get(user_id)
+            return entry is not None and time.monotonic() <= entry[1]
+
+
+class VaultCipher:
+    """Encrypts and decrypts the fields of the vault of one user with its key.
+    Create one per operation (e.g. per listing) and use it for all the entries.
+
+    Args:
+        key (bytes) : The key of the user (see derive_key).
+        user_id (int) : The id of the user, bound to every ciphertext.
+    """
+
+    def __init__(self, key: bytes, user_id: int) -> None:
+        # cryptography is imported when the first vault is opened, not on startup
+        from cryptography.exceptions import InvalidTag
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self._aead = AESGCM(key)
+        self._invalid_tag = InvalidTag
+        self.user_id = user_id
+
+    def _aad(self, field: str) -> bytes:
+        return f"{self.user_id}:{field}".encode("utf8")
+
+    def encrypt(self, value: str, field: str = "password") -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = self._aead.encrypt(nonce, value.encode("utf8"), self._aad(field))
+        return PREFIX + base64.urlsafe_b64encode(nonce + ciphertext).decode("ascii")
+
+    def decrypt(self, value: str, field: str = "password") -> str:
+        return self._decrypt(value, self._aad(field))
+
+    def _decrypt(self, value: str, aad: bytes) -> str:
+        if not value.startswith(PREFIX):
+            raise VaultDecryptionError("The value is not encrypted with a supported format")
+        try:
+            data = base64.urlsafe_b64decode(value[len(PREFIX):])
+        except (binascii.Error, ValueError):
+            # not base64, or not ASCII
+            raise VaultDecryptionError("The value is not encrypted with a supported format") from None
+        try:
+            plain = self._aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], aad)
+        except self._invalid_tag:
+            raise VaultDecryptionError("The value can't be authenticated") from None
+        return plain.decode("utf8")
+
+    def encrypt_many(self, values: Iterable[str], field: str = "password") -> list[str]:
+        aad = self._aad(field)
+        encrypt = self._aead.encrypt
+        result = []
+        for value in values:
+            nonce = os.urandom(NONCE_SIZE)
+            ciphertext = encrypt(nonce, value.encode("utf8"), aad)
+            result.append(PREFIX + base64.urlsafe_b64encode(nonce + ciphertext).decode("ascii"))
+        return result
+
+    def decrypt_many(self, values: Iterable[str], field: str = "password") -> Iterator[str]:
+        """Decrypt 'values' lazily (so it can be chained to a streamed query)"""
+        aad = self._aad(field)
+        for value in values:
+            yield self._decrypt(value, aad)
+
+
+# Keys of the users logged in this process
+session_keys = SessionKeyCache()
+
+
+def cipher_for(user_id: int) -> VaultCipher:
+    """Return a VaultCipher with the session key of the user
+
+    Raises:
+        VaultKeyError: If the user has no key or it expired.
+    """
+    return VaultCipher(session_keys.get(user_id), user_id)
@@ -0,0 +1,2 @@
+from .server import Server, serve
+from .protocol import ServiceError
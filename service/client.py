@@ -0,0 +1,164 @@
+"""
+Client of the service (see ./service/server.py).
+
+    python -m service.client sign-up "Eduardo" eduardo@mail.com
+    python -m service.client login eduardo@mail.com
+    export PASSWORD_MANAGER_TOKEN=<the token printed by login>
+    python -m service.client add GitHub https://github.com eduardo
+    python -m service.client list
+    python -m service.client search git
+    python -m service.client lookup https://github.com
+    python -m service.client logout
+
+The passwords are always prompted (never given as arguments).
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import sys
+from getpass import getpass
+from typing import Any
+
+from config import SERVICE_SOCKET
+from .protocol import ServiceError, encode, decode
+
+
+class Client:
+    """Blocking client of the service. The token of the last login is sent with the vault requests.
+
+    Args:
+        path (str) : The path of the Unix socket of the server.
+        timeout (float | None) : Seconds to wait for a response.
+    """
+
+    def __init__(self, path: str = SERVICE_SOCKET, timeout: float | None = 30.0) -> None:
+        self.path = path
+        self.token: str | None = None
+        self._ids = itertools.count(1)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._file = self._sock.makefile("rb")
+
+    def request(self, op: str, **args: Any) -> Any:
+        """Send a request and return the data of its response
+
+        Raises:
+            ServiceError: With the error of the response if the request failed.
+        """
+        request_id = next(self._ids)
+        self._sock.sendall(encode(dict(args, id=request_id, op=op)))
+        # requests are sent one at a time, so the next response is the one of this request
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection")
+        response = decode(line)
+        if not response.get("ok"):
+            raise ServiceError(response.get("error"))
+        return response.get("data")
+
+    def sign_up(self, name: str, email: str, password: str) -> None:
+        self.request("sign_up", name=name, email=email, password=password)
+
+    def login(self, email: str, password: str) -> dict[str, Any]:
+        """Log in and keep the token. Return the user"""
+        data = self.request("login", email=email, password=password)
+        self.token = data["token"]
+        return data["user"]
+
+    def logout(self) -> None:
+        self.request("logout", token=self.token)
+        self.token = None
+
+    def add_password(self, app_name: str, url: str, username: str, password: str) -> int:
+        """Save a vault entry, return the number of times the password was seen in breaches"""
+        data = self.request("add", token=self.token, app_name=app_name, url=url,
+                            username=username, password=password)
+        return data["breaches"]
+
+    def lookup(self, url: str) -> list[dict[str, Any]]:
+        return self.request("lookup", token=self.token, url=url)
+
+    def list_passwords(self, after: str | None = None,
+                       limit: int | None = None) -> tuple[list[dict[str, Any]], str | None]:
+        """Return a page of the vault and the cursor of the next page (see password.page_passwords)"""
+        args = dict(after=after) if limit is None else dict(after=after, limit=limit)
+        data = self.request("list", token=self.token, **args)
+        return data["entries"], data["cursor"]
+
+    def search(self, query: str, limit: int | None = None, offset: int = 0) -> list[dict[str, Any]]:
+        args = dict(offset=offset) if limit is None else dict(offset=offset, limit=limit)
+        return self.request("search", token=self.token, query=query, **args)
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Client of the password manager service")
+    parser.add_argument("--socket", default=SERVICE_SOCKET, help="path of the socket of the server")
+    parser.add_argument("--token", default=os.environ.get("PASSWORD_MANAGER_TOKEN"),
+                        help="session token (default $PASSWORD_MANAGER_TOKEN)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sign_up = commands.add_parser("sign-up")
+    sign_up.add_argument("name")
+    sign_up.add_argument("email")
+    commands.add_parser("login").add_argument("email")
+    commands.add_parser("logout")
+    add = commands.add_parser("add")
+    add.add_argument("app_name")
+    add.add_argument("url")
+    add.add_argument("username")
+    commands.add_parser("lookup").add_argument("url")
+    listing = commands.add_parser("list")
+    listing.add_argument("--after", default=None, help="cursor printed with the previous page")
+    listing.add_argument("--limit", type=int, default=None)
+    search = commands.add_parser("search")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=None)
+    search.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        with Client(args.socket) as client:
+            client.token = args.token
+            match args.command:
+                case "sign-up":
+                    client.sign_up(args.name, args.email, getpass(f"{'Enter password: ':<25}"))
+                    print(f"User {args.name} saved successfully.")
+                case "login":
+                    client.login(args.email, getpass(f"{'Enter your password: ':<25}"))
+                    print(client.token)
+                case "logout":
+                    client.logout()
+                case "add":
+                    breaches = client.add_password(args.app_name, args.url, args.username,
+                                                   getpass(f"{'Enter password: ':<25}"))
+                    if breaches:
+                        print(f"Warning: this password was seen {breaches} times in data breaches.",
+                              file=sys.stderr)
+                case "lookup":
+                    print(json.dumps(client.lookup(args.url), indent=2))
+                case "list":
+                    entries, cursor = client.list_passwords(args.after, args.limit)
+                    print(json.dumps(dict(entries=entries, cursor=cursor), indent=2))
+                case "search":
+                    print(json.dumps(client.search(args.query, args.limit, args.offset), indent=2))
+    except (ServiceError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Wire format of the service: one JSON object per line (UTF-8), in both directions.
+
+A request names an operation and its arguments, and an id chosen by the client:
+
+    {"id": 1, "op": "login", "email": "eduardo@mail.com", "password": "secret"}
+
+The response has the same id, and either the result of the operation or the reason of its
+failure:
+
+    {"id": 1, "ok": true, "data": {"token": "...", "user": {...}}}
+    {"id": 1, "ok": false, "error": "Invalid credentials. Try Again."}
+
+The requests of a client are processed concurrently, so the responses can come back in
+another order: the ids match them to the requests.
+
+Operations (the vault operations take the token returned by login):
+
+    sign_up(name, email, password)
+    login(email, password) -> {token, user}
+    logout(token)
+    add(token, app_name, url, username, password) -> {breaches}
+    lookup(token, url) -> [entry]
+    list(token, after=None, limit=VAULT_PAGE_SIZE) -> {entries, cursor}
+    search(token, query, limit=SEARCH_PAGE_SIZE, offset=0) -> [entry]
+"""
+
+import json
+from typing import Any
+
+
+class ServiceError(Exception):
+    """A failed request. The message is sent to the client as the error of the response"""
+
+
+def encode(message: dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def decode(line: bytes) -> dict[str, Any]:
+    """Parse a line of the protocol
+
+    Raises:
+        ServiceError: If the line is not a JSON object.
+    """
+    try:
+        message = json.loads(line)
+    except ValueError:
+        raise ServiceError("Invalid request: not JSON") from None
+    if not isinstance(message, dict):
+        raise ServiceError("Invalid request: not an object")
+    return message
@@ -0,0 +1,255 @@
+"""
+Long-running service mode: the auth and vault operations on a Unix domain socket.
+
+    python main.py --serve [--socket password_manager.sock]
+
+The server keeps a pool of warm connections to the database (see db.AsyncConnectionPool) and
+processes the requests of all the clients concurrently in one event loop: the queries run in
+the worker threads of the connections and bcrypt in the hashing workers, so a slow login
+never delays the other requests. See ./service/protocol.py for the requests and responses,
+and ./service/client.py for the bundled client.
+"""
+
+import asyncio
+import errno
+import os
+import socket
+import struct
+from typing import Any, Awaitable, Callable
+
+import db
+from auth.aio import authenticate_async, register_async
+from auth.hashing import get_hashing_service
+from config import DATABASE_URL, POOL_SIZE, SERVICE_SOCKET, SERVICE_MAX_REQUEST, \
+    SERVICE_MAX_CONCURRENCY, VAULT_PAGE_SIZE, SEARCH_PAGE_SIZE
+from db.migrations import migrate
+from messages import Messages
+from models import MODELS
+from models.migrations import MIGRATIONS
+from password.password import store_password, iter_passwords, page_passwords
+from password.search import search
+from password.vault import session_keys, VaultKeyError, VaultDecryptionError
+from .protocol import ServiceError, encode, decode
+from .sessions import SessionStore
+
+
+# Fields of the user sent to the client on login
+PUBLIC_USER_FIELDS = ("user_id", "name", "email")
+
+
+def peer_identity(writer: asyncio.StreamWriter) -> str:
+    """Return the identity of the client used by the login rate limits: the uid of the
+    process on the other end of the socket, where the platform reports it"""
+    sock = writer.get_extra_info("socket")
+    if sock is not None and hasattr(socket, "SO_PEERCRED"):
+        _, uid, _ = struct.unpack("3i", sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                        struct.calcsize("3i")))
+        return f"uid:{uid}"
+    return "unix"
+
+
+def _limit(request: dict[str, Any], maximum: int) -> int:
+    """The page size asked by the request, at most 'maximum'"""
+    limit = int(request.get("limit", maximum))
+    if limit <= 0:
+        raise ValueError("'limit' should be greater than zero")
+    return min(limit, maximum)
+
+
+class Server:
+    """The service (see module docstring).
+
+    Args:
+        pool (db.AsyncConnectionPool) : The connections to the database (opened by start).
+        path (str) : The path of the Unix socket.
+        sessions (SessionStore | None) : The session tokens.
+        max_concurrency (int) : Maximum number of requests processed at once. The other
+            requests wait for a slot.
+        writer (db.GroupCommitWriter | None) : If given, the users of the sign ups are saved
+            by the writer, committed together (see db/writer.py).
+    """
+
+    def __init__(self, pool: db.AsyncConnectionPool, path: str = SERVICE_SOCKET,
+                 sessions: SessionStore | None = None,
+                 max_concurrency: int = SERVICE_MAX_CONCURRENCY,
+                 writer: "db.GroupCommitWriter | None" = None) -> None:
+        self.pool = pool
+        self.writer = writer
+        self.path = path
+        self.sessions = sessions or SessionStore()
+        self.operations: dict[str, Callable[[dict[str, Any], str], Awaitable[Any]]] = {
+            "sign_up": self.sign_up,
+            "login": self.login,
+            "logout": self.logout,
+            "add": self.add_password,
+            "lookup": self.lookup,
+            "list": self.list_passwords,
+            "search": self.search_passwords,
+        }
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        """Open the connections, migrate the database and listen on the socket"""
+        await self.pool.open(lambda conn: conn.run_sync(migrate, MODELS, MIGRATIONS))
+        # starts the hashing workers and the dummy hash before the first login
+        get_hashing_service()
+        if os.path.exists(self.path):
+            self._remove_stale_socket()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the socket file is created with the permissions 0600, so no other user can connect
+        # before the server is listening
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        self._server = await asyncio.start_unix_server(self._serve_client, sock=sock,
+                                                       limit=SERVICE_MAX_REQUEST)
+
+    def _remove_stale_socket(self) -> None:
+        """Remove the socket file left by a server that didn't shut down.
+
+        Raises:
+            OSError: If a server is still listening on the socket.
+        """
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, f"A server is already listening on {self.path}")
+
+    async def serve_forever(self) -> None:
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        await self.pool.close()
+
+    async def _serve_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        client = peer_identity(writer)
+        tasks: set[asyncio.Task] = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._respond(line, client, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ValueError, ConnectionError):
+            # a line longer than SERVICE_MAX_REQUEST, or the client went away
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _respond(self, line: bytes, client: str, writer: asyncio.StreamWriter) -> None:
+        response = await self.handle(line, client)
+        writer.write(encode(response))
+        await writer.drain()
+
+    async def handle(self, line: bytes, client: str = "unix") -> dict[str, Any]:
+        """Process a request line and return the response"""
+        request_id = None
+        try:
+            request = decode(line)
+            request_id = request.get("id")
+            operation = self.operations.get(request.get("op"))
+            if operation is None:
+                raise ServiceError(f"Unknown operation {request.get('op')!r}")
+            async with self._slots:
+                data = await operation(request, client)
+        except (ServiceError, VaultKeyError, VaultDecryptionError) as e:
+            return dict(id=request_id, ok=False, error=str(e))
+        except KeyError as e:
+            return dict(id=request_id, ok=False, error=f"Invalid request: missing argument {e}")
+        except (TypeError, ValueError) as e:
+            return dict(id=request_id, ok=False, error=f"Invalid request: {e}")
+        except Exception as e:
+            print(e)
+            return dict(id=request_id, ok=False, error="Internal error")
+        return dict(id=request_id, ok=True, data=data)
+
+    def _user(self, request: dict[str, Any]) -> dict[str, Any]:
+        user = self.sessions.get(request["token"])
+        if user is None:
+            raise ServiceError("The session expired. Please, log in again.")
+        return user
+
+    async def sign_up(self, request: dict[str, Any], client: str) -> None:
+        async with self.pool.connection() as conn:
+            response = await register_async(conn, request["name"], request["email"],
+                                            request["password"], self.writer)
+        if response.message == Messages.SIGN_UP_FAILURE:
+            raise ServiceError(response.data)
+
+    async def login(self, request: dict[str, Any], client: str) -> dict[str, Any]:
+        async with self.pool.connection() as conn:
+            response = await authenticate_async(conn, request["email"], request["password"], client)
+        if response.message == Messages.LOGIN_FAILURE:
+            raise ServiceError(response.data)
+        user = response.data
+        return dict(token=self.sessions.create(user),
+                    user={field: user[field] for field in PUBLIC_USER_FIELDS})
+
+    async def logout(self, request: dict[str, Any], client: str) -> None:
+        user = self.sessions.revoke(request["token"])
+        if user is not None:
+            session_keys.wipe(user["user_id"])
+
+    async def add_password(self, request: dict[str, Any], client: str) -> dict[str, Any]:
+        user = self._user(request)
+        async with self.pool.connection() as conn:
+            response = await conn.run_sync(store_password, user, request["app_name"],
+                                           request["url"], request["username"], request["password"])
+        if response.message == Messages.VAULT_FAILURE:
+            raise ServiceError(response.data)
+        return dict(breaches=response.data)
+
+    async def lookup(self, request: dict[str, Any], client: str) -> list[dict[str, Any]]:
+        user = self._user(request)
+        async with self.pool.connection() as conn:
+            return await conn.run_sync(
+                lambda conn: list(iter_passwords(conn, user, app_url=request["url"])))
+
+    async def list_passwords(self, request: dict[str, Any], client: str) -> dict[str, Any]:
+        user = self._user(request)
+        async with self.pool.connection() as conn:
+            entries, cursor = await conn.run_sync(page_passwords, user, request.get("after"),
+                                                  _limit(request, VAULT_PAGE_SIZE))
+        return dict(entries=entries, cursor=cursor)
+
+    async def search_passwords(self, request: dict[str, Any], client: str) -> list[dict[str, Any]]:
+        user = self._user(request)
+        async with self.pool.connection() as conn:
+            return await conn.run_sync(search, user, request["query"],
+                                       _limit(request, SEARCH_PAGE_SIZE),
+                                       max(int(request.get("offset", 0)), 0))
+
+
+async def serve(path: str = SERVICE_SOCKET, url: str = DATABASE_URL, pool_size: int = POOL_SIZE) -> None:
+    """Run the service until it is cancelled (e.g. with Ctrl+C)"""
+    # bursts of sign ups are committed together by a connection of their own, when every
+    # commit is fsynced (see GROUP_COMMIT in config.py)
+    writer = db.GroupCommitWriter(lambda: db.DBConnectionFactory("sqlite3", url)) \
+        if db.group_commit_enabled() else None
+    server = Server(db.create_async_sqlite_pool(url, pool_size), path, writer=writer)
+    await server.start()
+    print(f"Listening on {path} ({pool_size} connections to {url})")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        if writer is not None:
+            writer.close()
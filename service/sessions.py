@@ -0,0 +1,65 @@
+import secrets
+import threading
+import time
+from typing import Any, Callable
+
+from config import SERVICE_SESSION_TTL
+
+
+class SessionStore:
+    """Session tokens of the users logged in through the service.
+
+    A token is a random string given to the client on login, and sent back with every vault
+    request instead of the credentials. Tokens expire 'ttl' seconds after the login.
+
+    Args:
+        ttl (float) : Seconds a token stays valid.
+        clock (Callable[[], float]) : Returns the current time in seconds.
+    """
+
+    def __init__(self, ttl: float = SERVICE_SESSION_TTL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        # token -> (user, expiration time)
+        self._sessions: dict[str, tuple[dict[str, Any], float]] = {}
+        self._next_sweep = clock() + ttl
+        self._lock = threading.Lock()
+
+    def create(self, user: dict[str, Any]) -> str:
+        """Return a new token for 'user'"""
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._expire()
+            self._sessions[token] = (user, self.clock() + self.ttl)
+        return token
+
+    def get(self, token: str) -> dict[str, Any] | None:
+        """Return the user of 'token', or None if the token is unknown or expired"""
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            user, expires = session
+            if self.clock() > expires:
+                del self._sessions[token]
+                return None
+            return user
+
+    def revoke(self, token: str) -> dict[str, Any] | None:
+        """Forget 'token' (e.g. on logout) and return its user"""
+        with self._lock:
+            session = self._sessions.pop(token, None)
+        return None if session is None else session[0]
+
+    def _expire(self) -> None:
+        # the expired tokens are swept at most once per 'ttl' seconds
+        now = self.clock()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.ttl
+        for token in [t for t, (_, expires) in self._sessions.items() if now > expires]:
+            del self._sessions[token]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
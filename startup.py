@@ -0,0 +1,108 @@
+"""
+Startup profile of the interactive app:
+
+    python main.py --profile-startup
+
+The app is started in a new interpreter with -X importtime and its input closed, so that
+it exits at the first prompt. The report shows the import time of each top-level package
+(the time spent in its own modules) and the time from the start of the interpreter to the
+first prompt, the best of a few runs in a temporary directory (the database is created by
+a first run that isn't measured).
+
+test_startup.py fails if the time to the first prompt exceeds STARTUP_BUDGET_MS.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from config import STARTUP_BUDGET_MS
+
+# The first prompt of the app (see helper.choice)
+PROMPT = b"Enter an option: "
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class StartupProfile:
+    """One start of the app
+
+    Args:
+        first_prompt (float) : Milliseconds from the start of the interpreter to the first prompt.
+        imports (dict[str, float]) : Milliseconds spent importing each top-level package.
+        modules (list[str]) : The modules imported, in order.
+    """
+
+    def __init__(self, first_prompt: float, imports: dict[str, float], modules: list[str]) -> None:
+        self.first_prompt = first_prompt
+        self.imports = imports
+        self.modules = modules
+
+    @property
+    def import_time(self) -> float:
+        return sum(self.imports.values())
+
+    def report(self, top: int = 15) -> str:
+        lines = [f"{'  STARTUP  '::^50}", f"{'package':<34}{'import (ms)':>16}"]
+        ranked = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+        for package, ms in ranked[:top]:
+            lines.append(f"{package:<34}{ms:>16.1f}")
+        if len(ranked) > top:
+            rest = sum(ms for _, ms in ranked[top:])
+            lines.append(f"{f'({len(ranked) - top} more)':<34}{rest:>16.1f}")
+        lines.append(f"{'total import time':<34}{self.import_time:>16.1f}")
+        lines.append(f"{'time to first prompt':<34}{self.first_prompt:>16.1f}")
+        lines.append(f"{'budget':<34}{STARTUP_BUDGET_MS:>16.1f}")
+        return "\n".join(lines)
+
+
+def parse_import_times(output: str) -> tuple[dict[str, float], list[str]]:
+    """Parse the output of -X importtime.
+
+    Return:
+        The milliseconds spent in the modules of each top-level package, and the modules
+        imported in order
+    """
+    imports: dict[str, float] = defaultdict(float)
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        imports[module.split(".")[0]] += int(self_us) / 1000
+        modules.append(module)
+    return dict(imports), modules
+
+
+def run_app(cwd: str) -> StartupProfile:
+    """Start the app in 'cwd' until its first prompt"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    # a pipe could fill up before the prompt, the import times are written to a file
+    with tempfile.TemporaryFile("w+", dir=cwd) as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "-c", "import main; main.main([])"],
+            cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+        output = b""
+        first_prompt = None
+        while chunk := os.read(process.stdout.fileno(), 4096):
+            output += chunk
+            if first_prompt is None and PROMPT in output:
+                first_prompt = (time.perf_counter() - start) * 1000
+        process.stdout.close()
+        if process.wait() != 0 or first_prompt is None:
+            stderr.seek(0)
+            raise RuntimeError(f"The app didn't reach the first prompt:\n{stderr.read()[-2000:]}")
+        stderr.seek(0)
+        imports, modules = parse_import_times(stderr.read())
+    return StartupProfile(first_prompt, imports, modules)
+
+
+def profile_startup(runs: int = 3) -> StartupProfile:
+    """Return the fastest of 'runs' starts of the app"""
+    with tempfile.TemporaryDirectory() as cwd:
+        run_app(cwd)
+        return min((run_app(cwd) for _ in range(runs)), key=lambda profile: profile.first_prompt)
@@ -0,0 +1,416 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from auth import aio, auth, hashing
+from auth.calibration import calibrate_cost, save_cost
+from auth.ratelimit import RateLimiter, LoginRateLimiter
+from auth.user_cache import UserCache
+from auth.hashing import HashingService, HashingQueueFull, hash_password, hash_cost, \
+    needs_rehash, validate_password
+from db.aio import AsyncSQLiteDBConnection
+from db.db import SQLiteDBConnection
+from db.writer import GroupCommitWriter
+from db.migrations import migrate
+from messages import Messages
+from password import breach
+from password.breach import BreachChecker, convert
+from models.models import MODELS, User, Password
+from password.password import iter_passwords
+from password.vault import session_keys
+
+
+class TestHashingService(unittest.TestCase):
+    def setUp(self):
+        self.service = HashingService(workers=2, max_pending=2, executor="thread")
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_hash_and_validate(self):
+        hashed_pw = self.service.hash_password("secret")
+
+        self.assertTrue(self.service.validate_password("secret", hashed_pw))
+        self.assertFalse(self.service.validate_password("wrong", hashed_pw))
+        # wait for the workers so that the completion callbacks have run
+        self.service.shutdown()
+        self.assertEqual(self.service.stats()["completed"], 3)
+
+    def test_async_validate(self):
+        hashed_pw = hash_password("secret")
+
+        async def validate_many():
+            return await asyncio.gather(
+                self.service.validate_password_async("secret", hashed_pw),
+                self.service.validate_password_async("wrong", hashed_pw))
+
+        self.assertEqual(asyncio.run(validate_many()), [True, False])
+
+    def test_queue_cap(self):
+        release = threading.Event()
+        futures = [self.service.submit(release.wait) for _ in range(2)]
+
+        with self.assertRaises(HashingQueueFull):
+            self.service.submit(release.wait)
+
+        release.set()
+        for future in futures:
+            future.result()
+        self.service.shutdown()
+        stats = self.service.stats()
+        self.assertEqual((stats["pending"], stats["rejected"]), (0, 1))
+
+    def test_dummy_hash(self):
+        future = self.service.dummy_hash(4)
+
+        self.assertIs(self.service.dummy_hash(4), future)
+        self.assertEqual(hash_cost(future.result()), 4)
+        # not a job of the service
+        self.service.shutdown()
+        self.assertEqual(self.service.stats()["submitted"], 0)
+
+
+class TestCalibration(unittest.TestCase):
+    def test_bounds(self):
+        # any cost fits a target of one minute, none fits a target of one microsecond
+        self.assertEqual(calibrate_cost(60_000, min_cost=4, max_cost=6, repeat=1)[0], 6)
+        cost, timings = calibrate_cost(0.001, min_cost=4, max_cost=6, repeat=1)
+        self.assertEqual((cost, list(timings)), (4, [4]))
+
+    def test_save_cost(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "config.py")
+            with open(path, "w") as f:
+                f.write("HASH_WORKERS = None\nBCRYPT_COST = 12\nBCRYPT_TARGET_MS = 250.0\n")
+
+            save_cost(9, path)
+
+            with open(path) as f:
+                self.assertEqual(f.read(), "HASH_WORKERS = None\nBCRYPT_COST = 9\n"
+                                           + "BCRYPT_TARGET_MS = 250.0\n")
+
+    def test_needs_rehash(self):
+        hashed_pw = hash_password("secret", 4)
+
+        self.assertEqual(hash_cost(hashed_pw), 4)
+        self.assertFalse(needs_rehash(hashed_pw, 4))
+        self.assertTrue(needs_rehash(hashed_pw, 5))
+        # never downgraded
+        self.assertFalse(needs_rehash(hashed_pw, 3))
+
+
+class TestAuthenticate(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        migrate(self.conn, MODELS)
+        self.conn.execute(self.conn.insert_into_table(User),
+                          ("Eduardo", "eduardo@mail.com", hash_password("secret", 4), None))
+        self.conn.commit()
+
+        self.service = HashingService(workers=2, executor="thread")
+        self.now = 0.0
+        self.limiter = LoginRateLimiter(email_burst=3, email_rate=0.1, client_burst=5,
+                                        client_rate=1.0, clock=lambda: self.now)
+        self.cache = UserCache()
+        patches = [mock.patch.object(auth, "get_hashing_service", lambda: self.service),
+                   mock.patch.object(auth, "get_login_limiter", lambda: self.limiter),
+                   mock.patch.object(auth, "get_user_cache", lambda: self.cache),
+                   mock.patch.object(auth, "BCRYPT_COST", 5)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.conn.close_connection()
+
+    def stored_hash(self):
+        return self.conn.execute("SELECT hashed_pw FROM users;")[0][0]
+
+    def test_rehash_outdated_cost(self):
+        response = auth.authenticate(self.conn, "eduardo@mail.com", "secret")
+        self.assertEqual(response.message, Messages.LOGIN_SUCCESS)
+
+        # the rehash may already have been saved by authenticate
+        auth.save_rehashes(self.conn, wait=True)
+        self.assertEqual(hash_cost(self.stored_hash()), 5)
+        self.assertTrue(validate_password("secret", self.stored_hash()))
+
+        # the new hash is current, nothing is scheduled on the next login
+        user = auth.authenticate(self.conn, "eduardo@mail.com", "secret").data
+        self.assertFalse(auth.schedule_rehash(user, "secret"))
+
+    def test_no_rehash_on_failure(self):
+        response = auth.authenticate(self.conn, "eduardo@mail.com", "wrong")
+
+        self.assertEqual(response.message, Messages.LOGIN_FAILURE)
+        self.assertEqual(auth.save_rehashes(self.conn, wait=True), 0)
+        self.assertEqual(hash_cost(self.stored_hash()), 4)
+
+    def test_legacy_passwords_encrypted_on_unlock(self):
+        # a password saved in plain text before the vault was encrypted
+        self.conn.execute(self.conn.insert_into_table(Password),
+                          (1, "App", "app.com", "eduardo", "plain"))
+        self.conn.commit()
+
+        user = auth.authenticate(self.conn, "eduardo@mail.com", "secret").data
+        self.addCleanup(session_keys.wipe, user["user_id"])
+
+        self.assertTrue(user["kdf_salt"])
+        stored = self.conn.execute("SELECT password FROM passwords;")[0][0]
+        self.assertTrue(stored.startswith("v1:"))
+        self.assertEqual([p["password"] for p in iter_passwords(self.conn, user, ("password",))],
+                         ["plain"])
+
+    def test_unknown_email(self):
+        response = auth.authenticate(self.conn, "nobody@mail.com", "secret")
+
+        self.assertEqual((response.message, response.data),
+                         (Messages.LOGIN_FAILURE, "Invalid credentials. Try Again."))
+        # the dummy hash was checked, as for a wrong password
+        self.service.shutdown()
+        self.assertEqual(self.service.stats()["completed"], 1)
+
+    def test_rate_limited_before_bcrypt(self):
+        for _ in range(3):
+            auth.authenticate(self.conn, "eduardo@mail.com", "wrong")
+        self.service.shutdown()
+        checked = self.service.stats()["completed"]
+
+        response = auth.authenticate(self.conn, "Eduardo@mail.com", "secret")
+
+        self.assertEqual(response.message, Messages.LOGIN_FAILURE)
+        self.assertTrue(response.data.startswith("Too many attempts"))
+        self.assertEqual(self.service.stats()["completed"], checked)
+
+        # the bucket of the email is refilled after 10 seconds
+        self.now += 10
+        response = auth.authenticate(self.conn, "eduardo@mail.com", "secret")
+        self.assertEqual(response.message, Messages.LOGIN_SUCCESS)
+
+    def test_repeated_logins_served_by_cache(self):
+        statements = []
+        auth.authenticate(self.conn, "eduardo@mail.com", "secret")
+        auth.save_rehashes(self.conn, wait=True)
+        self.conn.conn.set_trace_callback(statements.append)
+
+        for _ in range(2):
+            response = auth.authenticate(self.conn, "eduardo@mail.com", "secret")
+            self.assertEqual(response.message, Messages.LOGIN_SUCCESS)
+        response = auth.register(self.conn, "Eduardo", "eduardo@mail.com", "secret")
+        self.assertEqual(response.message, Messages.SIGN_UP_FAILURE)
+
+        # the rehash invalidated the user, which was read again only once
+        self.assertEqual(len([sql for sql in statements if sql.startswith("SELECT")]), 1)
+
+    def test_breached_password_rejected(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "breached.bin")
+        convert(["123456\n"], path, plaintext=True)
+        checker = self.enterContext(BreachChecker(path))
+
+        with mock.patch.object(breach, "get_breach_checker", lambda: checker):
+            response = auth.register(self.conn, "Ana", "ana@mail.com", "123456")
+            self.assertEqual((response.message, response.data), (
+                Messages.SIGN_UP_FAILURE,
+                "This password was seen 1 times in data breaches. Please, choose another one."))
+            # rejected before it is hashed
+            self.service.shutdown()
+            self.assertEqual(self.service.stats()["completed"], 0)
+
+    def test_sign_ups_with_writer(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        url = os.path.join(tmp.name, "test.db")
+        conn = SQLiteDBConnection(url)
+        conn.connect()
+        migrate(conn, MODELS)
+        conn.close_connection()
+        writer = GroupCommitWriter(lambda: SQLiteDBConnection(url), window=0.05)
+        self.addCleanup(writer.close)
+
+        def sign_up(i):
+            conn = SQLiteDBConnection(url)
+            conn.connect()
+            try:
+                return auth.register(conn, f"User {i}", f"user{i}@mail.com", "secret", writer)
+            finally:
+                conn.close_connection()
+
+        # the missing email is cached, and forgotten when the writer saves the user
+        self.assertIsNone(self.cache.get_by_email(self.conn, "user0@mail.com"))
+        with mock.patch.object(hashing, "BCRYPT_COST", 4), ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(sign_up, range(8)))
+
+        self.assertTrue(all(r.message == Messages.SIGN_UP_SUCCESS for r in responses))
+        self.assertEqual(writer.writes, 8)
+        self.assertLess(writer.commits, 8)
+        response = sign_up(0)
+        self.assertEqual((response.message, response.data),
+                         (Messages.SIGN_UP_FAILURE, "Email is already registered. Please, try again."))
+
+
+class TestAuthenticateAsync(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.conn = AsyncSQLiteDBConnection(":memory:")
+        await self.conn.connect()
+        await self.conn.run_sync(migrate, MODELS)
+
+        self.service = HashingService(workers=4, executor="thread")
+        self.cache = UserCache()
+        limiter = LoginRateLimiter(email_burst=100, client_burst=100)
+        # the rehashes are scheduled by auth.auth
+        patches = [mock.patch.object(module, name, value) for module in (auth, aio)
+                   for name, value in (("get_hashing_service", lambda: self.service),
+                                       ("get_login_limiter", lambda: limiter),
+                                       ("get_user_cache", lambda: self.cache),
+                                       ("BCRYPT_COST", 4))]
+        patches.append(mock.patch.object(hashing, "BCRYPT_COST", 4))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def asyncTearDown(self):
+        self.service.shutdown()
+        await self.conn.close_connection()
+
+    async def test_concurrent_sign_ups_and_logins(self):
+        responses = await asyncio.gather(*(
+            aio.register_async(self.conn, f"User {i}", f"user{i}@mail.com", f"secret{i}")
+            for i in range(20)))
+        self.assertTrue(all(r.message == Messages.SIGN_UP_SUCCESS for r in responses))
+
+        responses = await asyncio.gather(*(
+            aio.authenticate_async(self.conn, f"user{i}@mail.com",
+                                    f"secret{i}" if i % 2 else "wrong")
+            for i in range(20)))
+        self.assertEqual([r.message == Messages.LOGIN_SUCCESS for r in responses],
+                         [bool(i % 2) for i in range(20)])
+        self.assertEqual(responses[1].data["email"], "user1@mail.com")
+
+    async def test_prompted_flows(self):
+        def prompt_with(*answers):
+            answers = iter(answers)
+
+            async def prompt(text, secret):
+                return next(answers)
+            return prompt
+
+        prompt = prompt_with("Eduardo", "eduardo@mail.com", "secret", "other")
+        response = await aio.sign_up_async(self.conn, prompt)
+        self.assertEqual((response.message, response.data),
+                         (Messages.SIGN_UP_FAILURE, "Passwords don't match. Please, try again."))
+
+        prompt = prompt_with("Eduardo", "eduardo@mail.com", "secret", "secret")
+        response = await aio.sign_up_async(self.conn, prompt)
+        self.assertEqual(response.message, Messages.SIGN_UP_SUCCESS)
+
+        response = await aio.login_async(self.conn, prompt_with("eduardo@mail.com", "secret"))
+        self.assertEqual(response.message, Messages.LOGIN_SUCCESS)
+        response = await aio.login_async(self.conn, prompt_with("nobody@mail.com", "secret"))
+        self.assertEqual(response.data, "Invalid credentials. Try Again.")
+
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        migrate(self.conn, MODELS)
+        self.now = 0.0
+        self.cache = UserCache(maxsize=4, ttl=60, negative_ttl=10, clock=lambda: self.now)
+        self.insert("eduardo@mail.com")
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def insert(self, email):
+        self.conn.execute(self.conn.insert_into_table(User), ("Eduardo", email, "hash", None))
+        self.conn.commit()
+
+    def test_read_through(self):
+        user = self.cache.get_by_email(self.conn, "eduardo@mail.com")
+        user["name"] = "changed"
+
+        self.assertEqual(self.cache.get_by_email(self.conn, "eduardo@mail.com")["name"], "Eduardo")
+        self.assertEqual(self.cache.get_by_id(self.conn, 1)["email"], "eduardo@mail.com")
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"]), (2, 1, 2 / 3))
+
+    def test_negative_cache(self):
+        self.assertIsNone(self.cache.get_by_email(self.conn, "ana@mail.com"))
+        self.assertIsNone(self.cache.get_by_email(self.conn, "ana@mail.com"))
+        self.assertEqual(self.cache.stats()["negative_hits"], 1)
+
+        # inserting the user forgets the missing email
+        self.insert("ana@mail.com")
+        self.assertEqual(self.cache.get_by_email(self.conn, "ana@mail.com")["user_id"], 2)
+
+    def test_invalidated_by_writes(self):
+        self.cache.get_by_email(self.conn, "eduardo@mail.com")
+        sql = self.conn.update_from_table_where(User, dict(user_id=1), dict(name="Edu"))
+        self.conn.execute(sql, ("Edu", 1))
+        self.conn.commit()
+        self.assertEqual(self.cache.get_by_email(self.conn, "eduardo@mail.com")["name"], "Edu")
+
+        self.conn.execute(self.conn.delete_from_table_where(User, dict(email="eduardo@mail.com")),
+                          ("eduardo@mail.com",))
+        self.conn.commit()
+        self.assertIsNone(self.cache.get_by_id(self.conn, 1))
+
+    def test_failed_invalidation_clears(self):
+        self.insert("ana@mail.com")
+        self.cache.get_by_email(self.conn, "eduardo@mail.com")
+        self.cache.get_by_email(self.conn, "ana@mail.com")
+
+        sql = self.conn.update_from_table_where(User, dict(user_id=1), dict(hashed_pw="new"))
+        with mock.patch.object(self.cache, "_forget", side_effect=KeyError("user")), \
+                self.assertLogs("db.write_listeners", "ERROR") as logs:
+            self.conn.execute(sql, ("new", 1))
+        self.conn.commit()
+
+        self.assertIn("failed on update users", logs.output[0])
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertEqual(self.cache.get_by_email(self.conn, "eduardo@mail.com")["hashed_pw"], "new")
+
+    def test_ttl_and_eviction(self):
+        self.cache.get_by_email(self.conn, "eduardo@mail.com")
+        self.now += 61
+        self.cache.get_by_email(self.conn, "eduardo@mail.com")
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+        for i in range(3):
+            self.cache.get_by_email(self.conn, f"missing{i}@mail.com")
+        stats = self.cache.stats()
+        self.assertEqual((stats["size"], stats["evictions"]), (4, 1))
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = RateLimiter(burst=2, rate=0.5, max_keys=2, clock=lambda: self.now)
+
+    def test_token_bucket(self):
+        self.assertEqual([self.limiter.acquire("a") for _ in range(3)], [True, True, False])
+        self.assertEqual(self.limiter.retry_after("a"), 2.0)
+
+        self.now += 2
+        self.assertEqual([self.limiter.acquire("a") for _ in range(2)], [True, False])
+
+    def test_lru_eviction(self):
+        self.limiter.acquire("a")
+        self.limiter.acquire("b")
+        self.limiter.acquire("a")
+        self.limiter.acquire("c")
+
+        # "b" was the least recently used bucket
+        self.assertEqual(self.limiter.stats()["keys"], 2)
+        self.assertEqual(self.limiter.stats()["evictions"], 1)
+        self.assertEqual(self.limiter.retry_after("b"), 0.0)
+        self.assertFalse(self.limiter.acquire("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
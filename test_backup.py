@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+from db.backup import BackupError, MAGIC, backup, restore, export, import_, read_frames, \
+    write_frame
+from db.db import SQLiteDBConnection
+from db.migrations import migrate
+from models.migrations import MIGRATIONS
+from models.models import MODELS, User, Password
+
+
+class TestBackup(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.conn = self.connect("source.db")
+        self.conn.bulk_insert(User, (dict(name=f"User {i}", email=f"user{i}@mail.com",
+                                          hashed_pw="hash") for i in range(3)))
+        self.conn.bulk_insert(Password, (
+            dict(user_id=i % 3 + 1, app_name=f"app{i}", app_url=f"https://app{i}.com",
+                 username=f"user{i}", password="encrypted") for i in range(2500)))
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def connect(self, name):
+        conn = SQLiteDBConnection(os.path.join(self.dir, name))
+        conn.connect()
+        migrate(conn, MODELS, MIGRATIONS)
+        return conn
+
+    def rows(self, conn, table):
+        return conn.execute(f"SELECT * FROM {table.__tablename__} ORDER BY rowid;")
+
+    def test_backup_and_restore(self):
+        path = os.path.join(self.dir, "backup.db")
+        steps = []
+        result = backup(self.conn, path, pages=4, progress=lambda remaining, total: steps.append(remaining))
+
+        self.assertEqual(result.bytes, os.path.getsize(path))
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(steps[-1], 0)
+
+        expected = self.rows(self.conn, Password)
+        self.conn.execute("DELETE FROM passwords;")
+        self.conn.commit()
+        restore(self.conn, path)
+        self.assertEqual(self.rows(self.conn, Password), expected)
+
+        with open(os.path.join(self.dir, "garbage.db"), "wb") as f:
+            f.write(b"not a database" * 100)
+        with self.assertRaises(BackupError):
+            restore(self.conn, os.path.join(self.dir, "garbage.db"))
+
+    def test_export_and_import(self):
+        path = os.path.join(self.dir, "vault.export")
+        result = export(self.conn, MODELS, path, chunk_rows=1000)
+        self.assertEqual(result.rows, 2503)
+
+        target = self.connect("target.db")
+        self.addCleanup(target.close_connection)
+        result = import_(target, MODELS, path)
+
+        self.assertEqual(result.rows, 2503)
+        for table in MODELS:
+            self.assertEqual(self.rows(target, table), self.rows(self.conn, table))
+        # the full-text index is filled by its triggers
+        sql = target.search_table(Password, dict(user_id=2))
+        self.assertEqual(len(target.execute(sql, ('"app1"*', 2, 20, 0))), 20)
+
+        # conflicting rows: nothing is imported
+        with self.assertRaises(BackupError):
+            import_(target, MODELS, path)
+        self.assertEqual(len(self.rows(target, Password)), 2500)
+        import_(target, MODELS, path, replace=True)
+        self.assertEqual(len(self.rows(target, Password)), 2500)
+
+    def test_corrupted_export(self):
+        path = os.path.join(self.dir, "vault.export")
+        export(self.conn, MODELS, path, chunk_rows=1000)
+        with open(path, "r+b") as f:
+            f.seek(os.path.getsize(path) // 2)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xFF]))
+
+        target = self.connect("target.db")
+        self.addCleanup(target.close_connection)
+        with self.assertRaisesRegex(BackupError, "Corrupted"):
+            import_(target, MODELS, path)
+        self.assertEqual(self.rows(target, User), [])
+
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 10)
+        with self.assertRaises(BackupError):
+            import_(target, MODELS, path)
+
+    def test_missing_frames(self):
+        path = os.path.join(self.dir, "vault.export")
+        export(self.conn, MODELS, path, chunk_rows=1000)
+        with open(path, "rb") as f:
+            frames = list(read_frames(f))
+        target = self.connect("target.db")
+        self.addCleanup(target.close_connection)
+
+        # every frame has a valid checksum, but the counts of the end frame don't match
+        end = (b"END ", dict(rows=dict(users=3, passwords=2501)))
+        for changed, error in ((frames[:2] + frames[3:], "1500 rows of passwords read"),
+                               (frames[:-1] + [end], "2501 exported")):
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+                for kind, payload in changed:
+                    write_frame(f, kind, payload)
+            with self.assertRaisesRegex(BackupError, error):
+                import_(target, MODELS, path)
+            self.assertEqual(self.rows(target, User), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+from benchmarks import compare, measure
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_measure(self):
+        result = measure(lambda: None, repeat=3, number=10)
+
+        self.assertEqual((result["repeat"], result["number"]), (3, 10))
+        self.assertLessEqual(result["min"], result["p50"])
+
+    def test_compare(self):
+        baseline = dict(results={"fast": dict(p50=1.0), "slow": dict(p50=1.0),
+                                 "bulk": dict(rows_per_second=10.0),
+                                 "steady": dict(rows_per_second=10.0)})
+        current = dict(results={"fast": dict(p50=1.1), "slow": dict(p50=2.0),
+                                "bulk": dict(rows_per_second=1.0),
+                                "steady": dict(rows_per_second=8.0), "new": dict(p50=5.0)})
+
+        regressions = compare(current, baseline, threshold=0.25)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("slow:"))
+        self.assertEqual(regressions[1], "bulk: 10 rows/s -> 1 rows/s (-90%)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,19 @@
+import asyncio
+import io
+import os
+import sqlite3
+import tempfile
 import unittest
-from db.db import SQLiteDBConnection
-from models.models import User
+from contextlib import redirect_stdout
+from unittest import mock
+from db.aio import AsyncSQLiteDBConnection
+from db.db import SQLiteDBConnection, DBConnectionFactory
+from db.memory import MemoryDBConnection, UniqueConstraintError
+from db.writer import GroupCommitWriter, WriterClosed, group_commit_enabled
+from db.instrumentation import QueryInstrumentation
+from db.migrations import migrate
+from db.query import Query, Column, Predicate
+from models.models import MODELS, User, Password
 
 
 class TestSQLiteDBConnection(unittest.TestCase):
@@ -19,15 +32,28 @@ class TestSQLiteDBConnection(unittest.TestCase):
         required_sql += "user_id INTEGER PRIMARY KEY, \n\t"
         required_sql += "name TEXT NOT NULL, \n\t"
         required_sql += "email TEXT NOT NULL UNIQUE, \n\t"
-        required_sql += "hashed_pw TEXT NOT NULL);"
+        required_sql += "hashed_pw TEXT NOT NULL, \n\t"
+        required_sql += "kdf_salt TEXT);"
         self.assertEqual(sql, required_sql)
 
+    def test_create_table_foreign_key(self):
+        sql = self.conn.create_table(Password)
+
+        self.assertIn("user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE", sql)
+
+    def test_create_indexes(self):
+        self.assertEqual(self.conn.create_indexes(User), [])
+
+        required_sql = "CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_user_id_app_url \n"
+        required_sql += "ON passwords (user_id, app_url);"
+        self.assertEqual(self.conn.create_indexes(Password), [required_sql])
+
     def test_insert_into_table(self):
         sql = self.conn.insert_into_table(User)
 
         required_sql = "INSERT INTO users \n"
-        required_sql += "(name, email, hashed_pw) \n"
-        required_sql += "VALUES (?, ?, ?);"
+        required_sql += "(name, email, hashed_pw, kdf_salt) \n"
+        required_sql += "VALUES (?, ?, ?, ?);"
 
         self.assertEqual(sql, required_sql)
 
@@ -40,8 +66,8 @@ class TestSQLiteDBConnection(unittest.TestCase):
     def test_select_from_table_where(self):
         sql = self.conn.select_from_table_where(User, self.conditions)
         required_sql = "SELECT * FROM users \n\t"
-        required_sql += "WHERE name = ?, \n\t"
-        required_sql += "email = ?;"
+        required_sql += "WHERE name = ? \n\t"
+        required_sql += "AND email = ?;"
 
         self.assertEqual(sql, required_sql)
 
@@ -52,19 +78,640 @@ class TestSQLiteDBConnection(unittest.TestCase):
         required_sql += "SET name = ?, \n\t"
         required_sql += "email = ?, \n\t"
         required_sql += "hashed_pw = ? \n"
-        required_sql += "WHERE name = ?, \n\t"
-        required_sql += "email = ?;"
+        required_sql += "WHERE name = ? \n\t"
+        required_sql += "AND email = ?;"
 
         self.assertEqual(sql, required_sql)
 
     def test_delete_from_table_where(self):
         sql = self.conn.delete_from_table_where(User, self.conditions)
         required_sql = "DELETE FROM users \n"
-        required_sql += "WHERE name = ?, \n\t"
-        required_sql += "email = ?;"
+        required_sql += "WHERE name = ? \n\t"
+        required_sql += "AND email = ?;"
 
         self.assertEqual(sql, required_sql)
 
+    def test_statement_cache(self):
+        first = self.conn.select_from_table_where(User, self.conditions)
+        second = self.conn.select_from_table_where(User, dict(name="Other", email="other@mail.com"))
+
+        self.assertIs(first, second)
+        self.assertEqual(self.conn.statement_cache.hits, 1)
+        self.assertEqual(self.conn.statement_cache.misses, 1)
+
+    def test_statement_cache_eviction(self):
+        conn = SQLiteDBConnection("test.db", statement_cache_size=2)
+        conn.select_from_table_where(User, dict(name="Eduardo"))
+        conn.select_from_table_where(User, dict(email="eduardo@mail.com"))
+        # touch 'name' so that 'email' becomes the least recently used statement
+        conn.select_from_table_where(User, dict(name="Eduardo"))
+        conn.delete_from_table_where(User, dict(name="Eduardo"))
+
+        self.assertEqual(len(conn.statement_cache), 2)
+        self.assertEqual(conn.statement_cache.evictions, 1)
+        conn.select_from_table_where(User, dict(email="eduardo@mail.com"))
+        self.assertEqual(conn.statement_cache.misses, 4)
+
+
+
+class TestSQLiteBulkInsert(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        self.conn.execute(self.conn.create_table(User))
+        self.rows = [
+            dict(name="Eduardo", email="eduardo@mail.com", hashed_pw="hash1"),
+            dict(name="Ana", email="ana@mail.com", hashed_pw="hash2"),
+            # invalid: name is not a str
+            dict(name=1, email="one@mail.com", hashed_pw="hash3"),
+        ]
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def test_bulk_insert(self):
+        result = self.conn.bulk_insert(User, iter(self.rows), batch_size=2)
+
+        self.assertEqual((result.inserted, result.updated, result.rejected), (2, 0, 1))
+        self.assertEqual(len(self.conn.execute(self.conn.select_all_from_table(User))), 2)
+
+    def test_bulk_insert_rejects_duplicates(self):
+        self.conn.bulk_insert(User, self.rows)
+        result = self.conn.bulk_insert(User, self.rows[:1])
+
+        self.assertEqual((result.inserted, result.updated, result.rejected), (0, 0, 1))
+
+    def test_bulk_upsert(self):
+        self.conn.bulk_insert(User, self.rows)
+        rows = [dict(name="Eduardo N", email="eduardo@mail.com", hashed_pw="new"),
+                dict(name="Luis", email="luis@mail.com", hashed_pw="hash4")]
+        result = self.conn.bulk_insert(User, rows, upsert=True)
+
+        self.assertEqual((result.inserted, result.updated, result.rejected), (1, 1, 0))
+        sql = self.conn.select_from_table_where(User, dict(email="eduardo@mail.com"))
+        self.assertEqual(self.conn.execute(sql, ("eduardo@mail.com",))[0][1:],
+                         ("Eduardo N", "eduardo@mail.com", "new", None))
+
+    def test_bulk_upsert_repeated_rows(self):
+        self.conn.bulk_insert(User, self.rows)
+        rows = [dict(name="Luis", email="luis@mail.com", hashed_pw="hash4"),
+                dict(name="Luis N", email="luis@mail.com", hashed_pw="hash5"),
+                dict(name="Ana N", email="ana@mail.com", hashed_pw="hash6")]
+        result = self.conn.bulk_insert(User, rows, upsert=True, batch_size=2)
+
+        self.assertEqual((result.inserted, result.updated, result.rejected), (1, 2, 0))
+        sql = self.conn.select_from_table_where(User, dict(email="luis@mail.com"))
+        self.assertEqual(self.conn.execute(sql, ("luis@mail.com",))[0][1], "Luis N")
+
+
+    def test_iter_query(self):
+        self.conn.bulk_insert(User, self.rows)
+        rows = self.conn.iter_query(self.conn.select_all_from_table(User), chunk_size=1)
+
+        self.assertEqual([row[2] for row in rows], ["eduardo@mail.com", "ana@mail.com"])
+
+    def test_select_with_several_conditions(self):
+        self.conn.bulk_insert(User, self.rows)
+        sql = self.conn.select_from_table_where(User, dict(name="Ana", email="ana@mail.com"))
+
+        self.assertEqual([row[1] for row in self.conn.iter_query(sql, ("Ana", "ana@mail.com"))], ["Ana"])
+        self.assertEqual(list(self.conn.iter_query(sql, ("Ana", "eduardo@mail.com"))), [])
+
+    def test_row_type(self):
+        self.conn.bulk_insert(User, self.rows)
+        sql = self.conn.select_all_from_table(User)
+
+        rows = self.conn.execute(sql, row_type=User.__record__)
+        self.assertIsInstance(rows[0], User.__record__)
+        self.assertEqual([row.email for row in rows], ["eduardo@mail.com", "ana@mail.com"])
+        rows = self.conn.iter_query(sql, chunk_size=1, row_type=User.__record__)
+        self.assertEqual([row.name for row in rows], ["Eduardo", "Ana"])
+        # other statements still return plain tuples
+        self.assertIs(type(self.conn.execute(sql)[0]), tuple)
+
+    def test_fetch_columns(self):
+        self.conn.bulk_insert(User, self.rows)
+        columns = self.conn.fetch_columns("SELECT user_id, email FROM users ORDER BY user_id;",
+                                          chunk_size=1)
+
+        self.assertEqual(columns, dict(user_id=[1, 2], email=["eduardo@mail.com", "ana@mail.com"]))
+        self.assertEqual(self.conn.fetch_columns("SELECT email FROM users WHERE 0;"),
+                         dict(email=[]))
+
+
+
+class TestSQLiteTransaction(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        self.conn.execute(self.conn.create_table(User))
+        self.insert = self.conn.insert_into_table(User)
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def emails(self):
+        return [row[0] for row in self.conn.execute("SELECT email FROM users ORDER BY user_id;")]
+
+    def test_commit_and_rollback(self):
+        with self.conn.transaction():
+            self.conn.execute(self.insert, ("Eduardo", "eduardo@mail.com", "hash1", None))
+        self.conn.rollback()
+        self.assertEqual(self.emails(), ["eduardo@mail.com"])
+
+        with self.assertRaises(ZeroDivisionError):
+            with self.conn.transaction():
+                self.conn.execute(self.insert, ("Ana", "ana@mail.com", "hash2", None))
+                1 / 0
+        self.assertEqual(self.emails(), ["eduardo@mail.com"])
+
+    def test_savepoints(self):
+        with self.conn.transaction():
+            self.conn.execute(self.insert, ("Ana", "ana@mail.com", "hash2", None))
+            # the statements that fail raise inside a transaction
+            with self.assertRaises(sqlite3.IntegrityError):
+                with self.conn.transaction():
+                    self.conn.execute(self.insert, ("Luis", "luis@mail.com", "hash3", None))
+                    self.conn.execute(self.insert, ("Ana", "ana@mail.com", "hash2", None))
+            with self.conn.transaction():
+                self.conn.execute(self.insert, ("Sara", "sara@mail.com", "hash4", None))
+            # a bulk insert is a savepoint too
+            self.conn.bulk_insert(User, [dict(name="Eva", email="eva@mail.com", hashed_pw="hash5")])
+        self.conn.rollback()
+        self.assertEqual(self.emails(), ["ana@mail.com", "sara@mail.com", "eva@mail.com"])
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = os.path.join(self.tmp.name, "test.db")
+        conn = SQLiteDBConnection(self.url)
+        conn.connect()
+        migrate(conn, MODELS)
+        conn.close_connection()
+        self.writer = GroupCommitWriter(lambda: SQLiteDBConnection(self.url), window=0.05)
+
+    def tearDown(self):
+        self.writer.close()
+        self.tmp.cleanup()
+
+    @staticmethod
+    def insert(email):
+        return lambda conn: conn.execute(conn.insert_into_table(User), ("Name", email, "hash", None))
+
+    def test_enabled_by_profile(self):
+        with mock.patch("db.writer.GROUP_COMMIT", None):
+            self.assertTrue(group_commit_enabled("durable"))
+            self.assertFalse(group_commit_enabled("balanced"))
+            self.assertFalse(group_commit_enabled("throughput"))
+        with mock.patch("db.writer.GROUP_COMMIT", True):
+            self.assertTrue(group_commit_enabled("balanced"))
+
+    def emails(self):
+        conn = SQLiteDBConnection(self.url)
+        conn.connect()
+        emails = [row[0] for row in conn.execute("SELECT email FROM users ORDER BY user_id;")]
+        conn.close_connection()
+        return emails
+
+    def test_group_commit(self):
+        events = []
+        self.writer.add_write_listener(events.append)
+        futures = [self.writer.submit(self.insert(f"user{i}@mail.com")) for i in range(40)]
+
+        self.assertEqual([future.result() for future in futures], [[]] * 40)
+        self.assertEqual(len(self.emails()), 40)
+        self.assertEqual((self.writer.writes, self.writer.commits < 10), (40, True))
+        # the insert and its commit of every write
+        self.assertEqual(len(events), 80)
+
+    def test_errors(self):
+        futures = [self.writer.submit(self.insert("ana@mail.com")),
+                   self.writer.submit(self.insert("ana@mail.com")),
+                   self.writer.submit(lambda conn: 1 / 0),
+                   self.writer.submit(self.insert("luis@mail.com"))]
+
+        # the writes that fail are rolled back alone
+        self.assertEqual(futures[0].result(), [])
+        self.assertRaises(sqlite3.IntegrityError, futures[1].result)
+        self.assertRaises(ZeroDivisionError, futures[2].result)
+        self.assertEqual(futures[3].result(), [])
+        self.assertEqual(self.emails(), ["ana@mail.com", "luis@mail.com"])
+
+        self.writer.close()
+        self.assertRaises(WriterClosed, self.writer.submit, self.insert("sara@mail.com"))
+
+    def test_failed_commit(self):
+        class FailingCommit(MemoryDBConnection):
+            def commit(self):
+                raise OSError("disk I/O error")
+
+        with GroupCommitWriter(FailingCommit, window=0.05) as writer:
+            futures = [writer.submit(lambda conn: 1) for _ in range(3)]
+            for future in futures:
+                self.assertRaises(OSError, future.result)
+            self.assertEqual(writer.commits, 0)
+
+
+class TestMemoryDBConnection(unittest.TestCase):
+    def setUp(self):
+        self.conn = DBConnectionFactory("memory", "")
+        self.conn.connect()
+        for model in MODELS:
+            for sql in [self.conn.create_table(model), *self.conn.create_indexes(model),
+                        *self.conn.create_search_index(model)]:
+                self.conn.execute(sql)
+        self.rows = {
+            User: [dict(name="Eduardo", email="eduardo@mail.com", hashed_pw="hash1"),
+                   dict(name="Ana", email="ana@mail.com", hashed_pw="hash2")],
+            Password: [dict(user_id=i % 2 + 1, app_name=f"App {i}", app_url=f"https://app{i}.com",
+                            username=f"user{i}", password="encrypted") for i in range(10)]}
+        for table, rows in self.rows.items():
+            self.conn.bulk_insert(table, rows)
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def execute(self, sql, parameters=()):
+        """Execute a statement expected to fail, return the error printed"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(self.conn.execute(sql, parameters), [])
+        return output.getvalue()
+
+    def select(self, table, **conditions):
+        return self.conn.execute(self.conn.select_from_table_where(table, conditions),
+                                 tuple(conditions.values()))
+
+    def test_crud(self):
+        self.assertIsInstance(self.conn, MemoryDBConnection)
+        self.conn.execute(self.conn.insert_into_table(User), ("Luis", "luis@mail.com", "hash3", None))
+        self.assertEqual(self.select(User, email="luis@mail.com"),
+                         [(3, "Luis", "luis@mail.com", "hash3", None)])
+
+        sql = self.conn.update_from_table_where(User, dict(user_id=3), dict(name="Luis N"))
+        self.conn.execute(sql, ("Luis N", 3))
+        self.assertEqual(self.select(User, email="luis@mail.com")[0][1], "Luis N")
+        self.assertEqual(len(self.select(Password, user_id=1, app_url="https://app2.com")), 1)
+        # the columns not covered by the index are checked on its rows
+        self.assertEqual(len(self.select(Password, user_id=1, username="user2")), 1)
+        self.assertEqual(self.select(Password, user_id=1, username="user3"), [])
+
+        self.conn.execute(self.conn.delete_from_table_where(User, dict(user_id=3)), (3,))
+        self.assertEqual(self.select(User, email="luis@mail.com"), [])
+        self.assertEqual(len(self.conn.execute(self.conn.select_all_from_table(User))), 2)
+
+    def test_constraints(self):
+        insert = self.conn.insert_into_table(User)
+        self.assertIn("UNIQUE constraint failed: users.email",
+                      self.execute(insert, ("Other", "ana@mail.com", "hash", None)))
+        self.assertIn("NOT NULL constraint failed: users.name",
+                      self.execute(insert, (None, "other@mail.com", "hash", None)))
+        self.assertIn("FOREIGN KEY constraint failed", self.execute(
+            self.conn.insert_into_table(Password), (9, "App", "https://app.com", "user", "pw")))
+
+        # a statement that fails leaves no change: the first row was updated before the conflict
+        sql = self.conn.update_from_table_where(Password, dict(user_id=1), dict(app_url="same"))
+        self.assertIn("UNIQUE constraint failed", self.execute(sql, ("same", 1)))
+        self.assertEqual(self.select(Password, app_url="same"), [])
+        self.assertEqual(len(self.select(Password, username="user0")), 1)
+
+        # ON DELETE CASCADE
+        self.conn.execute(self.conn.delete_from_table_where(User, dict(user_id=1)), (1,))
+        self.assertEqual(self.select(Password, user_id=1), [])
+        self.assertEqual(len(self.select(Password, user_id=2)), 5)
+
+    def test_transactions(self):
+        self.conn.execute(self.conn.delete_from_table_where(User, dict(user_id=1)), (1,))
+        self.conn.execute(self.conn.insert_into_table(User), ("Luis", "luis@mail.com", "hash3", None))
+        self.conn.rollback()
+
+        self.assertEqual(len(self.select(Password, user_id=1)), 5)
+        self.assertEqual(self.select(User, email="luis@mail.com"), [])
+        self.conn.execute(self.conn.insert_into_table(User), ("Luis", "luis@mail.com", "hash3", None))
+        self.conn.commit()
+        self.conn.rollback()
+        self.assertEqual(self.select(User, email="luis@mail.com")[0][0], 3)
+
+    def test_savepoints(self):
+        insert = self.conn.insert_into_table(User)
+        with self.conn.transaction():
+            self.conn.execute(insert, ("Luis", "luis@mail.com", "hash3", None))
+            with self.assertRaises(UniqueConstraintError):
+                with self.conn.transaction():
+                    self.conn.execute(self.conn.delete_from_table_where(User, dict(user_id=1)), (1,))
+                    self.conn.execute(insert, ("Other", "ana@mail.com", "hash", None))
+        self.conn.rollback()
+
+        self.assertEqual(self.select(User, email="luis@mail.com")[0][0], 3)
+        # the cascade of the rolled back delete was undone too
+        self.assertEqual(len(self.select(Password, user_id=1)), 5)
+
+        with self.assertRaises(ZeroDivisionError):
+            with self.conn.transaction():
+                self.conn.execute(self.conn.delete_from_table_where(User, dict(user_id=3)), (3,))
+                1 / 0
+        self.assertEqual(len(self.select(User, email="luis@mail.com")), 1)
+
+    def test_compaction(self):
+        sql = self.conn.delete_from_table_where(Password, dict(user_id=2))
+        self.conn.execute(sql, (2,))
+        self.conn.commit()
+        table = self.conn.tables["passwords"]
+        self.assertEqual((len(table.alive), table.dead), (10, 5))
+
+        self.conn.execute(self.conn.delete_from_table_where(Password, dict(app_name="App 0")), ("App 0",))
+        self.conn.commit()
+        self.assertEqual((len(table.alive), table.dead), (4, 0))
+        self.assertEqual([row[2] for row in self.select(Password, user_id=1)],
+                         ["App 2", "App 4", "App 6", "App 8"])
+        self.assertEqual(len(self.select(Password, app_url="https://app8.com")), 1)
+
+    def test_bulk_insert(self):
+        rows = [dict(name="Eduardo N", email="eduardo@mail.com", hashed_pw="new"),
+                dict(name="Luis", email="luis@mail.com", hashed_pw="hash3"),
+                dict(name=1, email="one@mail.com", hashed_pw="hash4")]
+        result = self.conn.bulk_insert(User, rows)
+        self.assertEqual((result.inserted, result.updated, result.rejected), (1, 0, 2))
+
+        result = self.conn.bulk_insert(User, rows, upsert=True)
+        self.assertEqual((result.inserted, result.updated, result.rejected), (0, 2, 1))
+        self.assertEqual(self.select(User, email="eduardo@mail.com"),
+                         [(1, "Eduardo N", "eduardo@mail.com", "new", None)])
+
+    def test_reads(self):
+        sql = self.conn.select_from_table_where(Password, dict(user_id=None))
+        rows = self.conn.execute(sql, (1,), row_type=Password.__record__)
+        self.assertEqual([row.app_name for row in rows], [f"App {i}" for i in range(0, 10, 2)])
+        rows = self.conn.iter_query(sql, (2,), chunk_size=2)
+        self.assertEqual([row[0] for row in rows], [2, 4, 6, 8, 10])
+        self.assertEqual(self.conn.fetch_columns(sql, (2,))["username"],
+                         [f"user{i}" for i in range(1, 10, 2)])
+        self.assertIn("Unsupported statement", self.execute("SELECT * FROM users;"))
+
+    def test_query(self):
+        sqlite = SQLiteDBConnection(":memory:")
+        sqlite.connect()
+        self.addCleanup(sqlite.close_connection)
+        migrate(sqlite, MODELS)
+        for table, rows in self.rows.items():
+            sqlite.bulk_insert(table, rows)
+        self.conn.execute(self.conn.update_from_table_where(
+            Password, dict(password_id=4), dict(app_name="App 0")), ("App 0", 4))
+        sqlite.execute(sqlite.update_from_table_where(
+            Password, dict(password_id=4), dict(app_name="App 0")), ("App 0", 4))
+
+        url = Column("app_url")
+        queries = [
+            Query(Password).select("app_url").where(user_id=1).order_by("-app_url"),
+            Query(Password).where(url.in_(["https://app1.com", "https://app2.com"])
+                                  | ~(url < "https://app8.com")),
+            Query(Password).select("password_id").where(Column("password_id").between(3, 6),
+                                                        user_id=2),
+            Query(Password).where(Column("password_id") != None).order_by("app_name").limit(4),
+            Query(User).where(Column("kdf_salt") == None, Column("name").in_([])),
+        ]
+        for query in queries:
+            self.assertEqual(self.conn.execute(*self.conn.build_query(query)),
+                             sqlite.execute(*sqlite.build_query(query)), query)
+
+        # keyset pages with mixed directions, ties broken by the primary key
+        query = (Query(Password).select("password_id", "app_name", "user_id")
+                 .order_by("app_name", "-user_id").limit(3))
+        pages = {}
+        for conn in (self.conn, sqlite):
+            ids, page = [], query
+            while rows := conn.execute(*conn.build_query(page)):
+                ids += [row[0] for row in rows]
+                page = query.after(query.cursor(rows[-1]))
+            pages[conn] = ids
+        self.assertEqual(pages[self.conn], pages[sqlite])
+        self.assertEqual(sorted(pages[self.conn]), list(range(1, 11)))
+
+        with self.assertRaises(ValueError):
+            self.conn.build_query(Query(Password).where(Predicate("length(app_url) > ?", (5,))))
+
+    def test_search(self):
+        sql = self.conn.search_table(Password, dict(user_id=1))
+        self.conn.execute(self.conn.update_from_table_where(
+            Password, dict(password_id=3), dict(app_name="GitHub")), ("GitHub", 3))
+
+        self.assertEqual([row[2] for row in self.conn.execute(sql, ('"git"*', 1, 20, 0))],
+                         ["GitHub"])
+        # the app name weighs more than the url
+        rows = self.conn.execute(sql, ('"app"*', 1, 20, 0))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[-1][2], "GitHub")
+        self.assertEqual(self.conn.execute(sql, ('"app8"*', 1, 20, 0))[0][3], "https://app8.com")
+        self.assertEqual(self.conn.execute(sql, ('"app8"*', 2, 20, 0)), [])
+        self.assertEqual(len(self.conn.execute(sql, ('"app"*', 1, 2, 2))), 2)
+        # the rows of the owners follow the updates
+        self.conn.execute(self.conn.update_from_table_where(
+            Password, dict(password_id=3), dict(user_id=2)), (2, 3))
+        self.assertEqual(self.conn.execute(sql, ('"git"*', 1, 20, 0)), [])
+        self.assertEqual(len(self.conn.execute(sql, ('"git"*', 2, 20, 0))), 1)
+
+
+class TestAsyncSQLiteDBConnection(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.conn = AsyncSQLiteDBConnection(":memory:")
+        await self.conn.connect()
+        await self.conn.run_sync(migrate, MODELS)
+        await self.conn.bulk_insert(User, [
+            dict(name="Eduardo", email="eduardo@mail.com", hashed_pw="hash1"),
+            dict(name="Ana", email="ana@mail.com", hashed_pw="hash2")])
+
+    async def asyncTearDown(self):
+        await self.conn.close_connection()
+
+    async def test_execute_and_stream(self):
+        sql = self.conn.select_all_from_table(User)
+
+        rows = await self.conn.execute(sql, row_type=User.__record__)
+        self.assertEqual([row.email for row in rows], ["eduardo@mail.com", "ana@mail.com"])
+        names = [row[1] async for row in self.conn.iter_query(sql, chunk_size=1)]
+        self.assertEqual(names, ["Eduardo", "Ana"])
+        self.assertEqual((await self.conn.fetch_columns(sql))["user_id"], [1, 2])
+
+    async def test_transaction(self):
+        insert = self.conn.insert_into_table(User)
+        with self.assertRaises(ZeroDivisionError):
+            async with self.conn.transaction():
+                await self.conn.execute(insert, ("Luis", "luis@mail.com", "hash3", None))
+                1 / 0
+        count = "SELECT COUNT(*) FROM users;"
+        self.assertEqual(await self.conn.execute(count), [(2,)])
+
+        async def write():
+            async with self.conn.transaction():
+                await self.conn.execute(insert, ("Luis", "luis@mail.com", "hash3", None))
+                # the other tasks wait until the transaction is committed
+                await asyncio.sleep(0.05)
+                async with self.conn.transaction():
+                    await self.conn.execute(insert, ("Sara", "sara@mail.com", "hash4", None))
+
+        async def read():
+            await asyncio.sleep(0.01)
+            return await self.conn.execute(count)
+
+        _, counted = await asyncio.gather(write(), read())
+        self.assertEqual(counted, [(4,)])
+
+        # a nested transaction is a savepoint
+        async with self.conn.transaction():
+            await self.conn.execute(insert, ("Eva", "eva@mail.com", "hash5", None))
+            with self.assertRaises(sqlite3.IntegrityError):
+                async with self.conn.transaction():
+                    await self.conn.execute(insert, ("Eva", "eva@mail.com", "hash5", None))
+        self.assertEqual(await self.conn.execute(count), [(5,)])
+
+
+class TestSQLiteQueryPlan(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        for model in (User, Password):
+            self.conn.execute(self.conn.create_table(model))
+            for sql in self.conn.create_indexes(model) + self.conn.create_search_index(model):
+                self.conn.execute(sql)
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def test_search_starts_from_the_full_text_index(self):
+        sql = self.conn.search_table(Password, dict(user_id=1))
+        plan = self.conn.explain_query_plan(sql, ('"git"*', 1, 20, 0))
+
+        self.assertTrue(plan[0].startswith("SCAN passwords_fts VIRTUAL TABLE"), plan)
+        self.assertIn("SEARCH t USING INTEGER PRIMARY KEY", plan[1])
+        # ranked by the full-text index itself, no sort
+        self.assertNotIn("TEMP B-TREE", " ".join(plan))
+
+    def test_vault_queries_use_index(self):
+        queries = [
+            (self.conn.select_from_table_where(Password, dict(user_id=1)), (1,)),
+            ("SELECT * FROM passwords WHERE user_id = ? AND app_url = ?;", (1, "github.com")),
+        ]
+        for sql, parameters in queries:
+            plan = " ".join(self.conn.explain_query_plan(sql, parameters))
+
+            self.assertIn("USING", plan)
+            self.assertNotIn("SCAN", plan)
+
+
+
+class TestSQLiteProfile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.url = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_profile_applied(self):
+        conn = SQLiteDBConnection(self.url, profile="durable")
+        conn.connect()
+
+        self.assertEqual(conn.pragmas["journal_mode"], "wal")
+        self.assertEqual(conn.pragmas["synchronous"], 2)
+        self.assertEqual(conn.profile_mismatches(), {})
+        conn.close_connection()
+
+    def test_readers_not_blocked_by_writer(self):
+        writer = SQLiteDBConnection(self.url, profile="balanced")
+        reader = SQLiteDBConnection(self.url, profile="balanced")
+        writer.connect()
+        reader.connect()
+        writer.execute(writer.create_table(User))
+        writer.commit()
+
+        # the writer keeps its transaction open while the reader reads
+        writer.execute(writer.insert_into_table(User), ("Eduardo", "eduardo@mail.com", "hash", None))
+        self.assertEqual(reader.execute(reader.select_all_from_table(User)), [])
+        writer.commit()
+        self.assertEqual(len(reader.execute(reader.select_all_from_table(User))), 1)
+
+        writer.close_connection()
+        reader.close_connection()
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            SQLiteDBConnection(self.url, profile="unknown").connect()
+
+
+
+class TestQueryInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = QueryInstrumentation(enabled=True, slow_query_ms=0.0001,
+                                                    slow_query_log=None)
+        self.conn = SQLiteDBConnection(":memory:", instrumentation=self.instrumentation)
+        self.conn.connect()
+        with self.assertLogs("db.slow_queries") as logs:
+            self.conn.execute(self.conn.create_table(User))
+        self.assertIn("CREATE TABLE IF NOT EXISTS users", logs.output[0])
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def test_stats(self):
+        sql = self.conn.insert_into_table(User)
+        for i in range(3):
+            self.conn.execute(sql, ("Eduardo", f"eduardo{i}@mail.com", "hash", None))
+        self.conn.commit()
+        list(self.conn.iter_query(self.conn.select_all_from_table(User)))
+
+        stats = self.instrumentation.stats()
+        self.assertEqual(stats[" ".join(sql.split())]["count"], 3)
+        self.assertEqual(stats["SELECT * FROM users;"]["rows"], 3)
+        self.assertEqual(stats["COMMIT;"]["count"], 1)
+
+    def test_errors_and_hooks(self):
+        events = []
+        self.instrumentation.add_hook(events.append)
+        self.conn.execute("SELECT * FROM missing_table;")
+
+        self.assertEqual(self.instrumentation.stats()["SELECT * FROM missing_table;"]["errors"], 1)
+        self.assertIsNotNone(events[0].error)
+
+    def test_slow_query_log_hides_values(self):
+        sql = self.conn.select_from_table_where(User, dict(email=None))
+        with self.assertLogs("db.slow_queries") as logs:
+            self.conn.execute(sql, ("secret@mail.com",))
+
+        self.assertIn("1 params", logs.output[0])
+        self.assertNotIn("secret@mail.com", logs.output[0])
+
+    def test_slow_query_file(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "slow.log")
+        logger = self.instrumentation.logger
+        handlers = list(logger.handlers)
+        self.addCleanup(lambda: [(logger.removeHandler(h), h.close())
+                                 for h in logger.handlers if h not in handlers])
+
+        QueryInstrumentation(enabled=False, slow_query_ms=0.0001, slow_query_log=path)
+        first = QueryInstrumentation(enabled=True, slow_query_ms=0.0001, slow_query_log=path)
+        second = QueryInstrumentation(enabled=True, slow_query_ms=0.0001, slow_query_log=path)
+        self.assertEqual(logger.handlers, handlers)
+
+        first.record("SELECT 1;", 1.0)
+        second.record("SELECT 2;", 1.0)
+        self.assertEqual(len(logger.handlers), len(handlers) + 1)
+        logger.handlers[-1].flush()
+        with open(path) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+    def test_slow_query_log_disabled(self):
+        self.instrumentation.slow_query_ms = 0
+        with self.assertNoLogs("db.slow_queries"):
+            self.conn.execute(self.conn.select_all_from_table(User))
+
+    def test_disabled(self):
+        self.instrumentation.enabled = False
+        self.instrumentation.reset()
+        self.conn.execute(self.conn.select_all_from_table(User))
+
+        self.assertEqual(self.instrumentation.stats(), {})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+from unittest import mock
+from db.db import SQLiteDBConnection
+from db.migrations import Migration, MigrationError, migrate, rebuild_table, column_names, \
+    schema_fingerprint
+from models.models import User, Password, MODELS
+from models import migrations
+from models.migrations import MIGRATIONS
+
+
+# Schema of the passwords table before user_id was added
+OLD_PASSWORDS = """CREATE TABLE passwords (
+    password_id INTEGER PRIMARY KEY, app_name TEXT NOT NULL,
+    app_url TEXT NOT NULL UNIQUE, username TEXT NOT NULL UNIQUE, password TEXT NOT NULL);"""
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def user_version(self):
+        return self.conn.execute("PRAGMA user_version;")[0][0]
+
+    def test_fresh_database(self):
+        self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "created")
+        self.assertEqual(self.user_version(), schema_fingerprint(MODELS, MIGRATIONS))
+        self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "unchanged")
+
+        versions = self.conn.execute("SELECT version FROM schema_migrations;")
+        self.assertEqual(versions, [(m.version,) for m in MIGRATIONS])
+
+    def test_migrate_existing_database(self):
+        self.conn.execute(self.conn.create_table(User))
+        self.conn.execute(OLD_PASSWORDS)
+        self.conn.commit()
+
+        self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "migrated")
+        self.assertIn("user_id", column_names(self.conn, "passwords"))
+        indexes = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")
+        self.assertIn(("idx_passwords_user_id_app_url",), indexes)
+        # app_url and username are no longer unique across users
+        unique = [row[1] for row in self.conn.execute("PRAGMA index_list(passwords);") if row[2]]
+        self.assertEqual(unique, ["idx_passwords_user_id_app_url"])
+
+    def legacy_database(self, users: int) -> None:
+        self.conn.execute(self.conn.create_table(User))
+        self.conn.execute(OLD_PASSWORDS)
+        for i in range(users):
+            self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES (?, ?, 'h');",
+                              (f"user{i}", f"user{i}@mail.com"))
+        for i in range(3):
+            self.conn.execute("INSERT INTO passwords (app_name, app_url, username, password) "
+                              + "VALUES (?, ?, ?, ?);", (f"app{i}", f"url{i}", f"user{i}", "pw"))
+        self.conn.commit()
+
+    def test_migrate_legacy_rows_to_the_only_user(self):
+        self.legacy_database(users=1)
+
+        self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "migrated")
+        rows = self.conn.execute("SELECT user_id, app_url FROM passwords ORDER BY password_id;")
+        self.assertEqual(rows, [(1, f"url{i}") for i in range(3)])
+
+    def test_migrate_legacy_rows_needs_an_owner(self):
+        self.legacy_database(users=2)
+
+        with self.assertRaisesRegex(MigrationError, "LEGACY_PASSWORDS_OWNER"):
+            migrate(self.conn, MODELS, MIGRATIONS)
+        self.assertNotIn("user_id", column_names(self.conn, "passwords"))
+
+        with mock.patch.object(migrations, "LEGACY_PASSWORDS_OWNER", 3):
+            with self.assertRaisesRegex(MigrationError, "not a user_id"):
+                migrate(self.conn, MODELS, MIGRATIONS)
+        with mock.patch.object(migrations, "LEGACY_PASSWORDS_OWNER", 2):
+            self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "migrated")
+        self.assertEqual(self.conn.execute("SELECT DISTINCT user_id FROM passwords;"), [(2,)])
+
+    def test_search_index_of_existing_rows(self):
+        self.conn.execute(self.conn.create_table(User))
+        self.conn.execute(self.conn.create_table(Password))
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('a', 'a@mail.com', 'h');")
+        self.conn.execute("INSERT INTO passwords (user_id, app_name, app_url, username, password) "
+                          + "VALUES (1, 'GitHub', 'https://github.com', 'edu', 'pw');")
+        self.conn.commit()
+
+        self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "migrated")
+        rows = self.conn.execute("SELECT rowid FROM passwords_fts WHERE passwords_fts MATCH 'git*';")
+        self.assertEqual(rows, [(1,)])
+
+    def test_search_index_by_owner(self):
+        self.conn.execute(self.conn.create_table(User))
+        self.conn.execute(self.conn.create_table(Password))
+        # full-text index created before the owner was indexed
+        self.conn.execute("CREATE VIRTUAL TABLE passwords_fts USING fts5(app_name, app_url, "
+                          + "username, content='passwords', content_rowid='password_id');")
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('a', 'a@mail.com', 'h');")
+        self.conn.execute("INSERT INTO passwords (user_id, app_name, app_url, username, password) "
+                          + "VALUES (1, 'GitHub', 'https://github.com', 'edu', 'pw');")
+        self.conn.commit()
+
+        self.assertEqual(migrate(self.conn, MODELS, MIGRATIONS), "migrated")
+        rows = self.conn.execute("SELECT rowid FROM passwords_fts "
+                                 + "WHERE passwords_fts MATCH 'git* AND user_id : 1';")
+        self.assertEqual(rows, [(1,)])
+
+    def test_rebuild_table_in_batches(self):
+        self.conn.execute(self.conn.create_table(User))
+        self.conn.execute(OLD_PASSWORDS)
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('a', 'a@mail.com', 'h');")
+        for i in range(5):
+            self.conn.execute("INSERT INTO passwords (app_name, app_url, username, password) "
+                              + "VALUES (?, ?, ?, ?);", (f"app{i}", f"url{i}", f"user{i}", "pw"))
+        self.conn.commit()
+
+        copied = rebuild_table(self.conn, Password, {"user_id": "1"}, batch_size=2)
+        self.conn.commit()
+
+        self.assertEqual(copied, 5)
+        rows = self.conn.execute("SELECT password_id, user_id, app_url FROM passwords;")
+        self.assertEqual(rows, [(i + 1, 1, f"url{i}") for i in range(5)])
+
+    def test_failed_migration_rolls_back(self):
+        def fail(conn):
+            conn.conn.execute("CREATE TABLE partial (x INTEGER);")
+            conn.conn.execute("SELECT * FROM missing_table;")
+
+        self.conn.execute(self.conn.create_table(User))
+        self.conn.commit()
+        migrations = [Migration(1, "fails", fail)]
+
+        with self.assertRaises(MigrationError):
+            migrate(self.conn, MODELS, migrations)
+        self.assertEqual(self.user_version(), 0)
+        tables = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+        self.assertEqual(tables, [("users",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
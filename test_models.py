@@ -1,3 +1,5 @@
+import pickle
+import sys
 import unittest
 from models.models import User, Password
 from models.typing import SQLDataType, Integer, Text
@@ -9,6 +11,7 @@ class TestUser(unittest.TestCase):
         self.schema = dict(
             user_id=Integer(primary_key=True), name=Text(nullable=False),
             email=Text(nullable=False), hashed_pw=Text(nullable=False),
+            kdf_salt=Text(),
         )
 
         # This should be validated correctly
@@ -42,6 +45,31 @@ class TestUser(unittest.TestCase):
         self.assertFalse(User.validate_data(self.data_incorrect_1))
         self.assertFalse(User.validate_data(self.data_incorrect_2))
 
+    def test_validate_data_primary_key(self):
+        data = dict(self.data_correct, user_id=1)
+        self.assertFalse(User.validate_data(data))
+
+    def test_validate_many(self):
+        rows = [self.data_correct, self.data_incorrect_1, self.data_incorrect_2]
+        self.assertEqual(User.validate_many(rows), [True, False, False])
+
+    def test_compiled_schema(self):
+        schema = User.__compiled__
+        self.assertEqual(schema.column_names, ("user_id", "name", "email", "hashed_pw", "kdf_salt"))
+        self.assertEqual(schema.primary_key, "user_id")
+        self.assertEqual(schema.insert_columns, ("name", "email", "hashed_pw", "kdf_salt"))
+        self.assertEqual(schema.required, {"name", "email", "hashed_pw"})
+        self.assertEqual(schema.unique_columns, ("email",))
+
+    def test_record(self):
+        record = User.__record__(1, "Eduardo", "eduardo@mail.com", "hash", None)
+        self.assertEqual(record._fields, User.__compiled__.column_names)
+        self.assertEqual((record.email, record[2]), ("eduardo@mail.com", "eduardo@mail.com"))
+        # no instance dictionary: the record is as big as the tuple of the row
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertEqual(sys.getsizeof(record), sys.getsizeof(tuple(record)))
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+
 
 class TestPassword(unittest.TestCase):
     def setUp(self):
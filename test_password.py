@@ -0,0 +1,291 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from db.db import SQLiteDBConnection, DBConnectionFactory
+from db.migrations import migrate
+from messages import Messages
+from models.models import MODELS, User, Password
+from password import breach
+from password.breach import BreachChecker, BreachCorpusError, convert, password_digest
+from password.password import store_password, iter_passwords, page_passwords, write_passwords_csv
+from password.search import search, match_expression, rebuild_index
+from password.vault import SessionKeyCache, VaultCipher, VaultDecryptionError, VaultKeyError, \
+    cipher_for, derive_key, new_salt, session_keys
+
+
+class TestVaultCipher(unittest.TestCase):
+    def setUp(self):
+        self.key = derive_key("master", new_salt(), cost=10)
+        self.cipher = VaultCipher(self.key, user_id=1)
+
+    def test_encrypt_decrypt(self):
+        encrypted = self.cipher.encrypt("secret")
+
+        self.assertTrue(encrypted.startswith("v1:"))
+        self.assertNotIn("secret", encrypted)
+        self.assertEqual(self.cipher.decrypt(encrypted), "secret")
+
+    def test_batch(self):
+        values = [f"secret{i}" for i in range(100)]
+        encrypted = self.cipher.encrypt_many(values)
+
+        self.assertEqual(list(self.cipher.decrypt_many(encrypted)), values)
+
+    def test_bound_to_user_and_field(self):
+        encrypted = self.cipher.encrypt("secret")
+
+        with self.assertRaises(VaultDecryptionError):
+            VaultCipher(self.key, user_id=2).decrypt(encrypted)
+        with self.assertRaises(VaultDecryptionError):
+            self.cipher.decrypt(encrypted, field="username")
+
+    def test_invalid_value(self):
+        for value in ("v1:not base64!", "v1:abc", "v1:é"):
+            with self.assertRaises(VaultDecryptionError):
+                self.cipher.decrypt(value)
+
+
+class TestSessionKeyCache(unittest.TestCase):
+    def test_wipe(self):
+        cache = SessionKeyCache(ttl=60)
+        cache.put(1, b"k" * 32)
+        key_buffer = cache._keys[1][0]
+        cache.wipe(1)
+
+        self.assertEqual(key_buffer, bytearray(32))
+        with self.assertRaises(VaultKeyError):
+            cache.get(1)
+
+    def test_ttl(self):
+        cache = SessionKeyCache(ttl=0)
+        cache.put(1, b"k" * 32)
+
+        with self.assertRaises(VaultKeyError):
+            cache.get(1)
+
+
+class TestBreachChecker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "breached.bin")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def sha1(password):
+        return hashlib.sha1(password.encode()).hexdigest().upper()
+
+    def test_sha1_corpus(self):
+        passwords = [f"password{i}" for i in range(2_000)]
+        lines = [f"{self.sha1(password)}:{i + 1}\r\n" for i, password in enumerate(passwords)]
+        # in any order and case, repeated hashes are summed, other lines are skipped
+        lines = lines[::-1] + [f"{self.sha1('password7').lower()}:2\n", "not a hash\n", "ABCD:1\n"]
+
+        self.assertEqual(convert(lines, self.path, index_bits=8), 2_000)
+        with BreachChecker(self.path) as checker:
+            self.assertEqual((len(checker), checker.algorithm, checker.prefix_bytes), (2_000, "sha1", 10))
+            self.assertEqual(checker.times_breached("password0"), 1)
+            self.assertEqual(checker.times_breached("password7"), 10)
+            self.assertEqual(checker.times_breached("password1999"), 2_000)
+            self.assertEqual(checker.times_breached("not breached"), 0)
+            self.assertTrue(all(checker.times_breached(password) for password in passwords))
+
+    def test_ntlm_plaintext(self):
+        self.assertEqual(password_digest("password", "ntlm").hex(), "8846f7eaee8fb117ad06bdd830b7586c")
+        convert(["password\n", "123456\n", "password\n"], self.path, "ntlm", plaintext=True)
+
+        with BreachChecker(self.path) as checker:
+            self.assertEqual(checker.algorithm, "ntlm")
+            self.assertEqual(checker.times_breached("password"), 2)
+            self.assertEqual(checker.times_breached("Password"), 0)
+
+    def test_invalid_file(self):
+        convert([], self.path)
+        with BreachChecker(self.path) as checker:
+            self.assertEqual(checker.times_breached("password"), 0)
+
+        with open(self.path, "ab") as file:
+            file.write(b"x")
+        with self.assertRaises(BreachCorpusError):
+            BreachChecker(self.path)
+
+
+class TestVault(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        migrate(self.conn, MODELS)
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('a', 'a@mail.com', 'h');")
+        self.user = dict(user_id=1)
+        session_keys.put(1, derive_key("master", new_salt(), cost=10))
+
+    def tearDown(self):
+        session_keys.wipe(1)
+        self.conn.close_connection()
+
+    def test_store_and_list(self):
+        store_password(self.conn, self.user, "GitHub", "github.com", "edu", "secret")
+        stored = self.conn.execute("SELECT password FROM passwords;")[0][0]
+        entries = list(iter_passwords(self.conn, self.user))
+
+        self.assertNotEqual(stored, "secret")
+        self.assertEqual(entries[0]["password"], "secret")
+
+    def test_same_app_for_two_users(self):
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('b', 'b@mail.com', 'h');")
+        session_keys.put(2, derive_key("other", new_salt(), cost=10))
+        self.addCleanup(session_keys.wipe, 2)
+
+        store_password(self.conn, self.user, "GitHub", "github.com", "edu", "secret")
+        store_password(self.conn, dict(user_id=2), "GitHub", "github.com", "edu", "other")
+
+        self.assertEqual([e["password"] for e in iter_passwords(self.conn, self.user)], ["secret"])
+        self.assertEqual([e["password"] for e in iter_passwords(self.conn, dict(user_id=2))],
+                         ["other"])
+
+    def test_store_failure(self):
+        self.assertEqual(store_password(self.conn, self.user, "GitHub", "github.com", "edu",
+                                        "secret").message, Messages.VAULT_SUCCESS)
+        response = store_password(self.conn, self.user, "GitHub", "github.com", "ana", "other")
+
+        self.assertEqual(response.message, Messages.VAULT_FAILURE)
+        self.assertEqual([e["username"] for e in iter_passwords(self.conn, self.user)], ["edu"])
+
+    def test_breached_password_saved_with_warning(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "breached.bin")
+        convert(["secret\n"], path, plaintext=True)
+        checker = self.enterContext(BreachChecker(path))
+
+        with mock.patch.object(breach, "get_breach_checker", lambda: checker):
+            self.assertEqual(store_password(self.conn, self.user, "GitHub", "github.com", "edu",
+                                            "secret").data, 1)
+            self.assertEqual(store_password(self.conn, self.user, "GitLab", "gitlab.com", "ana",
+                                            "other").data, 0)
+        self.assertEqual(len(list(iter_passwords(self.conn, self.user))), 2)
+
+    def test_pages(self):
+        for i in range(5):
+            store_password(self.conn, self.user, f"App{i}", f"app{i}.com", f"user{i}", f"pw{i}")
+
+        first, cursor = page_passwords(self.conn, self.user, limit=3)
+        second, last = page_passwords(self.conn, self.user, cursor, limit=3)
+
+        self.assertEqual([e["app_url"] for e in first + second], [f"app{i}.com" for i in range(5)])
+        self.assertEqual(second[-1]["password"], "pw4")
+        self.assertIsNone(last)
+        self.assertEqual(list(iter_passwords(self.conn, self.user, ("username",), app_url="app3.com")),
+                         [dict(username="user3")])
+
+    def test_memory_engine(self):
+        conn = DBConnectionFactory("memory", "")
+        conn.connect()
+        self.addCleanup(conn.close_connection)
+        for model in MODELS:
+            for sql in [conn.create_table(model), *conn.create_indexes(model)]:
+                conn.execute(sql)
+        conn.execute(conn.insert_into_table(User), ("a", "a@mail.com", "h", None))
+        for i in reversed(range(5)):
+            store_password(conn, self.user, f"App{i}", f"app{i}.com", f"user{i}", f"pw{i}")
+
+        first, cursor = page_passwords(conn, self.user, limit=3)
+        second, last = page_passwords(conn, self.user, cursor, limit=3)
+        self.assertEqual([e["app_url"] for e in first + second], [f"app{i}.com" for i in range(5)])
+        self.assertIsNone(last)
+        self.assertEqual(list(iter_passwords(conn, self.user, ("password",), app_url="app3.com")),
+                         [dict(password="pw3")])
+
+    def test_export(self):
+        store_password(self.conn, self.user, "GitHub", "github.com", "edu", "secret")
+        file = io.StringIO()
+
+        self.assertEqual(write_passwords_csv(self.conn, self.user, file), 1)
+        self.assertIn("GitHub,github.com,edu,secret", file.getvalue())
+
+    def test_locked_vault(self):
+        session_keys.wipe(1)
+
+        with self.assertRaises(VaultKeyError):
+            store_password(self.conn, self.user, "GitHub", "github.com", "edu", "secret")
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        migrate(self.conn, MODELS)
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('a', 'a@mail.com', 'h');")
+        self.user = dict(user_id=1)
+        session_keys.put(1, derive_key("master", new_salt(), cost=10))
+        for app_name, app_url, username in [("GitHub", "https://github.com", "edu"),
+                                            ("GitLab", "https://gitlab.com", "eduardo"),
+                                            ("Bank", "https://mybank.com", "github-fan")]:
+            store_password(self.conn, self.user, app_name, app_url, username, "secret")
+
+    def tearDown(self):
+        session_keys.wipe_all()
+        self.conn.close_connection()
+
+    def names(self, query, **kwargs):
+        return [entry["app_name"] for entry in search(self.conn, self.user, query, **kwargs)]
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('git "hub" OR'), '"git"* "hub"* "OR"*')
+        self.assertEqual(self.names("*"), [])
+
+    def test_prefix_search_ranked(self):
+        # app_name weighs more than username
+        self.assertEqual(self.names("gith"), ["GitHub", "Bank"])
+        self.assertEqual(self.names("git edua"), ["GitLab"])
+        self.assertEqual(search(self.conn, self.user, "bank")[0]["password"], "secret")
+
+    def test_pagination(self):
+        self.assertEqual(self.names("com", limit=2) + self.names("com", limit=2, offset=2),
+                         sorted(self.names("com"), key=self.names("com").index))
+        self.assertEqual(len(self.names("com", limit=2, offset=2)), 1)
+
+    def test_every_match_ranked(self):
+        encrypted = cipher_for(1).encrypt("pw")
+        self.conn.bulk_insert(Password, (
+            dict(user_id=1, app_name=f"App{i}", app_url=f"https://app{i}.com",
+                 username=f"user{i}", password=encrypted) for i in range(1500)))
+        # the best match comes after the first 1000 matches in rowid order
+        store_password(self.conn, self.user, "Gitea", "https://gitea.io", "gitea", "secret")
+
+        self.assertEqual(self.names("git", limit=1), ["Gitea"])
+        self.assertEqual(len(self.names("com", limit=100, offset=1400)), 100)
+        self.assertEqual(len(self.names("com", limit=100, offset=1500)), 3)
+
+    def test_index_follows_changes(self):
+        self.conn.execute("UPDATE passwords SET app_name = 'Codeberg', "
+                          + "app_url = 'https://codeberg.org' WHERE app_name = 'GitLab';")
+        self.conn.execute("DELETE FROM passwords WHERE app_name = 'Bank';")
+
+        self.assertEqual(self.names("git"), ["GitHub"])
+        self.assertEqual(self.names("code"), ["Codeberg"])
+
+    def test_rebuild(self):
+        self.conn.execute("DELETE FROM passwords_fts;")
+        self.assertEqual(self.names("git"), [])
+
+        rebuild_index(self.conn)
+        self.assertEqual(self.names("gitl"), ["GitLab"])
+
+    def test_other_users(self):
+        session_keys.put(2, derive_key("master", new_salt(), cost=10))
+        self.assertEqual(search(self.conn, dict(user_id=2), "git"), [])
+
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('b', 'b@mail.com', 'h');")
+        store_password(self.conn, dict(user_id=2), "Gitea", "https://gitea.io", "ana", "secret")
+        self.assertEqual([e["app_name"] for e in search(self.conn, dict(user_id=2), "git")],
+                         ["Gitea"])
+        self.assertEqual(self.names("git"), ["GitHub", "GitLab", "Bank"])
+        # the user_id indexed with the entries isn't matched by the words
+        self.assertEqual(self.names("1"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import unittest
+from db.pool_manager import ReusablePool, PoolManager, PoolTimeout, create_sqlite_pool
+
+
+class TestReusablePool(unittest.TestCase):
+    def setUp(self):
+        self.counter = 0
+
+        def factory():
+            self.counter += 1
+            return dict(id=self.counter, healthy=True)
+
+        self.pool = ReusablePool(2, factory, check=lambda obj: obj["healthy"],
+                                 timeout=0.05)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_acquire_release(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        second = self.pool.acquire()
+
+        self.assertIs(first, second)
+        self.assertEqual(self.counter, 1)
+
+    def test_acquire_timeout(self):
+        self.pool.acquire()
+        self.pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        self.assertEqual(self.pool.stats().timeouts, 1)
+
+    def test_acquire_waits_for_release(self):
+        obj = self.pool.acquire()
+        self.pool.acquire()
+        threading.Timer(0.01, self.pool.release, args=(obj,)).start()
+
+        self.assertIs(self.pool.acquire(timeout=1), obj)
+
+    def test_health_check(self):
+        obj = self.pool.acquire()
+        obj["healthy"] = False
+        self.pool.release(obj)
+
+        self.assertIsNot(self.pool.acquire(), obj)
+        self.assertEqual(self.pool.stats().recycled, 1)
+
+    def test_pool_manager_releases_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with PoolManager(self.pool) as obj:
+                raise RuntimeError()
+
+        stats = self.pool.stats()
+        self.assertEqual((stats.in_use, stats.free), (0, 1))
+        self.assertIs(self.pool.acquire(), obj)
+
+
+class TestSQLitePool(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.pool = create_sqlite_pool(self.path, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        os.remove(self.path)
+
+    def test_connections_rollback_on_error(self):
+        with PoolManager(self.pool) as conn:
+            conn.execute("CREATE TABLE t (x INTEGER);")
+
+        with self.assertRaises(RuntimeError):
+            with PoolManager(self.pool) as conn:
+                conn.execute("INSERT INTO t VALUES (1);")
+                raise RuntimeError()
+
+        with PoolManager(self.pool) as conn:
+            self.assertEqual(conn.execute("SELECT * FROM t;"), [])
+
+    def test_connections_rollback_uncommitted_writes(self):
+        with PoolManager(self.pool) as conn:
+            conn.execute("CREATE TABLE t (x INTEGER);")
+            conn.commit()
+
+        with PoolManager(self.pool) as conn:
+            conn.execute("INSERT INTO t VALUES (1);")
+
+        with PoolManager(self.pool) as conn:
+            self.assertFalse(conn.conn.in_transaction)
+            self.assertEqual(conn.execute("SELECT * FROM t;"), [])
+
+    def test_connections_across_threads(self):
+        results = []
+
+        def worker():
+            with PoolManager(self.pool) as conn:
+                results.append(conn.execute("SELECT 1;"))
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [[(1,)]] * 6)
+        self.assertLessEqual(self.pool.stats().created, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
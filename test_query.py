@@ -0,0 +1,114 @@
+import unittest
+from db.db import SQLiteDBConnection
+from db.migrations import migrate
+from db.query import Query, Column
+from models.models import MODELS, User, Password
+
+
+class TestQuery(unittest.TestCase):
+    def test_projection_and_predicates(self):
+        sql, parameters = (Query(Password)
+                           .select("app_name", "app_url")
+                           .where(Column("app_name").in_(["GitHub", "GitLab"])
+                                  | (Column("password_id") >= 10), user_id=1)
+                           .order_by("-app_name")
+                           .limit(20)
+                           .build())
+
+        required_sql = "SELECT app_name, app_url FROM passwords \n\t"
+        required_sql += "WHERE (app_name IN (?, ?) OR password_id >= ?) \n\t"
+        required_sql += "AND user_id = ? \n\t"
+        required_sql += "ORDER BY app_name DESC, password_id DESC \n\t"
+        required_sql += "LIMIT ?;"
+        self.assertEqual(sql, required_sql)
+        self.assertEqual(parameters, ("GitHub", "GitLab", 10, 1, 20))
+
+    def test_null_range_and_empty_in(self):
+        sql, parameters = Query(User).where(Column("kdf_salt") == None,  # noqa: E711
+                                            Column("user_id").between(1, 5),
+                                            ~Column("email").in_([])).build()
+
+        self.assertEqual(sql, "SELECT * FROM users \n\tWHERE kdf_salt IS NULL \n\t"
+                              + "AND user_id BETWEEN ? AND ? \n\tAND NOT 0;")
+        self.assertEqual(parameters, (1, 5))
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            Query(User).select("password")
+        with self.assertRaises(ValueError):
+            Query(User).where(Column("name; DROP TABLE users") == 1)
+
+    def test_keyset(self):
+        query = Query(Password).select("password_id", "app_name").order_by("app_name")
+        self.assertEqual(query.keyset_columns, ("app_name", "password_id"))
+        self.assertEqual(query.cursor((7, "GitHub")), ("GitHub", 7))
+
+        sql, parameters = query.after(("GitHub", 7)).build()
+        self.assertIn("WHERE (app_name, password_id) > (?, ?)", sql)
+        self.assertEqual(parameters, ("GitHub", 7))
+
+        # mixed directions can't use a row value comparison
+        sql, parameters = query.order_by("-app_name", "password_id").after(("GitHub", 7)).build()
+        self.assertIn("WHERE ((app_name < ?) OR (app_name = ? AND password_id > ?))", sql)
+        self.assertEqual(parameters, ("GitHub", "GitHub", 7))
+
+        # app_url is only unique per user: the primary key breaks the ties between users
+        self.assertEqual(Query(Password).order_by("app_url").keyset_columns,
+                         ("app_url", "password_id"))
+        self.assertEqual(Query(Password).order_by("user_id", "app_url").keyset_columns,
+                         ("user_id", "app_url"))
+        self.assertEqual(Query(Password).where(user_id=1).order_by("app_url").keyset_columns,
+                         ("app_url",))
+        self.assertEqual(Query(Password).where(Column("user_id") > 1).order_by("app_url")
+                         .keyset_columns, ("app_url", "password_id"))
+
+    def test_record(self):
+        query = Query(Password).select("app_name", "app_url")
+        self.assertEqual(query.record._fields, ("app_name", "app_url"))
+        self.assertIs(query.where(user_id=1).record, query.record)
+        self.assertIs(Query(Password).record, Password.__record__)
+
+
+class TestQueryPagination(unittest.TestCase):
+    def setUp(self):
+        self.conn = SQLiteDBConnection(":memory:")
+        self.conn.connect()
+        migrate(self.conn, MODELS)
+        self.conn.execute("INSERT INTO users (name, email, hashed_pw) VALUES ('a', 'a@mail.com', 'h');")
+        self.conn.bulk_insert(Password, (
+            dict(user_id=1, app_name=f"app{i % 7}", app_url=f"https://app{i:03}.com",
+                 username=f"user{i}", password="pw") for i in range(100)))
+
+    def tearDown(self):
+        self.conn.close_connection()
+
+    def test_pages_cover_all_rows(self):
+        query = (Query(Password).select("password_id", "app_name")
+                 .where(user_id=1).order_by("-app_name").limit(15))
+        ids = []
+        page = query
+        while True:
+            rows = self.conn.execute(*page.build())
+            ids += [row[0] for row in rows]
+            if len(rows) < 15:
+                break
+            page = query.after(query.cursor(rows[-1]))
+
+        expected = self.conn.execute("SELECT password_id FROM passwords "
+                                     + "ORDER BY app_name DESC, password_id DESC;")
+        self.assertEqual(ids, [row[0] for row in expected])
+
+    def test_deep_page_is_an_index_seek(self):
+        query = (Query(Password).select("app_url", "username").where(user_id=1)
+                 .order_by("app_url").limit(10).after(("https://app090.com",)))
+        plan = " ".join(self.conn.explain_query_plan(*query.build()))
+
+        self.assertIn("SEARCH passwords USING INDEX idx_passwords_user_id_app_url "
+                      + "(user_id=? AND app_url>?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertEqual([row[0] for row in self.conn.execute(*query.build())],
+                         [f"https://app{i:03}.com" for i in range(91, 100)])
+
+
+if __name__ == "__main__":
+    unittest.main()
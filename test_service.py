@@ -0,0 +1,124 @@
+import asyncio
+import os
+import socket
+import stat
+import tempfile
+import unittest
+from unittest import mock
+from auth import aio, auth, hashing
+from auth.hashing import HashingService
+from auth.ratelimit import LoginRateLimiter
+from auth.user_cache import UserCache
+from db.aio import create_async_sqlite_pool
+from service import Server, ServiceError
+from service.client import Client
+from service.protocol import encode, decode
+
+
+class TestService(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.path = os.path.join(tmp.name, "service.sock")
+
+        self.service = HashingService(workers=4, executor="thread")
+        limiter = LoginRateLimiter(email_burst=100, client_burst=100)
+        cache = UserCache()
+        # the rehashes are scheduled by auth.auth
+        patches = [mock.patch.object(module, name, value) for module in (auth, aio)
+                   for name, value in (("get_hashing_service", lambda: self.service),
+                                       ("get_login_limiter", lambda: limiter),
+                                       ("get_user_cache", lambda: cache),
+                                       ("BCRYPT_COST", 4))]
+        patches.append(mock.patch.object(hashing, "BCRYPT_COST", 4))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.server = Server(create_async_sqlite_pool(os.path.join(tmp.name, "test.db"), 2),
+                             self.path)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.service.shutdown()
+
+    def session(self):
+        with Client(self.path) as client:
+            client.sign_up("Eduardo", "eduardo@mail.com", "secret")
+            with self.assertRaises(ServiceError):
+                client.sign_up("Eduardo", "eduardo@mail.com", "secret")
+
+            user = client.login("eduardo@mail.com", "secret")
+            self.assertEqual(user["email"], "eduardo@mail.com")
+            client.add_password("GitHub", "https://github.com", "eduardo", "pw1")
+            client.add_password("GitLab", "https://gitlab.com", "edu", "pw2")
+
+            entries, cursor = client.list_passwords(limit=1)
+            self.assertEqual((entries[0]["app_name"], entries[0]["password"]), ("GitHub", "pw1"))
+            entries, cursor = client.list_passwords(cursor, limit=1)
+            self.assertEqual(entries[0]["app_name"], "GitLab")
+            self.assertEqual([e["app_name"] for e in client.search("gitl")], ["GitLab"])
+            self.assertEqual(client.lookup("https://gitlab.com")[0]["username"], "edu")
+
+            client.logout()
+            with self.assertRaisesRegex(ServiceError, "log in again"):
+                client.lookup("https://gitlab.com")
+
+    async def test_session(self):
+        await asyncio.to_thread(self.session)
+
+    async def test_concurrent_clients(self):
+        async def sign_up_and_login(i):
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            # both requests are sent at once, the ids match the responses
+            writer.write(encode(dict(id=1, op="sign_up", name=f"User {i}",
+                                     email=f"user{i}@mail.com", password="secret")))
+            writer.write(encode(dict(id=2, op="login", email=f"user{i}@mail.com",
+                                     password="wrong")))
+            responses = {}
+            for _ in range(2):
+                response = decode(await reader.readline())
+                responses[response["id"]] = response
+            writer.close()
+            return responses
+
+        results = await asyncio.gather(*(sign_up_and_login(i) for i in range(20)))
+
+        self.assertTrue(all(r[1]["ok"] for r in results))
+        self.assertTrue(all(not r[2]["ok"] for r in results))
+
+    async def test_socket(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        # the socket of a running server is kept
+        other = Server(create_async_sqlite_pool(os.path.join(self.dir, "test.db"), 1), self.path)
+        with self.assertRaisesRegex(OSError, "already listening"):
+            await other.start()
+        await other.pool.close()
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        writer.write(encode(dict(id=1, op="logout", token="unknown")))
+        self.assertTrue(decode(await reader.readline())["ok"])
+        writer.close()
+
+        # the socket left by a server that didn't shut down is replaced
+        stale = os.path.join(self.dir, "stale.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(stale)
+        other = Server(create_async_sqlite_pool(os.path.join(self.dir, "test.db"), 1), stale)
+        await other.start()
+        await other.close()
+        self.assertFalse(os.path.exists(stale))
+
+    async def test_invalid_requests(self):
+        response = await self.server.handle(b"not json")
+        self.assertEqual(response, dict(id=None, ok=False, error="Invalid request: not JSON"))
+        response = await self.server.handle(encode(dict(id=3, op="drop")))
+        self.assertEqual((response["id"], response["ok"]), (3, False))
+        response = await self.server.handle(encode(dict(id=4, op="login")))
+        self.assertEqual(response["error"], "Invalid request: missing argument 'email'")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from config import STARTUP_BUDGET_MS
+from startup import parse_import_times, profile_startup
+
+
+class TestStartup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.profile = profile_startup()
+
+    def test_lazy_imports(self):
+        # loaded by the first login, sign up or vault menu, not before the first prompt
+        for module in ("bcrypt", "cryptography", "asyncio", "argparse", "password.password",
+                       "auth.aio", "db.aio", "service"):
+            self.assertNotIn(module, self.profile.modules)
+
+    def test_budget(self):
+        self.assertLessEqual(self.profile.first_prompt, STARTUP_BUDGET_MS, self.profile.report())
+
+    def test_parse_import_times(self):
+        output = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       100 |        100 |   db.query\n"
+                  "import time:      1500 |       1600 | db\n"
+                  "unrelated line\n")
+        self.assertEqual(parse_import_times(output), ({"db": 1.6}, ["db.query", "db"]))
+
+
+if __name__ == "__main__":
+    unittest.main()